@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+''' Builds .tex files and Setzer sessions (.stzs) without opening a
+    window, the way the editor would build them, and writes a JSON report
+    with the log items, LaTeX passes and job times of every document.
+
+    Exits with 1 if a document didn't build or has errors, for use in CI.
+
+    Run from the source folder: ./scripts/batch_build.py --help '''
+
+import sys
+import os.path
+import argparse
+import json
+
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import setzer.document.build_system.batch_build as batch_build
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Build LaTeX documents and Setzer sessions without a window.')
+    argument_parser.add_argument('filenames', nargs='+', metavar='file', help='.tex file or .stzs session')
+    argument_parser.add_argument('--workers', type=int, default=2, help='documents built at the same time (default 2)')
+    argument_parser.add_argument('--interpreter', choices=['xelatex', 'pdflatex', 'lualatex'], default='xelatex')
+    argument_parser.add_argument('--latexmk', action='store_true', help='build with latexmk')
+    argument_parser.add_argument('--system-commands', choices=['disable', 'restricted', 'enable'], default='disable', help='allow \\write18 (default disable)')
+    argument_parser.add_argument('--keep-build-files', action='store_true', help="don't remove .aux, .log, ... after building")
+    argument_parser.add_argument('--precompiled-preamble', action='store_true', help='precompile preambles with mylatexformat')
+    argument_parser.add_argument('--report', metavar='file', help='write the report here instead of to stdout')
+    arguments = argument_parser.parse_args()
+
+    options = {'latex_interpreter': arguments.interpreter,
+               'use_latexmk': arguments.latexmk,
+               'build_option_system_commands': arguments.system_commands,
+               'do_cleanup': not arguments.keep_build_files,
+               'use_precompiled_preamble': arguments.precompiled_preamble}
+    report = batch_build.BatchBuild(max(arguments.workers, 1), options).build(arguments.filenames)
+
+    if arguments.report != None:
+        with open(arguments.report, 'w') as filehandle:
+            json.dump(report, filehandle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    for document in report['documents']:
+        if document['success']:
+            status = 'ok'
+        elif document['error'] != None:
+            status = 'failed: ' + document['error'] + ('' if document['error_arg'] == None else ' (' + document['error_arg'] + ')')
+        else:
+            status = 'failed'
+        sys.stderr.write('{}: {}, {} errors, {} warnings, {} passes, {:.2f}s\n'.format(document['tex_filename'], status, document['error_count'], document['warning_count'], document['latex_passes'], document['seconds']))
+    sys.stderr.write('{} built, {} failed in {:.2f}s\n'.format(report['succeeded'], report['failed'], report['seconds']))
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+''' Benchmark and regression check for the document parsers.
+
+    Drives ParserLaTeX and ParserBibTeX with a stand-in for the source
+    buffer, so it runs without Gtk. Replays keystroke, paste, delete and
+    batched traces on synthetic documents and reports per edit latency
+    percentiles (and optionally allocations). After each trace the
+    parser state, including the fields of BibTeX entries, is compared to
+    a parser that saw the final text in one piece.
+
+    Exits with 1 if a parser state differs; meson test runs it on small
+    documents. Run from the source folder: ./scripts/benchmark_parser.py --help '''
+
+import sys
+import os.path
+import argparse
+import bisect
+import random
+import re
+import time
+import tracemalloc
+
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import setzer.document.content.parser.parser_latex as parser_latex
+import setzer.document.content.parser.parser_bibtex as parser_bibtex
+
+
+class TextIter(object):
+
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.offset = offset
+
+    def get_offset(self):
+        return self.offset
+
+    def get_line(self):
+        return bisect.bisect_right(self.buffer.line_starts, self.offset) - 1
+
+    def backward_char(self):
+        self.offset = max(0, self.offset - 1)
+
+
+class Buffer(object):
+    ''' Just what the parsers use of a Gtk.TextBuffer. '''
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.text = ''
+        self.line_starts = [0]
+
+    def get_char_count(self):
+        return len(self.text)
+
+    def get_line_count(self):
+        return len(self.line_starts)
+
+    def get_iter_at_line(self, line_number):
+        if line_number >= len(self.line_starts):
+            return TextIter(self, len(self.text))
+        return TextIter(self, self.line_starts[line_number])
+
+    def get_iter_at_offset(self, offset):
+        return TextIter(self, offset)
+
+    def get_end_iter(self):
+        return TextIter(self, len(self.text))
+
+    def get_text(self, start_iter, end_iter, include_hidden_chars):
+        return self.text[start_iter.offset:end_iter.offset]
+
+    def insert(self, offset, text, flush=True):
+        ''' Returns the time spent in the parser. Without flush the edit
+            stays pending in the parser, like several edits in a row do
+            before Setzer's parser catches up. '''
+
+        time_start = time.perf_counter()
+        self.parser.on_text_inserted(self, TextIter(self, offset), text, len(text.encode('utf-8')))
+        duration = time.perf_counter() - time_start
+
+        self.text = self.text[:offset] + text + self.text[offset:]
+        self.update_line_starts(offset, offset, len(text))
+
+        time_start = time.perf_counter()
+        self.parser.on_buffer_changed(self)
+        if flush:
+            self.parser.flush_pending_edits()
+        return duration + time.perf_counter() - time_start
+
+    def delete(self, offset_start, offset_end, flush=True):
+        time_start = time.perf_counter()
+        self.parser.on_text_deleted(self, TextIter(self, offset_start), TextIter(self, offset_end))
+        duration = time.perf_counter() - time_start
+
+        self.text = self.text[:offset_start] + self.text[offset_end:]
+        self.update_line_starts(offset_start, offset_end, 0)
+
+        time_start = time.perf_counter()
+        self.parser.on_buffer_changed(self)
+        if flush:
+            self.parser.flush_pending_edits()
+        return duration + time.perf_counter() - time_start
+
+    def flush(self):
+        time_start = time.perf_counter()
+        self.parser.flush_pending_edits()
+        return time.perf_counter() - time_start
+
+    def update_line_starts(self, offset_start, offset_end, length):
+        line_first = bisect.bisect_right(self.line_starts, offset_start)
+        line_last = bisect.bisect_right(self.line_starts, offset_end)
+        new_line_starts = list()
+        position = self.text.find('\n', offset_start, offset_start + length)
+        while position >= 0:
+            new_line_starts.append(position + 1)
+            position = self.text.find('\n', position + 1, offset_start + length)
+        delta = length - (offset_end - offset_start)
+        self.line_starts[line_first:] = new_line_starts + [offset + delta for offset in self.line_starts[line_last:]]
+
+
+class Content(object):
+    ''' Just what the parsers use of Content. '''
+
+    def __init__(self):
+        self.symbols = dict()
+        self.symbols['bibitems'] = set()
+        self.symbols['labels'] = set()
+        self.symbols['included_latex_files'] = set()
+        self.symbols['bibliographies'] = set()
+        self.symbols['packages'] = set()
+        self.symbols['packages_detailed'] = dict()
+        self.symbols['blocks'] = list()
+        self.source_buffer = None
+
+    def add_change_code(self, change_code, parameter=None):
+        pass
+
+
+def create_parser(language):
+    content = Content()
+    if language == 'latex':
+        parser = parser_latex.ParserLaTeX(content)
+    else:
+        parser = parser_bibtex.ParserBibTeX(content)
+    buffer = Buffer(parser)
+    content.source_buffer = buffer
+    return (content, parser, buffer)
+
+
+def generate_latex(number_of_lines, rng):
+    lines = ['\\documentclass{article}', '\\usepackage{amsmath}', '\\usepackage{graphicx}', '\\begin{document}']
+    label_count = 0
+    while len(lines) < number_of_lines - 1:
+        choice = rng.random()
+        if choice < 0.02:
+            lines.append('\\section{Section ' + str(len(lines)) + '}')
+        elif choice < 0.06:
+            lines.append('\\subsection{Subsection ' + str(len(lines)) + '}')
+        elif choice < 0.12:
+            lines += ['\\begin{itemize}', '    \\item first', '    \\item second \\label{item' + str(label_count) + '}', '\\end{itemize}']
+            label_count += 1
+        elif choice < 0.16:
+            lines += ['\\begin{equation}', '    a^2 + b^2 = c^2 \\label{eq' + str(label_count) + '}', '\\end{equation}']
+            label_count += 1
+        elif choice < 0.18:
+            lines += ['\\begin{figure}', '    \\begin{center}', '        \\includegraphics{image.png}', '    \\end{center}', '\\end{figure}']
+        else:
+            lines.append('Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt.')
+    lines.append('\\end{document}')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_bibtex(number_of_lines, rng):
+    lines = list()
+    while len(lines) < number_of_lines:
+        key = 'key' + str(len(lines))
+        lines += ['@article{' + key + ',', '    author = {Doe, John and Roe, Jane},', '    title = {On the {T}itle of ' + key + '},', '    journal = {Journal},', '    year = ' + str(rng.randint(1950, 2020)) + ',', '}', '']
+    return '\n'.join(lines) + '\n'
+
+
+def trace_keystrokes(buffer, rng, language, count):
+    ''' Typing at a few places, with backspace now and then. '''
+
+    if language == 'latex':
+        snippets = ['Some more words. ', '\\label{new}', '\\begin{center}', '\\end{center}', '\\section{New}', '\n']
+    else:
+        snippets = ['note = {typed},', '@misc{typed,', '}', '\n']
+    durations = list()
+    while len(durations) < count:
+        offset = rng.randint(0, buffer.get_char_count())
+        for char in rng.choice(snippets):
+            durations.append(buffer.insert(offset, char))
+            offset += 1
+            if rng.random() < 0.05:
+                durations.append(buffer.delete(offset - 1, offset))
+                offset -= 1
+    return durations
+
+
+def trace_paste(buffer, rng, language, count):
+    durations = list()
+    for i in range(count):
+        start = rng.randint(0, buffer.get_char_count())
+        end = min(buffer.get_char_count(), start + rng.randint(100, 5000))
+        text = buffer.text[start:end]
+        durations.append(buffer.insert(rng.randint(0, buffer.get_char_count()), text))
+    return durations
+
+
+def trace_delete(buffer, rng, language, count):
+    durations = list()
+    for i in range(count):
+        if buffer.get_char_count() == 0: break
+        start = rng.randint(0, buffer.get_char_count())
+        end = min(buffer.get_char_count(), start + rng.choice([1, 1, 1, 20, 200, 2000]))
+        durations.append(buffer.delete(start, end))
+    return durations
+
+
+def trace_batched(buffer, rng, language, count, batch_size=20):
+    ''' Keystrokes, deletions and pastes at different places, batch_size
+        of them before the parser catches up. Each duration covers a batch.
+        After every tenth batch of BibTeX the entries are looked up before
+        the parser caught up, their fields have to come from the current
+        text. '''
+
+    if language == 'latex':
+        snippets = ['x', '\\', '{', '}', '\n', '\\label{batch}', '\\begin{itemize}', '\\end{itemize}', '\\section{Batch}', '\\usepackage{tikz}']
+    else:
+        snippets = ['x', '{', '}', '\n', '@misc{batch,', 'note = {batched},']
+    durations = list()
+    for i in range(count):
+        duration = 0
+        for j in range(batch_size):
+            choice = rng.random()
+            if choice < 0.6 or buffer.get_char_count() == 0:
+                duration += buffer.insert(rng.randint(0, buffer.get_char_count()), rng.choice(snippets), flush=False)
+            elif choice < 0.9:
+                start = rng.randint(0, buffer.get_char_count())
+                end = min(buffer.get_char_count(), start + rng.choice([1, 1, 5, 50]))
+                duration += buffer.delete(start, end, flush=False)
+            else:
+                start = rng.randint(0, buffer.get_char_count())
+                end = min(buffer.get_char_count(), start + rng.randint(10, 500))
+                duration += buffer.insert(rng.randint(0, buffer.get_char_count()), buffer.text[start:end], flush=False)
+        if language == 'bibtex' and i % 10 == 0:
+            look_up_entries(buffer)
+        durations.append(duration + buffer.flush())
+    return durations
+
+
+def look_up_entries(buffer):
+    for key in list(buffer.parser.get_entry_keys()):
+        buffer.parser.get_entry(key)
+
+
+def get_state(content, parser, language):
+    if language == 'latex':
+        blocks = sorted(parser.get_keyed_blocks().values())
+        symbols = {name: set(content.symbols[name]) for name in ['labels', 'included_latex_files', 'bibliographies', 'bibitems', 'packages']}
+        packages = sorted((name, parser.get_symbol_offset(match)) for name, match in content.symbols['packages_detailed'].items())
+        return (blocks, symbols, packages)
+    else:
+        entries = list()
+        fields = list()
+        for key in sorted(parser.get_entry_keys()):
+            entry = parser.get_entry(key)
+            entries.append((key, entry['offset'], entry['type']))
+            fields.append((key, sorted(entry['fields'].items())))
+        return (entries, set(content.symbols['bibitems']), fields)
+
+
+def get_reference_state(text, language):
+    ''' The state of get_state() with plain regexes over the whole text and
+        the block rules of the parser before it was incremental, so it
+        doesn't share code with the parser. Without the fields of BibTeX
+        entries, these are only compared with a full parse. '''
+
+    if language == 'bibtex':
+        entries = dict()
+        for match in re.finditer(r'@(\w+)\{(\w+)', text):
+            entries[match.group(2).strip()] = (match.start(), match.group(1).lower())
+        return ([(key, offset, entry_type) for key, (offset, entry_type) in sorted(entries.items())], set(entries))
+
+    symbols = {name: set() for name in ['labels', 'included_latex_files', 'bibliographies', 'bibitems', 'packages']}
+    packages = dict()
+    for match in re.finditer(r'\\(label|include|input|bibliography|addbibresource)\{((?:\s|\w|\:|\.|,)*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}', text):
+        if match.group(1) == 'label':
+            symbols['labels'].add(match.group(2).strip())
+        elif match.group(1) in ['include', 'input']:
+            filename = match.group(2).strip()
+            symbols['included_latex_files'].add(filename if filename.endswith('.tex') else filename + '.tex')
+        elif match.group(1) == 'bibliography':
+            symbols['bibliographies'] |= {entry.strip() + '.bib' for entry in match.group(2).strip().split(',')}
+        elif match.group(1) == 'addbibresource':
+            symbols['bibliographies'] |= {entry.strip() for entry in match.group(2).strip().split(',')}
+        elif match.group(3) == 'usepackage':
+            symbols['packages'].add(match.group(4).strip())
+            packages[match.group(4).strip()] = match.start()
+        elif match.group(5) == 'bibitem':
+            symbols['bibitems'].add(match.group(6).strip())
+
+    return (get_reference_blocks(text), symbols, sorted(packages.items()))
+
+
+def get_reference_blocks(text):
+    text_length = len(text)
+
+    # the parser counts line breaks, i.e. it's the number of the last line
+    number_of_lines = text.count('\n')
+    begin_or_end = list()
+    others = list()
+    line_number = 0
+    for match in re.finditer(r'\n|\\(begin|end)\{((?:\w|•|\*)+)\}|\\(part|chapter|section|subsection|subsubsection)(?:\*){0,1}\{', text):
+        if match.group(1) != None:
+            begin_or_end.append((match, line_number, match.start()))
+        elif match.group(3) != None:
+            others.append((match, line_number, match.start()))
+        elif match.group(0) == '\n':
+            line_number += 1
+
+    open_blocks = dict()
+    blocks = list()
+    has_preamble = True
+    begin_document = None
+    end_document = None
+    for match, line_number, offset in begin_or_end:
+        if line_number == 0:
+            has_preamble = False
+        if match.group(1) == 'begin':
+            if match.group(2) == 'document':
+                begin_document = (offset, line_number)
+            open_blocks.setdefault(match.group(2), list()).append([offset, None, line_number, None])
+        else:
+            if match.group(2) == 'document':
+                end_document = (offset, line_number)
+            if len(open_blocks.get(match.group(2), list())) > 0:
+                block = open_blocks[match.group(2)].pop()
+                block[1], block[3] = offset, line_number
+                blocks.append(block)
+
+    following_blocks = [list() for level in range(5)]
+    levels = {'part': 0, 'chapter': 1, 'section': 2, 'subsection': 3, 'subsubsection': 4}
+    for match, line_number, offset in reversed(others):
+        if line_number == 0:
+            has_preamble = False
+        level = levels[match.group(3)]
+        if len(following_blocks[level]) > 0:
+            block = [offset, following_blocks[level][-1][0] - 1, line_number, following_blocks[level][-1][2] - 1]
+        elif end_document != None and offset < end_document[0]:
+            block = [offset, end_document[0] - 1, line_number, end_document[1] - 1]
+        else:
+            block = [offset, text_length, line_number, number_of_lines]
+        blocks.append(block)
+        for i in range(level, 5):
+            following_blocks[i].append(block)
+
+    if has_preamble and begin_document != None and begin_document[0] > 0 and begin_document[1] > 0:
+        blocks.append([0, begin_document[0] - 1, 0, begin_document[1] - 1])
+    return sorted(blocks)
+
+
+def check_equivalence(content, parser, buffer, language):
+    ''' None if the parser state is right, otherwise what it differs from:
+        a parser that saw the final text in one piece, or the reference. '''
+
+    state = get_state(content, parser, language)
+    content_full, parser_full, buffer_full = create_parser(language)
+    buffer_full.insert(0, buffer.text)
+    if state != get_state(content_full, parser_full, language):
+        return 'full parse'
+    reference_state = get_reference_state(buffer.text, language)
+    if state[:len(reference_state)] != reference_state:
+        return 'reference'
+    return None
+
+
+def get_percentile(sorted_values, percentile):
+    if len(sorted_values) == 0: return 0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(language, number_of_lines, trace_name, trace, args):
+    rng = random.Random(args.seed)
+    generate = generate_latex if language == 'latex' else generate_bibtex
+    text = generate(number_of_lines, rng)
+    content, parser, buffer = create_parser(language)
+    load_duration = buffer.insert(0, text)
+
+    if args.allocations:
+        tracemalloc.start()
+    durations = trace(buffer, rng, language, args.edits)
+    if args.allocations:
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    durations.sort()
+    result = '{:8} {:>7} {:10} load {:8.1f} ms  edits {:5}  p50 {:7.3f}  p90 {:7.3f}  p99 {:7.3f}  max {:7.3f} ms'.format(language, number_of_lines, trace_name, load_duration * 1000, len(durations), *[get_percentile(durations, percentile) * 1000 for percentile in [50, 90, 99, 100]])
+    if args.allocations:
+        result += '  retained {:.1f} kB  peak {:.1f} kB'.format(size / 1024, peak / 1024)
+    if not args.no_check:
+        mismatch = check_equivalence(content, parser, buffer, language)
+        equivalent = (mismatch == None)
+        result += '  ' + ('ok' if equivalent else 'MISMATCH (' + mismatch + ')')
+    else:
+        equivalent = True
+    print(result)
+    return equivalent
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark the LaTeX and BibTeX parsers on synthetic documents.')
+    argument_parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated document sizes in lines')
+    argument_parser.add_argument('--languages', default='latex,bibtex', help='comma separated, latex and / or bibtex')
+    argument_parser.add_argument('--traces', default='keystrokes,paste,delete,batched', help='comma separated, keystrokes, paste, delete and / or batched')
+    argument_parser.add_argument('--edits', type=int, default=500, help='number of edits per trace')
+    argument_parser.add_argument('--seed', type=int, default=1)
+    argument_parser.add_argument('--allocations', action='store_true', help='trace allocations (slows down edits)')
+    argument_parser.add_argument('--no-check', action='store_true', help='don\'t compare with a full parse')
+    args = argument_parser.parse_args()
+
+    traces = {'keystrokes': trace_keystrokes, 'paste': trace_paste, 'delete': trace_delete, 'batched': trace_batched}
+    all_equivalent = True
+    for language in args.languages.split(','):
+        for number_of_lines in [int(size) for size in args.sizes.split(',')]:
+            for trace_name in args.traces.split(','):
+                all_equivalent = run(language, number_of_lines, trace_name, traces[trace_name], args) and all_equivalent
+    return 0 if all_equivalent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
@@ -17,7 +17,6 @@
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import GObject
 
 import os.path
 import re
@@ -25,16 +24,18 @@ import time
 import xml.etree.ElementTree as ET
 
 import setzer.helpers.timer as timer
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class AutocompleteProvider(object):
 
-    def __init__(self, resources_path, workspace, latex_parser_regex, bibtex_parser_regex, packages_dict):
+    def __init__(self, resources_path, workspace, latex_parser_regex, bibtex_parser_regex, packages_dict, parse_cache):
         self.workspace = workspace
         self.resources_path = resources_path
         self.latex_parser_regex = latex_parser_regex
         self.bibtex_parser_regex = bibtex_parser_regex
         self.packages_dict = packages_dict
+        self.parse_cache = parse_cache
 
         self.static_proposals = dict()
         self.static_begin_end_proposals = dict()
@@ -68,11 +69,50 @@ class AutocompleteProvider(object):
         self.last_command = None
         self.last_dynamic_proposals = list()
 
+        # labels and bibitems of all documents, until a document's symbols change
+        self.dynamic_labels = dict()
+
+        for document in self.workspace.open_documents:
+            document.content.connect('symbols_changed', self.on_symbols_changed)
+        self.workspace.connect('new_document', self.on_new_document)
+        self.workspace.connect('document_removed', self.on_document_removed)
+        self.workspace.connect('new_active_document', self.on_new_active_document)
+
         self.generate_dynamic_word_beginnings()
         self.generate_static_proposals()
         self.generate_static_begin_end_proposals()
         self.parse_included_files()
-        GObject.timeout_add(2000, self.parse_included_files)
+        main_loop_monitor.timeout_add(2000, self.parse_included_files)
+
+    def on_new_document(self, workspace, document):
+        document.content.connect('symbols_changed', self.on_symbols_changed)
+        self.invalidate_dynamic_labels(['labels', 'bibitems'])
+
+    def on_document_removed(self, workspace, document):
+        document.content.disconnect('symbols_changed', self.on_symbols_changed)
+        self.invalidate_dynamic_labels(['labels', 'bibitems'])
+
+    def on_new_active_document(self, workspace, document):
+        self.invalidate_dynamic_labels(['labels', 'bibitems'])
+
+    def on_symbols_changed(self, content, symbols_changed):
+        if 'included_latex_files' in symbols_changed or 'bibliographies' in symbols_changed:
+            self.invalidate_dynamic_labels(['labels', 'bibitems'])
+        else:
+            self.invalidate_dynamic_labels([symbol_type for symbol_type in ['labels', 'bibitems'] if symbol_type in symbols_changed])
+
+    def update_symbols(self):
+        ''' Edits not parsed yet publish their symbols_changed now, so the
+            cached labels don't miss one that was just typed. '''
+
+        for document in self.workspace.open_documents:
+            document.content.update_symbols()
+
+    def invalidate_dynamic_labels(self, symbol_types):
+        for symbol_type in symbol_types:
+            if symbol_type in self.dynamic_labels:
+                del(self.dynamic_labels[symbol_type])
+                self.last_command = None
 
     def get_items_for_completion_window(self, current_word, last_tabbed_command):
         items = list()
@@ -109,7 +149,7 @@ class AutocompleteProvider(object):
                     items.append(item)
         return items
 
-    #@timer.timer
+    @timer.timer
     def get_items(self, word):
         items = list()
         try: static_items = self.static_proposals[word.lower()]
@@ -184,8 +224,12 @@ class AutocompleteProvider(object):
                     dynamic_items.append(command)
         return dynamic_items
 
-    #@timer.timer
+    @timer.timer
     def get_bibitems_for_dynamic_items(self):
+        self.update_symbols()
+        try: return self.dynamic_labels['bibitems']
+        except KeyError: pass
+
         bibitems_first = set()
         bibitems_second = set()
         bibitems_rest = set()
@@ -223,9 +267,14 @@ class AutocompleteProvider(object):
                             bibitems_rest = bibitems_rest | document_object.content.get_bibitems()
 
         bibitems = ['•'] + list(bibitems_first) + list(bibitems_second) + list(bibitems_rest)
+        self.dynamic_labels['bibitems'] = bibitems
         return bibitems
 
     def get_labels_for_dynamic_items(self):
+        self.update_symbols()
+        try: return self.dynamic_labels['labels']
+        except KeyError: pass
+
         labels_first = set()
         labels_second = set()
         labels_rest = set()
@@ -263,6 +312,7 @@ class AutocompleteProvider(object):
                             labels_rest = labels_rest | document_object.content.get_labels()
 
         labels = ['•'] + list(labels_first) + list(labels_second) + list(labels_rest)
+        self.dynamic_labels['labels'] = labels
         return labels
 
     def append_to_dynamic_items(self, word, items, ref_type, labels, parlabel):
@@ -281,6 +331,7 @@ class AutocompleteProvider(object):
                     items.append(command)
 
     def parse_included_files(self):
+        has_changed = False
         current_includes = set()
         open_docs_pathnames = self.workspace.get_open_documents_filenames()
         for document in self.workspace.open_latex_documents:
@@ -290,22 +341,29 @@ class AutocompleteProvider(object):
                     if os.path.isfile(pathname):
                         if pathname not in self.included_files_labels:
                             self.included_files_labels[pathname] = self.parse_bibtex_file(pathname)
+                            has_changed = True
                         else:
                             last_parse_time = self.included_files_labels[pathname]['last_parse_time']
                             if last_parse_time < os.path.getmtime(pathname):
                                 self.included_files_labels[pathname] = self.parse_bibtex_file(pathname)
+                                has_changed = True
             for pathname in self.get_included_latex_files(document):
                 if pathname not in open_docs_pathnames:
                     if os.path.isfile(pathname):
                         if pathname not in self.included_files_labels:
                             self.included_files_labels[pathname] = self.parse_latex_file(pathname)
+                            has_changed = True
                         else:
                             last_parse_time = self.included_files_labels[pathname]['last_parse_time']
                             if last_parse_time < os.path.getmtime(pathname):
                                 self.included_files_labels[pathname] = self.parse_latex_file(pathname)
+                                has_changed = True
         for pathname in list(self.included_files_labels):
             if pathname not in current_includes or pathname in open_docs_pathnames:
                 del(self.included_files_labels[pathname])
+                has_changed = True
+        if has_changed:
+            self.invalidate_dynamic_labels(['labels', 'bibitems'])
         return True
 
     def get_included_files(self, document):
@@ -332,22 +390,30 @@ class AutocompleteProvider(object):
     def parse_latex_file(self, pathname):
         with open(pathname, 'r') as f:
             text = f.read()
-        labels = set()
-        bibitems = set()
-        for match in self.latex_parser_regex.finditer(text):
-            if match.group(1) == 'label':
-                labels = labels | {match.group(2).strip()}
-            elif match.group(5) == 'bibitem':
-                bibitems = bibitems | {match.group(6).strip()}
-        return {'last_parse_time': time.time(), 'labels': {'labels': labels, 'bibitems': bibitems}}
+        labels_dict = self.parse_cache.get('autocomplete_latex', text)
+        if labels_dict == None:
+            labels = set()
+            bibitems = set()
+            for match in self.latex_parser_regex.finditer(text):
+                if match.group(1) == 'label':
+                    labels = labels | {match.group(2).strip()}
+                elif match.group(5) == 'bibitem':
+                    bibitems = bibitems | {match.group(6).strip()}
+            labels_dict = {'labels': labels, 'bibitems': bibitems}
+            self.parse_cache.set('autocomplete_latex', text, labels_dict)
+        return {'last_parse_time': time.time(), 'labels': labels_dict}
 
     def parse_bibtex_file(self, pathname):
         with open(pathname, 'r') as f:
             text = f.read()
-        bibitems = set()
-        for match in self.bibtex_parser_regex.finditer(text):
-            bibitems = bibitems | {match.group(2).strip()}
-        return {'last_parse_time': time.time(), 'labels': {'bibitems': bibitems}}
+        labels_dict = self.parse_cache.get('autocomplete_bibtex', text)
+        if labels_dict == None:
+            bibitems = set()
+            for match in self.bibtex_parser_regex.finditer(text):
+                bibitems = bibitems | {match.group(2).strip()}
+            labels_dict = {'bibitems': bibitems}
+            self.parse_cache.set('autocomplete_bibtex', text, labels_dict)
+        return {'last_parse_time': time.time(), 'labels': labels_dict}
 
     def generate_dynamic_word_beginnings(self):
         self.dynamic_word_beginnings = dict()
@@ -369,7 +435,7 @@ class AutocompleteProvider(object):
                 except KeyError:
                     self.static_begin_end_proposals[command['command'][0:i].lower()] = [command]
 
-    #@timer.timer
+    @timer.timer
     def generate_static_proposals(self):
         commands = self.get_commands()
         self.static_proposals = dict()
@@ -390,7 +456,7 @@ class AutocompleteProvider(object):
                     except KeyError:
                         self.static_proposals[command['command'][0:i].lower()] = [command]
 
-    #@timer.timer
+    @timer.timer
     def get_commands(self):
         commands = dict()
         for filename in ['additional.xml', 'latex-document.xml', 'tex.xml', 'textcomp.xml', 'graphicx.xml', 'latex-dev.xml', 'amsmath.xml', 'amsopn.xml', 'amsbsy.xml', 'amsfonts.xml', 'amssymb.xml', 'amsthm.xml', 'color.xml', 'url.xml', 'geometry.xml', 'glossaries.xml']:
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import _thread as thread
+import threading
+import itertools
+import time
+import traceback
+
+
+class BuildScheduler(object):
+    ''' Runs build jobs of all documents on a fixed number of worker
+        threads.
+
+        Jobs carry a key (the root file) and a priority, lower runs first.
+        Only one job per key runs at a time, and a job replaces a job with
+        the same key that is still waiting, as a newer build makes an older
+        one pointless. '''
+
+    PRIORITY_SYNC = 0
+    PRIORITY_BUILD = 1
+    PRIORITY_BACKGROUND = 2
+
+    def __init__(self, number_of_workers=2):
+        self.number_of_workers = number_of_workers
+        self.number_of_running_workers = 0
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+
+        # [priority, sequence, key, function, args, time_added]
+        self.waiting_jobs = list()
+        self.running_keys = set()
+
+        self.jobs_started = 0
+        self.jobs_dropped = 0
+        self.total_wait_time = 0
+        self.max_wait_time = 0
+
+    def add_job(self, key, priority, function, *args):
+        with self.condition:
+            for job in self.waiting_jobs:
+                if job[2] == key:
+                    self.waiting_jobs.remove(job)
+                    self.jobs_dropped += 1
+                    break
+            self.waiting_jobs.append([priority, next(self.sequence), key, function, args, time.time()])
+
+            # workers are started when they are needed
+            if self.number_of_running_workers < self.number_of_workers:
+                self.number_of_running_workers += 1
+                thread.start_new_thread(self.worker_loop, ())
+            self.condition.notify()
+
+    def get_next_job(self):
+        next_job = None
+        for job in self.waiting_jobs:
+            if job[2] not in self.running_keys:
+                if next_job == None or job[:2] < next_job[:2]:
+                    next_job = job
+        return next_job
+
+    def worker_loop(self):
+        while True:
+            with self.condition:
+                job = self.get_next_job()
+                while job == None:
+                    self.condition.wait()
+                    job = self.get_next_job()
+                self.waiting_jobs.remove(job)
+                self.running_keys.add(job[2])
+
+                wait_time = time.time() - job[5]
+                self.jobs_started += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+            # a job that fails must not take its worker with it
+            try:
+                job[3](*job[4])
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.running_keys.discard(job[2])
+                    self.condition.notify_all()
+
+    def get_queue_depth(self):
+        with self.condition:
+            return len(self.waiting_jobs)
+
+    def get_stats(self):
+        with self.condition:
+            mean_wait_time = self.total_wait_time / self.jobs_started if self.jobs_started > 0 else 0
+            return {'queue_depth': len(self.waiting_jobs),
+                    'running': len(self.running_keys),
+                    'started': self.jobs_started,
+                    'dropped': self.jobs_dropped,
+                    'mean_wait_ms': mean_wait_time * 1000,
+                    'max_wait_ms': self.max_wait_time * 1000}
+
+
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os, os.path
+import hashlib
+import pickle
+
+
+class ParseCache(object):
+    ''' Parser results on disk, keyed by a hash of the text they were made
+        from. Reading an entry touches its file, when the cache grows
+        beyond size_limit (bytes) the least recently used entries go. '''
+
+    def __init__(self, pathname, size_limit=64 * 1024 * 1024):
+        self.pathname = pathname
+        self.size_limit = size_limit
+
+    def get_filename(self, kind, text):
+        key = hashlib.sha1((kind + '\0' + text).encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.pathname, key + '.pickle')
+
+    def get(self, kind, text):
+        ''' kind separates parsers (and their versions) using the same text. '''
+
+        filename = self.get_filename(kind, text)
+        try: filehandle = open(filename, 'rb')
+        except IOError: return None
+        with filehandle:
+            try: data = pickle.load(filehandle)
+            except Exception: return None
+        try: os.utime(filename)
+        except OSError: pass
+        return data
+
+    def set(self, kind, text, data):
+        if not os.path.isdir(self.pathname):
+            try: os.makedirs(self.pathname)
+            except OSError: return
+
+        filename = self.get_filename(kind, text)
+        try:
+            with open(filename + '.tmp', 'wb') as filehandle:
+                pickle.dump(data, filehandle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(filename + '.tmp', filename)
+        except (IOError, OSError, pickle.PicklingError):
+            return
+        self.evict()
+
+    def evict(self):
+        entries = list()
+        total_size = 0
+        for name in os.listdir(self.pathname):
+            filename = os.path.join(self.pathname, name)
+            try: stat = os.stat(filename)
+            except OSError: continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            total_size += stat.st_size
+
+        for mtime, size, filename in sorted(entries):
+            if total_size <= self.size_limit: break
+            try: os.remove(filename)
+            except OSError: continue
+            total_size -= size
+
+
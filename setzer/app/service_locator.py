@@ -28,6 +28,9 @@ import setzer.app.settings as settingscontroller
 import setzer.app.autocomplete_provider.autocomplete_provider as autocomplete_provider
 import setzer.app.color_manager as color_manager
 import setzer.app.font_manager as font_manager
+import setzer.app.parse_cache as parse_cache
+import setzer.app.build_scheduler as build_scheduler
+import setzer.document.build_system.synctex_reader as synctex_reader
 import setzer.helpers.popover_menu_builder as popover_menu_builder
 
 
@@ -47,6 +50,9 @@ class ServiceLocator(object):
     source_style_scheme_manager = None
     color_manager = None
     font_manager = None
+    parse_cache = None
+    build_scheduler = None
+    synctex_reader = None
 
     def init_main_window(main_window):
         ServiceLocator.main_window = main_window
@@ -105,6 +111,21 @@ class ServiceLocator(object):
             ServiceLocator.color_manager = color_manager.ColorManager(ServiceLocator.get_main_window(), ServiceLocator.get_settings(), ServiceLocator.get_source_style_scheme_manager())
         return ServiceLocator.color_manager
 
+    def get_parse_cache():
+        if ServiceLocator.parse_cache == None:
+            ServiceLocator.parse_cache = parse_cache.ParseCache(os.path.join(ServiceLocator.get_config_folder(), 'parse_cache'))
+        return ServiceLocator.parse_cache
+
+    def get_build_scheduler():
+        if ServiceLocator.build_scheduler == None:
+            ServiceLocator.build_scheduler = build_scheduler.BuildScheduler()
+        return ServiceLocator.build_scheduler
+
+    def get_synctex_reader():
+        if ServiceLocator.synctex_reader == None:
+            ServiceLocator.synctex_reader = synctex_reader.SyncTeXReader(ServiceLocator.get_config_folder())
+        return ServiceLocator.synctex_reader
+
     def get_popover_menu_builder():
         if ServiceLocator.popover_menu_builder == None:
             ServiceLocator.popover_menu_builder = popover_menu_builder.PopoverMenuBuilder()
@@ -114,7 +135,7 @@ class ServiceLocator(object):
         path = ServiceLocator.get_resources_path()
         latex_parser_regex = ServiceLocator.get_regex_object(r'\\(label|include|input|bibliography|addbibresource)\{((?:\s|\w|\:|\.|,)*)\}|\\(usepackage)(?:\[.*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}')
         bibtex_parser_regex = ServiceLocator.get_regex_object(r'@(\w+)\{(\w+)')
-        ServiceLocator.autocomplete_provider = autocomplete_provider.AutocompleteProvider(path, workspace, latex_parser_regex, bibtex_parser_regex, ServiceLocator.get_packages_dict())
+        ServiceLocator.autocomplete_provider = autocomplete_provider.AutocompleteProvider(path, workspace, latex_parser_regex, bibtex_parser_regex, ServiceLocator.get_packages_dict(), ServiceLocator.get_parse_cache())
 
     def get_autocomplete_provider():
         return ServiceLocator.autocomplete_provider
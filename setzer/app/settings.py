@@ -73,12 +73,17 @@ class Settings(Observable):
         self.defaults['preferences']['autoshow_build_log'] = 'errors_warnings'
         self.defaults['preferences']['latex_interpreter'] = 'xelatex'
         self.defaults['preferences']['use_latexmk'] = False
+        self.defaults['preferences']['abort_build_on_first_error'] = False
+        self.defaults['preferences']['use_precompiled_preamble'] = False
         self.defaults['preferences']['prefer_dark_mode'] = False
         self.defaults['preferences']['invert_pdf'] = False
         self.defaults['preferences']['spaces_instead_of_tabs'] = True
         self.defaults['preferences']['tab_width'] = 4
         self.defaults['preferences']['show_line_numbers'] = True
         self.defaults['preferences']['enable_code_folding'] = True
+        self.defaults['preferences']['parser_debounce_interval'] = 0
+        self.defaults['preferences']['enable_profiling'] = False
+        self.defaults['preferences']['monitor_main_loop'] = False
         self.defaults['preferences']['enable_line_wrapping'] = True
         self.defaults['preferences']['highlight_current_line'] = False
         self.defaults['preferences']['highlight_matching_brackets'] = True
@@ -43,10 +43,30 @@ class AddRemovePackagesDialog(Dialog):
     def run(self, document):
         self.document = document
         self.setup()
+        self.document.content.connect('symbols_changed', self.on_symbols_changed)
         self.view.run()
+        self.document.content.disconnect('symbols_changed', self.on_symbols_changed)
         self.view.dialog.hide()
         del(self.view)
 
+    def on_symbols_changed(self, content, symbols_changed):
+        ''' Packages can also be added or removed by undo or by the
+            buttons, move those that ended up in the wrong list. '''
+
+        try: changes = symbols_changed['packages']
+        except KeyError: return
+        for package in changes['added']:
+            self.move_to_list(package, self.view.add_list, self.view.remove_list)
+        for package in changes['removed']:
+            self.move_to_list(package, self.view.remove_list, self.view.add_list)
+
+    def move_to_list(self, package, from_list, to_list):
+        for row in from_list.get_children():
+            if row.get_child().get_text() == package:
+                from_list.remove(row)
+                self.add_to_list(to_list, package)
+                return
+
     def setup(self):
         self.view = view.AddRemovePackagesDialogView(self.main_window)
 
@@ -82,37 +102,36 @@ class AddRemovePackagesDialog(Dialog):
                 self.view.remove_button.hide()
 
         def add_button_clicked(button):
-            self.document.content.add_packages([self.add_package_selection])
+            package = self.add_package_selection
+            selected_row_index = self.view.add_list.get_selected_row().get_index()
+            self.document.content.add_packages([package])
             self.document.content.scroll_cursor_onscreen()
-            selected_row = self.view.add_list.get_selected_row()
-            selected_row_index = selected_row.get_index()
-            new_row = self.view.add_list.get_row_at_index(selected_row_index + 1)
-            if new_row == None:
-                new_row = self.view.add_list.get_row_at_index(selected_row_index - 1)
 
-            self.view.add_list.remove(selected_row)
-            self.add_to_list(self.view.remove_list, self.add_package_selection)
+            # the row may have been moved already when the parser published the change
+            self.move_to_list(package, self.view.add_list, self.view.remove_list)
             for row in self.view.remove_list.get_children():
-                if row.get_child().get_text() == self.add_package_selection:
+                if row.get_child().get_text() == package:
                     self.view.remove_list.select_row(row)
 
+            new_row = self.view.add_list.get_row_at_index(selected_row_index)
+            if new_row == None:
+                new_row = self.view.add_list.get_row_at_index(selected_row_index - 1)
             if new_row != None:
                 self.view.add_list.select_row(new_row)
 
         def remove_button_clicked(button):
-            self.document.content.remove_packages([self.remove_package_selection])
-            selected_row = self.view.remove_list.get_selected_row()
-            selected_row_index = selected_row.get_index()
-            new_row = self.view.remove_list.get_row_at_index(selected_row_index + 1)
-            if new_row == None:
-                new_row = self.view.remove_list.get_row_at_index(selected_row_index - 1)
+            package = self.remove_package_selection
+            selected_row_index = self.view.remove_list.get_selected_row().get_index()
+            self.document.content.remove_packages([package])
 
-            self.view.remove_list.remove(selected_row)
-            self.add_to_list(self.view.add_list, self.remove_package_selection)
+            self.move_to_list(package, self.view.remove_list, self.view.add_list)
             for row in self.view.add_list.get_children():
-                if row.get_child().get_text() == self.remove_package_selection:
+                if row.get_child().get_text() == package:
                     self.view.add_list.select_row(row)
 
+            new_row = self.view.remove_list.get_row_at_index(selected_row_index)
+            if new_row == None:
+                new_row = self.view.remove_list.get_row_at_index(selected_row_index - 1)
             if new_row != None:
                 self.view.remove_list.select_row(new_row)
 
@@ -35,6 +35,12 @@ class PageBuildSystem(object):
         self.view.option_cleanup_build_files.set_active(self.settings.get_value('preferences', 'cleanup_build_files'))
         self.view.option_cleanup_build_files.connect('toggled', self.preferences.on_check_button_toggle, 'cleanup_build_files')
 
+        self.view.option_abort_on_first_error.set_active(self.settings.get_value('preferences', 'abort_build_on_first_error'))
+        self.view.option_abort_on_first_error.connect('toggled', self.preferences.on_check_button_toggle, 'abort_build_on_first_error')
+
+        self.view.option_use_precompiled_preamble.set_active(self.settings.get_value('preferences', 'use_precompiled_preamble'))
+        self.view.option_use_precompiled_preamble.connect('toggled', self.preferences.on_check_button_toggle, 'use_precompiled_preamble')
+
         self.view.option_autoshow_build_log_errors.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'errors')
         self.view.option_autoshow_build_log_errors_warnings.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'errors_warnings')
         self.view.option_autoshow_build_log_all.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'all')
@@ -148,6 +154,10 @@ class PageBuildSystemView(Gtk.VBox):
         self.pack_start(self.option_cleanup_build_files, False, False, 0)
         self.option_use_latexmk = Gtk.CheckButton(_('Use Latexmk'))
         self.pack_start(self.option_use_latexmk, False, False, 0)
+        self.option_abort_on_first_error = Gtk.CheckButton(_('Stop building at the first error.'))
+        self.pack_start(self.option_abort_on_first_error, False, False, 0)
+        self.option_use_precompiled_preamble = Gtk.CheckButton(_('Precompile the preamble (needs the mylatexformat package).'))
+        self.pack_start(self.option_use_precompiled_preamble, False, False, 0)
 
         label = Gtk.Label()
         label.set_markup('<b>' + _('Automatically show build log ..') + ' </b>')
@@ -160,7 +160,7 @@ class Autocomplete(object):
         else:
             self.view.hide()
 
-    #@timer.timer
+    @timer.timer
     def populate(self, offset):
         self.view.empty_list()
         for command in reversed(self.items):
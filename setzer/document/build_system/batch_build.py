@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os.path
+import pickle
+import threading
+import time
+
+import setzer.app.build_scheduler as build_scheduler
+import setzer.document.build_system.build_system as build_system
+import setzer.document.build_system.query.query as query
+
+
+class BatchBuild(object):
+    ''' Builds documents without a window, for scripts and CI. Each
+        document goes through the same queries and builders as a build
+        from the editor, on a scheduler with number_of_workers threads.
+
+        build() returns a report that can be written out as JSON: per
+        document the result, log items, LaTeX passes and how long each
+        job took. '''
+
+    def __init__(self, number_of_workers=2, options=None):
+        self.build_scheduler = build_scheduler.BuildScheduler(number_of_workers)
+
+        self.options = {'latex_interpreter': 'xelatex',
+                        'use_latexmk': False,
+                        'build_option_system_commands': 'disable',
+                        'do_cleanup': True,
+                        'use_precompiled_preamble': False}
+        if options != None:
+            self.options.update(options)
+
+        self.condition = threading.Condition()
+        self.number_of_pending_documents = 0
+        self.document_reports = dict()
+
+    def get_tex_filenames(self, filenames):
+        ''' .tex files to build, sessions (.stzs) replaced by their root
+            document or, without one, all their .tex documents. '''
+
+        tex_filenames = list()
+        for filename in filenames:
+            if filename.endswith('.stzs'):
+                session_filenames = self.get_session_tex_filenames(filename)
+            else:
+                session_filenames = [filename]
+            for tex_filename in session_filenames:
+                tex_filename = os.path.abspath(tex_filename)
+                if tex_filename not in tex_filenames:
+                    tex_filenames.append(tex_filename)
+        return tex_filenames
+
+    def get_session_tex_filenames(self, filename):
+        try: filehandle = open(filename, 'rb')
+        except IOError: return list()
+        with filehandle:
+            try: data = pickle.load(filehandle)
+            except (EOFError, pickle.UnpicklingError): return list()
+
+        try: root_document_filename = data['root_document_filename']
+        except KeyError: root_document_filename = None
+        if root_document_filename != None:
+            return [root_document_filename]
+
+        items = sorted(data['open_documents'].values(), key=lambda val: val['last_activated'])
+        return [item['filename'] for item in items if item['filename'].endswith('.tex')]
+
+    def build(self, filenames):
+        start_time = time.time()
+        tex_filenames = self.get_tex_filenames(filenames)
+
+        with self.condition:
+            self.number_of_pending_documents = len(tex_filenames)
+            self.document_reports = dict()
+        for tex_filename in tex_filenames:
+            self.build_scheduler.add_job(tex_filename, build_scheduler.BuildScheduler.PRIORITY_BUILD, self.build_document, tex_filename)
+        with self.condition:
+            while self.number_of_pending_documents > 0:
+                self.condition.wait()
+
+        documents = [self.document_reports[tex_filename] for tex_filename in tex_filenames]
+        return {'documents': documents,
+                'succeeded': len([document for document in documents if document['success']]),
+                'failed': len([document for document in documents if not document['success']]),
+                'seconds': time.time() - start_time}
+
+    def build_document(self, tex_filename):
+        start_time = time.time()
+        try:
+            query_obj = self.get_query(tex_filename)
+            if query_obj == None:
+                report = self.get_error_report(tex_filename, 'file_not_readable', tex_filename)
+            else:
+                build_system.run_jobs(build_system.get_builders(), query_obj)
+                report = self.get_document_report(query_obj)
+        except Exception as e:
+            report = self.get_error_report(tex_filename, 'exception', repr(e))
+        report['seconds'] = time.time() - start_time
+
+        with self.condition:
+            self.document_reports[tex_filename] = report
+            self.number_of_pending_documents -= 1
+            self.condition.notify_all()
+
+    def get_query(self, tex_filename):
+        try:
+            with open(tex_filename, 'r', encoding='utf-8', errors='surrogateescape') as filehandle:
+                text = filehandle.read()
+        except OSError:
+            return None
+
+        interpreter = self.options['latex_interpreter']
+        query_obj = query.Query(tex_filename)
+        query_obj.jobs = ['build_latex']
+        query_obj.build_data['text'] = text
+        query_obj.build_data['latex_interpreter'] = interpreter
+        query_obj.build_data['use_latexmk'] = self.options['use_latexmk']
+        query_obj.build_data['additional_arguments'] = build_system.get_additional_arguments(interpreter, self.options['build_option_system_commands'])
+        query_obj.build_data['do_cleanup'] = self.options['do_cleanup']
+        query_obj.build_data['abort_on_first_error'] = False
+        query_obj.build_data['use_precompiled_preamble'] = self.options['use_precompiled_preamble']
+        return query_obj
+
+    def get_document_report(self, query_obj):
+        build_result = query_obj.get_build_result()
+        if build_result == None:
+            return self.get_error_report(query_obj.tex_filename, 'no_result', None)
+
+        items = list()
+        if build_result['error'] == None:
+            for filename, log_messages in build_result['log_messages'].items():
+                items += self.get_items(log_messages, filename, 'latex')
+            items += self.get_items(build_result['bibtex_log_messages'], None, 'bibtex')
+
+        latex_passes = query_obj.build_data.get('latex_passes', 0)
+        jobs = list()
+        for job, seconds in query_obj.build_data.get('job_times', list()):
+            jobs.append({'jobs': list(job) if isinstance(job, tuple) else [job], 'seconds': seconds})
+
+        report = {'tex_filename': query_obj.tex_filename,
+                  'pdf_filename': build_result.get('pdf_filename'),
+                  'success': build_result['error'] == None and build_result.get('pdf_filename') != None,
+                  'error': build_result['error'],
+                  'error_arg': build_result['error_arg'],
+                  'latex_passes': latex_passes,
+                  'reruns': max(latex_passes - 1, 0),
+                  'jobs': jobs,
+                  'items': items}
+        for item_type in ['error', 'warning', 'badbox']:
+            report[item_type + '_count'] = len([item for item in items if item['type'] == item_type])
+        return report
+
+    def get_error_report(self, tex_filename, error, error_arg):
+        return {'tex_filename': tex_filename,
+                'pdf_filename': None,
+                'success': False,
+                'error': error,
+                'error_arg': error_arg,
+                'latex_passes': 0,
+                'reruns': 0,
+                'jobs': list(),
+                'items': list(),
+                'error_count': 0,
+                'warning_count': 0,
+                'badbox_count': 0}
+
+    def get_items(self, log_messages, filename, tool):
+        items = list()
+        for item_type in ['error', 'warning', 'badbox']:
+            for item in log_messages[item_type]:
+                items.append({'type': item_type,
+                              'tool': tool,
+                              'label': item[0],
+                              'filename': filename,
+                              'line': item[1] if item[1] >= 0 else None,
+                              'text': item[2]})
+        return items
+
+
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os, os.path
+import base64
+import hashlib
+import pickle
+import shutil
+
+
+class BuildCache(object):
+    ''' Outputs of the last successful build of each file (pdf, synctex
+        file and log messages), with a fingerprint of what went into it:
+        the text, the build options and the files the build read. A build
+        with the same fingerprint restores the outputs instead of running
+        LaTeX again.
+
+        Dependencies are compared by mtime and size, by content hash if
+        those differ. When the cache grows beyond size_limit (bytes) the
+        entries used least recently go. '''
+
+    def __init__(self, config_folder, synctex_reader, size_limit=256 * 1024 * 1024):
+        self.synctex_reader = synctex_reader
+        self.pathname = os.path.join(config_folder, 'build_cache')
+        self.size_limit = size_limit
+
+    def get_folder(self, tex_filename):
+        return os.path.join(self.pathname, base64.urlsafe_b64encode(str.encode(tex_filename)).decode())
+
+    def get_fingerprint(self, query):
+        fingerprint = hashlib.sha1()
+        for item in [query.tex_filename, query.build_data['latex_interpreter'], str(query.build_data['use_latexmk']), query.build_data['additional_arguments'], query.build_data['text']]:
+            fingerprint.update(item.encode('utf-8', 'surrogatepass') + b'\0')
+        return fingerprint.hexdigest()
+
+    def get_file_state(self, filename, with_hash=True):
+        ''' (mtime, size, sha1), None if the file is gone. '''
+
+        try: stat = os.stat(filename)
+        except OSError: return None
+        file_hash = None
+        if with_hash:
+            try:
+                with open(filename, 'rb') as filehandle:
+                    file_hash = hashlib.sha1(filehandle.read()).hexdigest()
+            except OSError: return None
+        return (stat.st_mtime, stat.st_size, file_hash)
+
+    def is_unchanged(self, filename, state):
+        current_state = self.get_file_state(filename, with_hash=False)
+        if current_state == None: return False
+        if current_state[:2] == state[:2]: return True
+        if current_state[1] != state[1]: return False
+        return self.get_file_state(filename)[2] == state[2]
+
+    def restore(self, query):
+        ''' Sets the build result of query from the cache, if the
+            fingerprint and all dependencies match. Returns True then. '''
+
+        folder = self.get_folder(query.tex_filename)
+        try:
+            with open(os.path.join(folder, 'entry.pickle'), 'rb') as filehandle:
+                entry = pickle.load(filehandle)
+        except Exception: return False
+
+        if entry['fingerprint'] != self.get_fingerprint(query): return False
+        for filename, state in entry['dependencies']:
+            if not self.is_unchanged(filename, state): return False
+
+        pdf_filename = entry['build_result']['pdf_filename']
+        try:
+            if not self.is_unchanged(pdf_filename, entry['pdf_state']):
+                shutil.copyfile(os.path.join(folder, 'output.pdf'), pdf_filename)
+            if entry['build_result']['has_synctex_file']:
+                synctex_filename = self.synctex_reader.get_synctex_filename(query.tex_filename)
+                if not os.path.isdir(os.path.dirname(synctex_filename)):
+                    os.makedirs(os.path.dirname(synctex_filename))
+                # the stored file may be a hard link to the build's, don't write through it
+                shutil.copyfile(os.path.join(folder, 'output.synctex.gz'), synctex_filename + '.tmp')
+                os.replace(synctex_filename + '.tmp', synctex_filename)
+        except OSError: return False
+
+        try: os.utime(os.path.join(folder, 'entry.pickle'))
+        except OSError: pass
+        query.can_sync = entry['build_result']['has_synctex_file']
+        with query.build_result_lock:
+            query.build_result = entry['build_result']
+        return True
+
+    def store(self, query):
+        ''' Keep the outputs of a successful build. Needs the files the
+            build read in query.build_data['dependencies']. '''
+
+        build_result = query.get_build_result()
+        if build_result == None or build_result['error'] != None or build_result['pdf_filename'] == None: return
+        if query.build_data.get('dependencies') == None: return
+
+        dependencies = list()
+        for filename in query.build_data['dependencies']:
+            state = self.get_file_state(filename)
+            if state == None: return
+            dependencies.append((filename, state))
+
+        folder = self.get_folder(query.tex_filename)
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            try: os.remove(os.path.join(folder, 'entry.pickle'))
+            except FileNotFoundError: pass
+            shutil.copyfile(build_result['pdf_filename'], os.path.join(folder, 'output.pdf'))
+            if build_result['has_synctex_file']:
+                shutil.copyfile(self.synctex_reader.get_synctex_filename(query.tex_filename), os.path.join(folder, 'output.synctex.gz'))
+
+            entry = {'fingerprint': self.get_fingerprint(query),
+                     'dependencies': dependencies,
+                     'pdf_state': self.get_file_state(build_result['pdf_filename']),
+                     'build_result': build_result}
+            with open(os.path.join(folder, 'entry.pickle.tmp'), 'wb') as filehandle:
+                pickle.dump(entry, filehandle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(os.path.join(folder, 'entry.pickle.tmp'), os.path.join(folder, 'entry.pickle'))
+        except (OSError, pickle.PicklingError):
+            return
+        self.evict()
+
+    def evict(self):
+        entries = list()
+        total_size = 0
+        for name in os.listdir(self.pathname):
+            folder = os.path.join(self.pathname, name)
+            try:
+                mtime = os.stat(os.path.join(folder, 'entry.pickle')).st_mtime
+                size = sum(os.stat(os.path.join(folder, filename)).st_size for filename in os.listdir(folder))
+            except OSError:
+                mtime, size = 0, 0
+            entries.append((mtime, size, folder))
+            total_size += size
+
+        for mtime, size, folder in sorted(entries):
+            if total_size <= self.size_limit: break
+            shutil.rmtree(folder, ignore_errors=True)
+            total_size -= size
+
+
@@ -15,11 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import gi
-from gi.repository import GObject
-
-import _thread as thread, queue
+import threading
 import time
+import traceback
 
 from setzer.app.service_locator import ServiceLocator
 import setzer.document.build_system.builder.builder_build_latex as builder_build_latex
@@ -30,7 +28,9 @@ import setzer.document.build_system.builder.builder_build_glossaries as builder_
 import setzer.document.build_system.builder.builder_forward_sync as builder_forward_sync
 import setzer.document.build_system.builder.builder_backward_sync as builder_backward_sync
 import setzer.document.build_system.query.query as query
+import setzer.document.build_system.build_cache as build_cache
 from setzer.helpers.observable import Observable
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class BuildSystem(Observable):
@@ -39,6 +39,8 @@ class BuildSystem(Observable):
         Observable.__init__(self)
         self.document = document
         self.settings = ServiceLocator.get_settings()
+        self.build_scheduler = ServiceLocator.get_build_scheduler()
+        self.build_cache = build_cache.BuildCache(ServiceLocator.get_config_folder(), ServiceLocator.get_synctex_reader())
         self.active_query = None
 
         # possible states: idle, ready_for_building
@@ -60,16 +62,7 @@ class BuildSystem(Observable):
 
         self.build_log_data = {'items': list(), 'error_count': 0, 'warning_count': 0, 'badbox_count': 0}
 
-        self.builders = dict()
-        self.builders['build_latex'] = builder_build_latex.BuilderBuildLaTeX()
-        self.builders['build_bibtex'] = builder_build_bibtex.BuilderBuildBibTeX()
-        self.builders['build_biber'] = builder_build_biber.BuilderBuildBiber()
-        self.builders['build_makeindex'] = builder_build_makeindex.BuilderBuildMakeindex()
-        self.builders['build_glossaries'] = builder_build_glossaries.BuilderBuildGlossaries()
-        self.builders['forward_sync'] = builder_forward_sync.BuilderForwardSync()
-        self.builders['backward_sync'] = builder_backward_sync.BuilderBackwardSync()
-
-        GObject.timeout_add(50, self.results_loop)
+        self.builders = get_builders()
 
     def change_build_state(self, state):
         self.build_state = state
@@ -167,16 +160,38 @@ class BuildSystem(Observable):
     def get_badbox_count(self):
         return self.build_log_data['badbox_count']
 
-    def results_loop(self):
-        if self.active_query != None:
-            if self.active_query.is_done():
-                build_result = self.active_query.get_build_result()
-                forward_sync_result = self.active_query.get_forward_sync_result()
-                backward_sync_result = self.active_query.get_backward_sync_result()
-                if forward_sync_result != None or backward_sync_result != None or build_result != None:
-                    self.parse_result({'build': build_result, 'forward_sync': forward_sync_result, 'backward_sync': backward_sync_result})
-                self.active_query = None
-        return True
+    def on_live_log_messages(self, query):
+        main_loop_monitor.idle_add(self.show_live_log_messages, query)
+
+    def show_live_log_messages(self, query):
+        ''' Errors and warnings of the LaTeX pass that is still running. '''
+
+        log_messages = query.get_live_log_messages()
+        if query == self.active_query and log_messages != None:
+            self.set_build_log_items(log_messages)
+            self.invalidate_build_log()
+        return False
+
+    def on_build_progress(self, query):
+        main_loop_monitor.idle_add(self.show_build_progress, query)
+
+    def show_build_progress(self, query):
+        if query == self.active_query:
+            self.add_change_code('build_progress', query.get_build_progress())
+        return False
+
+    def on_query_done(self, query):
+        ''' Runs on the main loop, queries that have been stopped or replaced
+            in the meantime are ignored. '''
+
+        if query == self.active_query:
+            build_result = query.get_build_result()
+            forward_sync_result = query.get_forward_sync_result()
+            backward_sync_result = query.get_backward_sync_result()
+            self.active_query = None
+            if forward_sync_result != None or backward_sync_result != None or build_result != None:
+                self.parse_result({'build': build_result, 'forward_sync': forward_sync_result, 'backward_sync': backward_sync_result})
+        return False
 
     def parse_result(self, result_blob):
         if result_blob['build'] != None or result_blob['forward_sync'] != None:
@@ -244,15 +259,34 @@ class BuildSystem(Observable):
     def add_query(self, query):
         self.stop_building(notify=False)
         self.active_query = query
-        thread.start_new_thread(self.execute_query, (query,))
+        query.live_log_callback = self.on_live_log_messages
+        query.build_progress_callback = self.on_build_progress
+        if set(query.jobs) <= {'forward_sync', 'backward_sync'}:
+            priority = self.build_scheduler.PRIORITY_SYNC
+        else:
+            priority = self.build_scheduler.PRIORITY_BUILD
+        self.build_scheduler.add_job(query.tex_filename, priority, self.execute_query, query)
 
         self.change_build_state('building_in_progress')
 
     def execute_query(self, query):
-        while len(query.jobs) > 0:
-            if not query.force_building_to_stop:
-                self.builders[query.jobs.pop(0)].run(query)
-        query.mark_done()
+        try:
+            restored_from_cache = 'build_latex' in query.jobs and self.build_cache.restore(query)
+            if restored_from_cache:
+                query.jobs.remove('build_latex')
+
+            run_jobs(self.builders, query)
+
+            if not restored_from_cache and query == self.active_query:
+                self.build_cache.store(query)
+        except Exception as e:
+            traceback.print_exc()
+            with query.build_result_lock:
+                query.build_result = {'error': 'interpreter_not_working',
+                                      'error_arg': str(e)}
+        finally:
+            query.mark_done()
+            main_loop_monitor.idle_add(self.on_query_done, query)
 
     def start_building(self):
         if self.build_mode == 'forward_sync' and not self.has_synctex_file: return
@@ -270,18 +304,12 @@ class BuildSystem(Observable):
             interpreter = self.settings.get_value('preferences', 'latex_interpreter')
             use_latexmk = self.settings.get_value('preferences', 'use_latexmk')
             build_option_system_commands = self.settings.get_value('preferences', 'build_option_system_commands')
-            additional_arguments = ''
-
-            lualatex_prefix = ' -' if interpreter == 'lualatex' else ' '
-            if build_option_system_commands == 'disable':
-                additional_arguments += lualatex_prefix + '-no-shell-escape'
-            elif build_option_system_commands == 'restricted':
-                additional_arguments += lualatex_prefix + '-shell-restricted'
-            elif build_option_system_commands == 'enable':
-                additional_arguments += lualatex_prefix + '-shell-escape'
+            additional_arguments = get_additional_arguments(interpreter, build_option_system_commands)
 
             text = self.document.content.get_all_text()
             do_cleanup = self.settings.get_value('preferences', 'cleanup_build_files')
+            abort_on_first_error = self.settings.get_value('preferences', 'abort_build_on_first_error')
+            use_precompiled_preamble = self.settings.get_value('preferences', 'use_precompiled_preamble')
 
         if mode == 'build':
             query_obj.jobs = ['build_latex']
@@ -290,6 +318,8 @@ class BuildSystem(Observable):
             query_obj.build_data['use_latexmk'] = use_latexmk
             query_obj.build_data['additional_arguments'] = additional_arguments
             query_obj.build_data['do_cleanup'] = do_cleanup
+            query_obj.build_data['abort_on_first_error'] = abort_on_first_error
+            query_obj.build_data['use_precompiled_preamble'] = use_precompiled_preamble
         elif mode == 'forward_sync':
             query_obj.jobs = ['forward_sync']
             query_obj.can_sync = True
@@ -311,6 +341,8 @@ class BuildSystem(Observable):
             query_obj.build_data['use_latexmk'] = use_latexmk
             query_obj.build_data['additional_arguments'] = additional_arguments
             query_obj.build_data['do_cleanup'] = do_cleanup
+            query_obj.build_data['abort_on_first_error'] = abort_on_first_error
+            query_obj.build_data['use_precompiled_preamble'] = use_precompiled_preamble
             query_obj.can_sync = False
             query_obj.forward_sync_data['filename'] = synctex_arguments['filename']
             query_obj.forward_sync_data['line'] = synctex_arguments['line']
@@ -320,6 +352,7 @@ class BuildSystem(Observable):
 
     def stop_building(self, notify=True):
         if self.active_query != None:
+            self.active_query.force_building_to_stop = True
             self.active_query.jobs = []
             self.active_query = None
         for builder in self.builders.values():
@@ -329,3 +362,58 @@ class BuildSystem(Observable):
             self.change_build_state('idle')
 
 
+def get_builders():
+    builders = dict()
+    builders['build_latex'] = builder_build_latex.BuilderBuildLaTeX()
+    builders['build_bibtex'] = builder_build_bibtex.BuilderBuildBibTeX()
+    builders['build_biber'] = builder_build_biber.BuilderBuildBiber()
+    builders['build_makeindex'] = builder_build_makeindex.BuilderBuildMakeindex()
+    builders['build_glossaries'] = builder_build_glossaries.BuilderBuildGlossaries()
+    builders['forward_sync'] = builder_forward_sync.BuilderForwardSync()
+    builders['backward_sync'] = builder_backward_sync.BuilderBackwardSync()
+    return builders
+
+
+def run_jobs(builders, query):
+    ''' Runs the jobs of query, a tuple of jobs that don't depend on each
+        other (bibliography, index, glossaries) all at the same time. The
+        time each job took is kept in query.build_data['job_times'].
+
+        Tools running at the same time don't clean up build files or add
+        to query.error_count themselves, that's done when all are done. '''
+
+    query.build_data.setdefault('job_times', list())
+    while len(query.jobs) > 0 and not query.force_building_to_stop:
+        job = query.jobs.pop(0)
+        start_time = time.time()
+        if isinstance(job, tuple):
+            query.build_data['is_running_concurrently'] = True
+            threads = [threading.Thread(target=builders[name].run, args=(query,)) for name in job[1:]]
+            for job_thread in threads:
+                job_thread.start()
+            try:
+                builders[job[0]].run(query)
+            finally:
+                for job_thread in threads:
+                    job_thread.join()
+                query.build_data['is_running_concurrently'] = False
+            if query.build_data.pop('has_pending_cleanup', False):
+                builders[job[0]].cleanup_files(query)
+        else:
+            builders[job].run(query)
+        query.error_count += sum(query.tool_error_counts.values())
+        query.tool_error_counts = dict()
+        query.build_data['job_times'].append((job, time.time() - start_time))
+
+
+def get_additional_arguments(interpreter, build_option_system_commands):
+    lualatex_prefix = ' -' if interpreter == 'lualatex' else ' '
+    if build_option_system_commands == 'disable':
+        return lualatex_prefix + '-no-shell-escape'
+    elif build_option_system_commands == 'restricted':
+        return lualatex_prefix + '-shell-restricted'
+    elif build_option_system_commands == 'enable':
+        return lualatex_prefix + '-shell-escape'
+    return ''
+
+
@@ -25,12 +25,25 @@ class BuilderBuild(object):
     def __init__(self):
         self.process = None
 
+    def report_success(self, query, tool):
+        ''' Lets the rerun planner know tool doesn't have to run again
+            until its input changes. '''
+
+        query.build_data.setdefault('succeeded_tools', set()).add(tool)
+
     def throw_build_error(self, query, error, error_arg):
+        # the LaTeX pass after a failed tool would replace the error
+        query.jobs = [job for job in query.jobs if job != 'build_latex']
         with query.build_result_lock:
             query.build_result = {'error': error,
                                  'error_arg': error_arg}
 
     def cleanup_files(self, query):
+        # other tools running at the same time may still read the files
+        if query.build_data.get('is_running_concurrently'):
+            query.build_data['has_pending_cleanup'] = True
+            return
+
         if query.build_data['do_cleanup']:
             self.cleanup_build_files(query)
             self.cleanup_glossaries_files(query)
@@ -41,16 +41,17 @@ class BuilderBuildBiber(builder_build.BuilderBuild):
         custom_env = os.environ.copy()
         custom_env['BIBINPUTS'] = os.path.dirname(query.tex_filename) + ':' + os.path.dirname(tex_filename)
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename), env=custom_env)
+            process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename), env=custom_env)
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'biber missing')
             return
-        self.process.wait()
+        self.process = process
+        process.communicate()
 
         self.parse_biber_log(query, tex_filename[:-3] + 'blg')
-
-        query.jobs.insert(0, 'build_latex')
+        if process.returncode == 0:
+            self.report_success(query, 'build_biber')
 
     def stop_running(self):
         if self.process != None:
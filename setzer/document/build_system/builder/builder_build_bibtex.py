@@ -42,15 +42,19 @@ class BuilderBuildBibTeX(builder_build.BuilderBuild):
         query.bibtex_data['ran_on_files'].append(filename)
 
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
+            process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'bibtex missing')
             return
-        self.process.wait()
+        self.process = process
+        process.communicate()
 
         self.parse_bibtex_log(query, tex_filename[:-3] + 'blg')
-        query.jobs.insert(0, 'build_latex')
+
+        # 1 means there were warnings
+        if process.returncode in [0, 1]:
+            self.report_success(query, 'build_bibtex')
 
     def stop_running(self):
         if self.process != None:
@@ -64,11 +68,12 @@ class BuilderBuildBibTeX(builder_build.BuilderBuild):
             text = file.read().decode('utf-8', errors='ignore')
 
             query.bibtex_log_messages = {'error': list(), 'warning': list(), 'badbox': list()}
+            error_count = 0
             for item in self.bibtex_log_item_regex.finditer(text):
                 line = item.group(0)
 
                 if line.startswith('I couldn\'t open style file'):
-                    query.error_count += 1
+                    error_count += 1
                     text = 'I couldn\'t open style file ' + item.group(4) + '.bst'
                     line_number = int(item.group(5).strip())
                     query.bibtex_log_messages['error'].append(('Error', -1, text))
@@ -82,5 +87,6 @@ class BuilderBuildBibTeX(builder_build.BuilderBuild):
                     query.bibtex_log_messages['warning'].append(('Warning', line_number, text))
             query.bibtex_log_messages['error'].sort(key=itemgetter(1))
             query.bibtex_log_messages['warning'].sort(key=itemgetter(1))
+            query.tool_error_counts['build_bibtex'] = error_count
 
 
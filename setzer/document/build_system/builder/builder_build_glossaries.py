@@ -35,20 +35,21 @@ class BuilderBuildGlossaries(builder_build.BuilderBuild):
         arguments = ['makeglossaries']
         arguments.append(basename)
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
+            process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'makeglossaries missing')
             return
-        self.process.wait()
+        self.process = process
+        process.communicate()
+        if process.returncode == 0:
+            self.report_success(query, 'build_glossaries')
         for ending in ['.gls', '.acr']:
             move_from = os.path.join(os.path.dirname(tex_filename), basename + ending)
             move_to = os.path.join(os.path.dirname(query.tex_filename), basename + ending)
             try: shutil.move(move_from, move_to)
             except FileNotFoundError: pass
 
-        query.jobs.insert(0, 'build_latex')
-
     def stop_running(self):
         if self.process != None:
             self.process.kill()
@@ -18,29 +18,75 @@
 import os
 import os.path
 import sys
-import base64
-import shutil
 import pexpect
 from operator import itemgetter
 
 import setzer.document.build_system.builder.builder_build as builder_build
 import setzer.document.build_system.latex_log_parser.latex_log_parser as latex_log_parser
+import setzer.document.build_system.latex_output_reader as latex_output_reader
+import setzer.document.build_system.rerun_planner as rerun_planner
+import setzer.document.build_system.preamble_format as preamble_format
 from setzer.app.service_locator import ServiceLocator
 
 
 class BuilderBuildLaTeX(builder_build.BuilderBuild):
 
+    READ_SIZE = 16384
+
     def __init__(self):
         builder_build.BuilderBuild.__init__(self)
 
-        self.config_folder = ServiceLocator.get_config_folder()
         self.latex_log_parser = latex_log_parser.LaTeXLogParser()
+        self.rerun_planner = rerun_planner.RerunPlanner()
+        self.preamble_format = preamble_format.PreambleFormat(ServiceLocator.get_config_folder(), ServiceLocator.get_build_scheduler())
+        self.synctex_reader = ServiceLocator.get_synctex_reader()
 
     def run(self, query):
+        self.rerun_planner.on_tools_done(query)
+        if self.rerun_planner.is_latex_pass_needed(query):
+            self.rerun_planner.on_latex_pass_start(query)
+            if not self.run_interpreter(query):
+                return
+
+        if query.build_data.get('aborted'):
+            additional_jobs = list()
+        else:
+            additional_jobs = self.rerun_planner.get_additional_jobs(query)
+        if len(additional_jobs) > 0:
+            query.jobs[0:0] = additional_jobs
+            return
+
+        # parse results
+        try:
+            self.parse_build_log(query)
+        except FileNotFoundError as e:
+            self.cleanup_files(query)
+            self.throw_build_error(query, 'interpreter_not_working', 'log file missing')
+            return
+
+        query.can_sync = self.store_synctex_file(query)
+        query.build_data['dependencies'] = self.get_dependencies(query)
+        self.cleanup_files(query)
+
+        pdf_filename = query.tex_filename.rsplit('.tex', 1)[0] + '.pdf'
+        if query.error_count > 0:
+            if os.path.isfile(pdf_filename):
+                os.remove(pdf_filename)
+            pdf_filename = None
+
+        with query.build_result_lock:
+            query.build_result = {'pdf_filename': pdf_filename, 
+                                  'has_synctex_file': query.can_sync,
+                                  'log_messages': query.log_messages,
+                                  'bibtex_log_messages': query.bibtex_log_messages,
+                                  'error': None,
+                                  'error_arg': None}
+
+    def run_interpreter(self, query):
         build_command_defaults = dict()
-        build_command_defaults['pdflatex'] = 'pdflatex -synctex=1 -interaction=nonstopmode'
-        build_command_defaults['xelatex'] = 'xelatex -synctex=1 -interaction=nonstopmode'
-        build_command_defaults['lualatex'] = 'lualatex --synctex=1 --interaction=nonstopmode'
+        build_command_defaults['pdflatex'] = 'pdflatex -synctex=1 -interaction=nonstopmode -recorder'
+        build_command_defaults['xelatex'] = 'xelatex -synctex=1 -interaction=nonstopmode -recorder'
+        build_command_defaults['lualatex'] = 'lualatex --synctex=1 --interaction=nonstopmode --recorder'
         if query.build_data['use_latexmk']:
             if query.build_data['latex_interpreter'] == 'pdflatex':
                 interpreter_option = 'pdf'
@@ -50,56 +96,75 @@ class BuilderBuildLaTeX(builder_build.BuilderBuild):
         else:
             build_command = build_command_defaults[query.build_data['latex_interpreter']] + query.build_data['additional_arguments']
 
+            # decided once per build, all passes use the same format
+            if 'preamble_format' not in query.build_data:
+                query.build_data['preamble_format'] = self.preamble_format.get_format(query) if query.build_data['use_precompiled_preamble'] else None
+            if query.build_data['preamble_format'] != None:
+                build_command += ' -fmt="' + query.build_data['preamble_format'] + '"'
+
         arguments = build_command.split()
         arguments.append('-output-directory=' + os.path.dirname(query.tex_filename))
         arguments.append(query.tex_filename)
         try:
             self.process = pexpect.spawn(build_command + ' -output-directory="' + os.path.dirname(query.tex_filename) + '" "' + query.tex_filename + '"', cwd=os.path.dirname(query.tex_filename))
-        except FileNotFoundError:
+        except (FileNotFoundError, pexpect.ExceptionPexpect):
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_missing', arguments[0])
-            return
+            return False
 
+        output_reader = latex_output_reader.LaTeXOutputReader()
+        log_stream = latex_log_parser.LaTeXLogStream(self.latex_log_parser, query.tex_filename)
+        log_messages = dict()
+        has_format_error = False
         while True:
+            process = self.process
             try:
-                out = self.process.expect(['\r\n\r\n', pexpect.TIMEOUT, pexpect.EOF], timeout=20)
+                lines = output_reader.add_bytes(process.read_nonblocking(size=self.READ_SIZE, timeout=20))
             except AttributeError:
                 break
-            if out == 0:
-                pass
-            elif out == 1:
-                for line in self.process.before.split(b'\n'):
-                    if line.startswith(b'!'):
-                        self.process.sendcontrol('c')
-                        self.process.sendline('x')
-            else:
+            except pexpect.TIMEOUT:
+                if output_reader.is_waiting_for_input():
+                    process.sendcontrol('c')
+                    process.sendline('x')
+                continue
+            except pexpect.EOF:
+                self.add_live_log_messages(query, log_messages, log_stream.add_text(''.join(output_reader.finish())))
+                self.add_live_log_messages(query, log_messages, log_stream.finish())
                 break
 
-        # parse results
-        try:
-            if self.parse_build_log(query):
-                return
-        except FileNotFoundError as e:
-            self.cleanup_files(query)
-            self.throw_build_error(query, 'interpreter_not_working', 'log file missing')
-            return
-
-        query.can_sync = self.copy_synctex_file(query)
-        self.cleanup_files(query)
+            self.add_live_log_messages(query, log_messages, log_stream.add_text(''.join(lines)))
+            query.set_build_progress(output_reader.get_progress())
+            if query.build_data.get('preamble_format') != None:
+                has_format_error = has_format_error or any(self.preamble_format.is_load_error(line) for line in lines)
 
-        pdf_filename = query.tex_filename.rsplit('.tex', 1)[0] + '.pdf'
-        if query.error_count > 0:
-            if os.path.isfile(pdf_filename):
-                os.remove(pdf_filename)
-            pdf_filename = None
+            if log_stream.has_fatal_error and query.build_data['abort_on_first_error']:
+                query.build_data['aborted'] = True
+                self.stop_running()
+                break
 
-        with query.build_result_lock:
-            query.build_result = {'pdf_filename': pdf_filename, 
-                                  'has_synctex_file': query.can_sync,
-                                  'log_messages': query.log_messages,
-                                  'bibtex_log_messages': query.bibtex_log_messages,
-                                  'error': None,
-                                  'error_arg': None}
+        # a format that can't be loaded isn't used again, the pass runs without it
+        if has_format_error and not query.force_building_to_stop:
+            self.preamble_format.discard(query.build_data['preamble_format'])
+            query.build_data['preamble_format'] = None
+            query.build_data.pop('aborted', None)
+            return self.run_interpreter(query)
+        return True
+
+    def add_live_log_messages(self, query, log_messages, new_log_messages):
+        ''' Missing files (.aux, .toc, ...) are normal in early passes,
+            they are only reported from the log of the final pass. '''
+
+        is_new = False
+        for filename, file_messages in new_log_messages.items():
+            for item_type in ['error', 'warning', 'badbox']:
+                for item in file_messages[item_type]:
+                    if not item[2].startswith('No file '):
+                        if filename not in log_messages:
+                            log_messages[filename] = {'error': list(), 'warning': list(), 'badbox': list()}
+                        log_messages[filename][item_type].append(item)
+                        is_new = True
+        if is_new:
+            query.set_live_log_messages({filename: {item_type: list(items) for item_type, items in file_messages.items()} for filename, file_messages in log_messages.items()})
 
     def stop_running(self):
         if self.process != None:
@@ -112,14 +177,14 @@ class BuilderBuildLaTeX(builder_build.BuilderBuild):
         query.log_messages = list()
         query.error_count = 0
 
-        log_items = self.latex_log_parser.parse_build_log(query.tex_filename)
-        additional_jobs = self.latex_log_parser.get_additional_jobs(log_items, query)
-        file_no = 0
-
-        for job in additional_jobs:
-            query.jobs.insert(0, job)
-            return True
-
+        # the log file of a pass that was stopped may be incomplete, the
+        # live messages are used unless there were none yet
+        log_items = None
+        if query.build_data.get('aborted'):
+            with query.live_log_messages_lock:
+                log_items = query.live_log_messages
+        if log_items == None:
+            log_items = self.latex_log_parser.parse_build_log(query.tex_filename)
         for filename, items in log_items.items():
             query.error_count += len(items['error'])
             items['error'].sort(key=itemgetter(1))
@@ -127,18 +192,45 @@ class BuilderBuildLaTeX(builder_build.BuilderBuild):
             items['badbox'].sort(key=itemgetter(1))
         query.log_messages = log_items
 
-        return False
-
-    def copy_synctex_file(self, query):
-        move_from = os.path.splitext(query.tex_filename)[0] + '.synctex.gz'
-        folder = self.config_folder + '/' + base64.urlsafe_b64encode(str.encode(query.tex_filename)).decode()
-        move_to = folder + '/' + os.path.splitext(os.path.basename(query.tex_filename))[0] + '.synctex.gz'
-
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-
-        try: shutil.copyfile(move_from, move_to)
-        except FileNotFoundError: return False
-        else: return True
+    def store_synctex_file(self, query):
+        synctex_filename = os.path.splitext(query.tex_filename)[0] + '.synctex.gz'
+        return self.synctex_reader.store(query.tex_filename, synctex_filename, keep_original=not query.build_data['do_cleanup'])
+
+    def get_dependencies(self, query):
+        ''' Files the build read according to the recorder file, leaving
+            out those it wrote itself and the ones from the TeX distribution
+            (absolute paths outside the document folder). Bibliographies
+            come from the .aux or .bcf file, the preamble's files from the
+            format it was built with. None without a recorder file. '''
+
+        dirname = os.path.dirname(query.tex_filename)
+        basename = os.path.splitext(query.tex_filename)[0]
+        inputs = {query.tex_filename}
+        outputs = set()
+        try: filehandle = open(basename + '.fls', 'r', errors='ignore')
+        except FileNotFoundError: return None
+        with filehandle:
+            for line in filehandle:
+                kind, _, filename = line.rstrip('\n').partition(' ')
+                if kind == 'INPUT' and (not os.path.isabs(filename) or filename.startswith(dirname + '/')):
+                    inputs.add(os.path.normpath(os.path.join(dirname, filename)))
+                elif kind == 'OUTPUT':
+                    outputs.add(os.path.normpath(os.path.join(dirname, filename)))
+
+        for names in self.rerun_planner.bibdata_regex.findall(self.rerun_planner.read_file(basename + '.aux')):
+            for name in names.split(','):
+                name = name.strip()
+                inputs.add(os.path.normpath(os.path.join(dirname, name if name.endswith('.bib') else name + '.bib')))
+        for name in self.rerun_planner.datasource_regex.findall(self.rerun_planner.read_file(basename + '.bcf')):
+            inputs.add(os.path.normpath(os.path.join(dirname, name)))
+
+        if query.build_data.get('preamble_format') != None:
+            format_dependencies = self.preamble_format.get_format_dependencies(query.build_data['preamble_format'])
+            if format_dependencies == None: return None
+            inputs.update(format_dependencies)
+
+        # .aux, .toc, .bbl and the like are regenerated by the build
+        dependencies = [filename for filename in inputs - outputs if filename == query.tex_filename or not filename.startswith(basename + '.')]
+        return sorted(dependencies)
 
 
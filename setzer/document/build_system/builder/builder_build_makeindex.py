@@ -41,14 +41,15 @@ class BuilderBuildMakeindex(builder_build.BuilderBuild):
         query.makeindex_data['ran_on_files'].append(filename)
 
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
+            process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'makeindex missing')
             return
-        self.process.wait()
-
-        query.jobs.insert(0, 'build_latex')
+        self.process = process
+        process.communicate()
+        if process.returncode == 0:
+            self.report_success(query, 'build_makeindex')
 
     def stop_running(self):
         if self.process != None:
@@ -15,106 +15,100 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import os.path
+import os, os.path
+import mmap
+import hashlib
+import bisect
 
 from setzer.app.service_locator import ServiceLocator
 
 
 class LaTeXLogParser():
 
+    # lines of an item read by parse_log_text(), at most
+    MAX_ITEM_LINES = 12
+
     def __init__(self):
-        self.doc_regex = ServiceLocator.get_regex_object(r'(\(([^\(\)]*\.(?:tex|gls)))')
-        self.item_regex = ServiceLocator.get_regex_object(r'((?<!.) *' + 
+        doc_pattern = r'\(((?:[^()\s]|\n)*?\.(?:tex|gls))(?=[\s()\[\]{}]|$)'
+        file_context_pattern = r'(\((?=[/.~]))|(\()|(\))|\n\n'
+        item_pattern = (r'((?<!.) *' + 
     r'(?:Overfull \\hbox|Underfull \\hbox|' + 
     r'No file .*\.|File .* does not exist\.|' +
     r'(?:LaTeX|pdfTeX|LuaTeX|Package|Class) .*Warning.*:|LaTeX Font Warning:|' +
     r'!(?: )(?:LaTeX|pdfTeX|LuaTeX|Package|Class) error|' +
     r'! ).*\n)')
+
+        self.doc_regex = ServiceLocator.get_regex_object(doc_pattern)
+        self.file_context_regex = ServiceLocator.get_regex_object(file_context_pattern)
+        self.item_regex = ServiceLocator.get_regex_object(item_pattern)
         self.badbox_line_number_regex = ServiceLocator.get_regex_object(r'lines ([0-9]+)--([0-9]+)')
         self.other_line_number_regex = ServiceLocator.get_regex_object(r'(l\.| input line \n| input line )([0-9]+)( |\.)')
 
+        # for scanning the log file without decoding it
+        self.doc_bytes_regex = ServiceLocator.get_regex_object(doc_pattern.encode())
+        self.file_context_bytes_regex = ServiceLocator.get_regex_object(file_context_pattern.encode())
+        self.item_bytes_regex = ServiceLocator.get_regex_object(item_pattern.encode())
+
+        # items of the last log per root file: {filename: (region hash, items)}
+        self.previous_items = dict()
+
     def parse_build_log(self, tex_filename):
-        log_filename = os.path.dirname(tex_filename) + '/' + os.path.basename(tex_filename).rsplit('.tex', 1)[0] + '.log'
-        try: file = open(log_filename, 'rb')
-        except FileNotFoundError as e: raise e
-        else:
-            text = file.read().decode('utf-8', errors='ignore')
+        ''' The log is mapped into memory and scanned as bytes, only the
+            lines of the messages are decoded.
 
-        doc_texts = self.split_log_text_by_file(text, tex_filename)
+            Files whose part of the log is the same as in the last log of
+            tex_filename keep their items from then, only the others are
+            parsed again. '''
 
-        log_items = dict()
-        for filename, text in doc_texts.items():
-            filename = ''.join(filename.splitlines())
-            log_items[filename] = self.parse_log_text(filename, text)
+        log_filename = os.path.dirname(tex_filename) + '/' + os.path.basename(tex_filename).rsplit('.tex', 1)[0] + '.log'
+        with open(log_filename, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                self.previous_items.pop(tex_filename, None)
+                return {tex_filename: self.parse_log_text(tex_filename, '')}
+
+            previous_items = self.previous_items.get(tex_filename, dict())
+            current_items = dict()
+            log_items = dict()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log_bytes:
+                for filename, spans in self.get_file_spans(log_bytes, tex_filename).items():
+                    region_hash = self.get_region_hash(log_bytes, spans)
+                    try: previous_hash, items = previous_items[filename]
+                    except KeyError: previous_hash, items = None, None
+                    if region_hash != previous_hash:
+                        items = self.parse_log_text(filename, self.get_item_text(log_bytes, spans))
+                    current_items[filename] = (region_hash, items)
+                    log_items[filename] = items
+            self.previous_items[tex_filename] = current_items
 
         return log_items
 
-    def get_additional_jobs(self, log_items, query):
-        jobs = set()
-        rerun_latex_reasons = set()
-        for filename, items in log_items.items():
-            for item in items['error'] + items['warning']:
-
-                if item[2].startswith('No file ') and item[2].find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0 and item[2].find('.bbl.') >= 0:
-                    if not query.tex_filename.rsplit('/', 1)[1][:-4] in query.bibtex_data['ran_on_files']:
-                        jobs |= {'build_bibtex'}
-
-                elif item[2].startswith('No file ') and item[2].find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0 and item[2].find('.ind.') >= 0:
-                    if not query.tex_filename.rsplit('/', 1)[1][:-4] in query.makeindex_data['ran_on_files']:
-                        jobs |= {'build_makeindex'}
-
-                elif item[2] == 'Please (re)run Biber on the file:':
-                    line = item[3]
-                    if line.find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0:
-                        if not query.tex_filename.rsplit('/', 1)[1][:-4] in query.biber_data['ran_on_files']:
-                            jobs |= {'build_biber'}
-
-                elif item[2] == 'File `' + query.tex_filename.rsplit('/', 1)[1][:-4] + '.out\' has changed.':
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {1}
-
-                elif item[2] == 'Please rerun LaTeX.':
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {2}
-
-                elif item[2] == 'Label(s) may have changed. Rerun to get cross-references right.':
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {3}
-
-                elif item[2] == 'Citation(s) may have changed.':
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {4}
-
-                elif item[2].startswith('No file ') and item[2].find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0 and (item[2].find('.toc.') >= 0 or item[2].find('.aux.') >= 0):
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {5}
-
-                elif item[2] == 'Rerun to get transparencies right.':
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {6}
-
-                elif item[2].startswith('No file ') and item[2].find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0 and (item[2].find('.gls.') >= 0 or item[2].find('.acr.') >= 0):
-                    jobs |= {'build_glossaries'}
-
-                elif item[2].startswith('No file ') and item[2].find(query.tex_filename.rsplit('.', 1)[0].rsplit('/', 1)[1]) >= 0 and (item[2].find('.aux.') >= 0):
-                    jobs |= {'build_latex'}
-                    rerun_latex_reasons |= {7}
-
-        if 'build_biber' in jobs:
-            return {'build_biber'}
-        if 'build_bibtex' in jobs:
-            return {'build_bibtex'}
-        if 'build_makeindex' in jobs:
-            return {'build_makeindex'}
-        if 'build_glossaries' in jobs:
-            return {'build_glossaries'}
-        if 'build_latex' in jobs:
-            if len(rerun_latex_reasons - query.build_data['rerun_latex_reasons']) > 0:
-                query.build_data['rerun_latex_reasons'] = rerun_latex_reasons
-                return {'build_latex'}
-            else:
-                jobs -= {'build_latex'}
-        return jobs
+    def get_region_hash(self, log_bytes, spans):
+        region_hash = hashlib.sha1()
+        with memoryview(log_bytes) as view:
+            for start, end in spans:
+                region_hash.update(view[start:end])
+        return region_hash.digest()
+
+    def get_item_text(self, log_bytes, spans):
+        ''' The decoded lines of the items in spans of log_bytes, other
+            text is left out. '''
+
+        texts = list()
+        for start, end in spans:
+            item_starts = [match.start() for match in self.item_bytes_regex.finditer(log_bytes, start, end)]
+            for i, item_start in enumerate(item_starts):
+                item_end = item_starts[i + 1] if i + 1 < len(item_starts) else end
+                line_end = item_start
+                for j in range(self.MAX_ITEM_LINES):
+                    line_end = log_bytes.find(b'\n', line_end, item_end) + 1
+                    if line_end == 0:
+                        line_end = item_end
+                        break
+                text = log_bytes[item_start:line_end].decode('utf-8', errors='ignore')
+                if not text.endswith('\n'):
+                    text += '\n'
+                texts.append(text)
+        return ''.join(texts)
 
     def parse_log_text(self, filename, text):
         log_messages = {'error': list(), 'warning': list(), 'badbox': list()}
@@ -229,36 +223,70 @@ class LaTeXLogParser():
             return line.strip()
 
     def split_log_text_by_file(self, log_text, tex_filename):
-        doc_texts = dict()
-
-        matches = self.doc_regex.split(log_text)
-        buffer = ''
-        for match in reversed(matches):
-            if not self.doc_regex.fullmatch(match):
-                buffer += match
+        spans = self.get_file_spans(log_text, tex_filename)
+        return {filename: ''.join(log_text[start:end] for start, end in file_spans) for filename, file_spans in spans.items()}
+
+    def get_file_spans(self, log_text, tex_filename):
+        ''' Attributes each part of log_text (str, bytes or mmap) to the
+            file TeX was reading when it wrote it, in one pass with a stack
+            of open files. Returns a list of (start, end) per filename.
+
+            Other files (packages, fonts, .aux) count as the .tex or .gls
+            file that read them. Parentheses that don't open a file are
+            counted per file and forgotten at an empty line, so one left
+            open by a message can't keep a file open. Closing parentheses
+            with no file open are ignored. '''
+
+        if isinstance(log_text, str):
+            doc_regex, file_context_regex = self.doc_regex, self.file_context_regex
+        else:
+            doc_regex, file_context_regex = self.doc_bytes_regex, self.file_context_bytes_regex
+
+        spans = {tex_filename: list()}
+
+        # [filename, open parentheses that aren't files]
+        stack = [[tex_filename, 0]]
+        position = 0
+        for match in file_context_regex.finditer(log_text):
+            filename = stack[-1][0]
+            self.update_file_stack(stack, match, log_text, doc_regex, tex_filename)
+            if stack[-1][0] != filename:
+                spans[filename].append((position, match.start()))
+                position = match.start()
+                if stack[-1][0] not in spans:
+                    spans[stack[-1][0]] = list()
+        spans[stack[-1][0]].append((position, len(log_text)))
+
+        return spans
+
+    def update_file_stack(self, stack, match, log_text, doc_regex, tex_filename):
+        ''' Applies a match of file_context_regex in log_text to the stack
+            of open files, see get_file_spans(). '''
+
+        frame = stack[-1]
+        if match.lastindex == 3:
+            if frame[1] > 0:
+                frame[1] -= 1
+            elif len(stack) > 1:
+                stack.pop()
+        elif match.lastindex == None:
+            frame[1] = 0
+        else:
+            doc_match = doc_regex.match(log_text, match.start())
+            if doc_match != None:
+                stack.append([self.get_filename(doc_match.group(1), tex_filename), 0])
+            elif match.lastindex == 1:
+                stack.append([frame[0], 0])
             else:
-                match = match.strip() + buffer
-                buffer = ''
-                filename = self.doc_regex.match(match).group(2).strip()
-                if not filename.startswith('/'):
-                    filename = os.path.normpath(os.path.dirname(tex_filename) + '/' + filename)
-                if not filename == tex_filename:
-                    open_brackets = 0
-                    char_count = 0
-                    for char in match:
-                        if char == ')':
-                            open_brackets -= 1
-                        if char == '(':
-                            open_brackets += 1
-                        char_count += 1
-                        if open_brackets == 0:
-                            break
-                    match = match[:char_count]
-                    doc_texts[filename] = match
-                    log_text = log_text.replace(match, '')
-                buffer = ''
-        doc_texts[tex_filename] = log_text
-        return doc_texts
+                frame[1] += 1
+
+    def get_filename(self, name, tex_filename):
+        if isinstance(name, bytes):
+            name = name.decode('utf-8', errors='ignore')
+        filename = ''.join(name.splitlines()).strip()
+        if not filename.startswith('/'):
+            filename = os.path.normpath(os.path.dirname(tex_filename) + '/' + filename)
+        return filename
 
     def bl_get_line_number(self, line, matchiter):
         for i in range(10):
@@ -273,3 +301,117 @@ class LaTeXLogParser():
         return -1
 
 
+class LaTeXLogStream():
+    ''' Classifies interpreter output while it comes in, with the rules of
+        LaTeXLogParser.parse_log_text(). An item is complete when the next
+        one starts, when enough lines followed for its line number, or
+        when the stream ends.
+
+        Like LaTeXLogParser.get_file_spans() it follows the files TeX opens
+        and closes, each item is filed under the file it was written in. '''
+
+    MAX_ITEM_LINES = 12
+
+    def __init__(self, log_parser, tex_filename):
+        self.log_parser = log_parser
+        self.tex_filename = tex_filename
+        self.has_fatal_error = False
+
+        # pending_text starts at pending_offset of the whole output
+        self.pending_text = ''
+        self.pending_offset = 0
+
+        # text not looked at for files yet, from context_offset on
+        self.context_text = ''
+        self.context_offset = 0
+        self.file_stack = [[tex_filename, 0]]
+
+        # the file from each offset on
+        self.file_change_offsets = [0]
+        self.file_change_filenames = [tex_filename]
+
+    def add_text(self, text):
+        ''' Returns the log messages completed by text, per filename. '''
+
+        self.update_files(text, False)
+
+        offset = self.pending_offset
+        self.pending_text += text
+        item_starts = [match.start() for match in self.log_parser.item_regex.finditer(self.pending_text)]
+
+        # text in front of the first item can't belong to any
+        if len(item_starts) == 0:
+            start = self.pending_text.rfind('\n') + 1
+            self.pending_text = self.pending_text[start:]
+            self.pending_offset = offset + start
+            return self.parse('', offset)
+        self.pending_text = self.pending_text[item_starts[0]:]
+        offset += item_starts[0]
+        self.pending_offset = offset
+
+        if self.pending_text.count('\n') > self.MAX_ITEM_LINES * len(item_starts):
+            return self.finish()
+        complete_text = self.pending_text[:item_starts[-1] - item_starts[0]]
+        self.pending_text = self.pending_text[item_starts[-1] - item_starts[0]:]
+        self.pending_offset = offset + len(complete_text)
+        return self.parse(complete_text, offset)
+
+    def finish(self):
+        self.update_files('', True)
+
+        offset = self.pending_offset
+        complete_text = self.pending_text
+        self.pending_text = ''
+        self.pending_offset = offset + len(complete_text)
+        return self.parse(complete_text, offset)
+
+    def update_files(self, text, is_final):
+        ''' File names can go on in the next line, the last line is looked
+            at when more text came in. '''
+
+        self.context_text += text
+        if is_final:
+            limit = len(self.context_text)
+        else:
+            limit = max(self.context_text.rfind('\n', 0, len(self.context_text) - 1), 0)
+
+        log_parser = self.log_parser
+        for match in log_parser.file_context_regex.finditer(self.context_text, 0, limit):
+            filename = self.file_stack[-1][0]
+            log_parser.update_file_stack(self.file_stack, match, self.context_text, log_parser.doc_regex, self.tex_filename)
+            if self.file_stack[-1][0] != filename:
+                self.file_change_offsets.append(self.context_offset + match.start())
+                self.file_change_filenames.append(self.file_stack[-1][0])
+
+        self.context_text = self.context_text[limit:]
+        self.context_offset += limit
+
+    def get_filename(self, offset):
+        position = bisect.bisect_right(self.file_change_offsets, offset) - 1
+        return self.file_change_filenames[max(position, 0)]
+
+    def parse(self, text, offset):
+        log_messages = dict()
+        if text == '':
+            return log_messages
+        if text.startswith('!') or text.find('\n!') >= 0:
+            self.has_fatal_error = True
+
+        item_starts = [match.start() for match in self.log_parser.item_regex.finditer(text)] + [len(text)]
+        for i in range(len(item_starts) - 1):
+            filename = self.get_filename(offset + item_starts[i])
+            items = self.log_parser.parse_log_text(filename, text[item_starts[i]:item_starts[i + 1]])
+            try: file_messages = log_messages[filename]
+            except KeyError: log_messages[filename] = items
+            else:
+                for item_type, new_items in items.items():
+                    file_messages[item_type] += new_items
+
+        # older file changes are only needed for text that is still pending
+        position = bisect.bisect_right(self.file_change_offsets, self.pending_offset) - 1
+        if position > 0:
+            del(self.file_change_offsets[:position])
+            del(self.file_change_filenames[:position])
+        return log_messages
+
+
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os.path
+import codecs
+import collections
+
+from setzer.app.service_locator import ServiceLocator
+
+
+class LaTeXOutputReader(object):
+    ''' Splits interpreter output into lines as it comes in, and follows
+        the page and file TeX is at.
+
+        Only the last MAX_LINES lines are kept, and a line without end is
+        cut after MAX_LINE_LENGTH characters, so memory doesn't grow with
+        the amount of output. '''
+
+    MAX_LINES = 64
+    MAX_LINE_LENGTH = 4096
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.last_lines = collections.deque(maxlen=self.MAX_LINES)
+        self.partial_line = ''
+
+        self.page = None
+        self.filename = None
+
+        self.page_regex = ServiceLocator.get_regex_object(r'\[([0-9]+)(?=[\]\s{<]|$)')
+        self.file_regex = ServiceLocator.get_regex_object(r'\(([^()\s]*\.tex)(?=[\s()\[\]{}]|$)')
+
+    def add_bytes(self, data):
+        ''' Returns the lines completed by data, each ending with \\n. '''
+
+        lines = (self.partial_line + self.decoder.decode(data)).split('\n')
+        self.partial_line = lines.pop()
+        if len(self.partial_line) > self.MAX_LINE_LENGTH:
+            lines.append(self.partial_line[:self.MAX_LINE_LENGTH])
+            self.partial_line = ''
+        return self.add_lines(lines)
+
+    def finish(self):
+        lines = [self.partial_line + self.decoder.decode(b'', final=True)]
+        self.partial_line = ''
+        if lines[0] == '': return list()
+        return self.add_lines(lines)
+
+    def add_lines(self, lines):
+        result = list()
+        for line in lines:
+            line = line.rstrip('\r')
+            for match in self.page_regex.finditer(line):
+                self.page = int(match.group(1))
+            for match in self.file_regex.finditer(line):
+                self.filename = os.path.basename(match.group(1))
+            self.last_lines.append(line)
+            result.append(line + '\n')
+        return result
+
+    def get_progress(self):
+        ''' (page, filename) of the last page shipped out and the last .tex
+            file opened, None for either if there was none yet. '''
+
+        return (self.page, self.filename)
+
+    def is_waiting_for_input(self):
+        ''' TeX stopped at an error and wants the user to say how to go on. '''
+
+        if self.partial_line.startswith('!'): return True
+        return len(self.last_lines) > 0 and self.last_lines[-1].startswith('!')
+
+
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os, os.path
+import base64
+import hashlib
+import pickle
+import subprocess
+import threading
+
+
+class PreambleFormat(object):
+    ''' Formats with the preamble of a document already loaded, made with
+        the mylatexformat package. LaTeX started with such a format skips
+        the preamble, which for documents with many packages is most of
+        the time a build takes.
+
+        A format is made once the preamble stayed the same for two builds,
+        so editing the preamble doesn't pay for it every time. It's made in
+        the background, builds go on without it until it's ready. It's used
+        until the preamble, the build options or one of the files the
+        preamble read from the document folder change. If making a format
+        fails (mylatexformat missing, a package that can't be dumped), or
+        the interpreter can't load it (after a TeX update), it isn't tried
+        again for that preamble. '''
+
+    INTERPRETERS = ['pdflatex', 'xelatex']
+    TIMEOUT = 300
+
+    def __init__(self, config_folder, build_scheduler):
+        self.pathname = os.path.join(config_folder, 'preamble_formats')
+        self.build_scheduler = build_scheduler
+
+        # tex_filename: key of the preamble of the last build
+        self.last_keys = dict()
+        self.failed_keys = set()
+
+        # tex_filename: key of the format being made
+        self.keys_in_progress = dict()
+        self.lock = threading.Lock()
+
+    def get_folder(self, tex_filename):
+        return os.path.join(self.pathname, base64.urlsafe_b64encode(str.encode(tex_filename)).decode())
+
+    def get_key(self, query):
+        ''' None if the document has no preamble to precompile. '''
+
+        text = query.build_data['text']
+        position = text.find('\\begin{document}')
+        if position < 0: return None
+
+        key = hashlib.sha1()
+        for item in [query.tex_filename, query.build_data['latex_interpreter'], query.build_data['additional_arguments'], text[:position]]:
+            key.update(item.encode('utf-8', 'surrogatepass') + b'\0')
+        return key.hexdigest()
+
+    def get_format(self, query):
+        ''' The format (path without .fmt) to build query with, None to
+            build without one. May start making the format. '''
+
+        if query.build_data['latex_interpreter'] not in self.INTERPRETERS: return None
+        key = self.get_key(query)
+        with self.lock:
+            if key == None or key in self.failed_keys or self.keys_in_progress.get(query.tex_filename) == key: return None
+
+        format_name = os.path.join(self.get_folder(query.tex_filename), key)
+        if self.is_up_to_date(format_name):
+            self.last_keys[query.tex_filename] = key
+            return format_name
+
+        is_stable = (self.last_keys.get(query.tex_filename) == key)
+        self.last_keys[query.tex_filename] = key
+        if not is_stable: return None
+
+        with self.lock:
+            self.keys_in_progress[query.tex_filename] = key
+        build_data = {'latex_interpreter': query.build_data['latex_interpreter'], 'additional_arguments': query.build_data['additional_arguments']}
+        self.build_scheduler.add_job('preamble_format:' + query.tex_filename, self.build_scheduler.PRIORITY_BACKGROUND, self.run_make_format, query.tex_filename, build_data, key)
+        return None
+
+    def run_make_format(self, tex_filename, build_data, key):
+        try:
+            is_made = self.make_format(tex_filename, build_data, key)
+        except Exception:
+            is_made = False
+        with self.lock:
+            if self.keys_in_progress.get(tex_filename) == key:
+                del(self.keys_in_progress[tex_filename])
+            if not is_made:
+                self.failed_keys.add(key)
+
+    def is_load_error(self, line):
+        ''' Whether line of the interpreter output says it can't use the
+            format, e.g. one made by another TeX version. '''
+
+        if line.startswith('---! '): return True
+        return 'Fatal format file error' in line or 'I can\'t find the format file' in line
+
+    def discard(self, format_name):
+        ''' For a format the interpreter couldn't load. '''
+
+        with self.lock:
+            self.failed_keys.add(os.path.basename(format_name))
+        for ending in ['.fmt', '.pickle']:
+            try: os.remove(format_name + ending)
+            except OSError: pass
+
+    def is_up_to_date(self, format_name):
+        try:
+            with open(format_name + '.pickle', 'rb') as filehandle:
+                dependencies = pickle.load(filehandle)
+        except Exception: return False
+        if not os.path.isfile(format_name + '.fmt'): return False
+
+        for filename, state in dependencies:
+            try: stat = os.stat(filename)
+            except OSError: return False
+            if (stat.st_mtime, stat.st_size) != state: return False
+        return True
+
+    def get_format_dependencies(self, format_name):
+        ''' The format and the files from the document folder its preamble
+            read. A build with the format doesn't read them again, so they
+            don't show up in its recorder file. '''
+
+        try:
+            with open(format_name + '.pickle', 'rb') as filehandle:
+                dependencies = pickle.load(filehandle)
+        except Exception: return None
+        return [format_name + '.fmt'] + [filename for filename, state in dependencies]
+
+    def make_format(self, tex_filename, build_data, key):
+        folder = self.get_folder(tex_filename)
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        except OSError:
+            return False
+
+        # one format per document, the one of the old preamble is useless
+        for filename in os.listdir(folder):
+            try: os.remove(os.path.join(folder, filename))
+            except OSError: pass
+
+        interpreter = build_data['latex_interpreter']
+        arguments = [interpreter, '-ini', '-interaction=nonstopmode', '-recorder', '-jobname=' + key, '-output-directory=' + folder]
+        arguments += build_data['additional_arguments'].split()
+        arguments += ['&' + interpreter, 'mylatexformat.ltx', tex_filename]
+        try:
+            process = subprocess.run(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, cwd=os.path.dirname(tex_filename), timeout=self.TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        format_name = os.path.join(folder, key)
+        if process.returncode != 0 or not os.path.isfile(format_name + '.fmt'):
+            return False
+
+        dependencies = list()
+        for filename in self.get_dependencies(format_name + '.fls', tex_filename):
+            try: stat = os.stat(filename)
+            except OSError: continue
+            dependencies.append((filename, (stat.st_mtime, stat.st_size)))
+        try:
+            with open(format_name + '.pickle', 'wb') as filehandle:
+                pickle.dump(dependencies, filehandle)
+        except OSError:
+            return False
+        return True
+
+    def get_dependencies(self, fls_filename, tex_filename):
+        ''' Files from the document folder the preamble read, other than
+            the document itself. '''
+
+        dirname = os.path.dirname(tex_filename)
+        dependencies = set()
+        try: filehandle = open(fls_filename, 'r', errors='ignore')
+        except FileNotFoundError: return dependencies
+        with filehandle:
+            for line in filehandle:
+                kind, _, filename = line.rstrip('\n').partition(' ')
+                if kind == 'INPUT' and (not os.path.isabs(filename) or filename.startswith(dirname + '/')):
+                    filename = os.path.normpath(os.path.join(dirname, filename))
+                    if filename != tex_filename and os.path.dirname(filename) != os.path.dirname(fls_filename):
+                        dependencies.add(filename)
+        return dependencies
+
+
@@ -32,7 +32,18 @@ class Query(object):
         self.synctex_file = None
         self.synctex_file_lock = thread.allocate_lock()
 
-        self.build_data = {'rerun_latex_reasons': set()}
+        # messages of the LaTeX pass in progress, live_log_callback is
+        # called from the build thread when there are new ones
+        self.live_log_messages = None
+        self.live_log_messages_lock = thread.allocate_lock()
+        self.live_log_update_pending = False
+        self.live_log_callback = None
+
+        # (page, filename) the LaTeX pass in progress is at
+        self.build_progress = (None, None)
+        self.build_progress_callback = None
+
+        self.build_data = dict()
         self.biber_data = {'ran_on_files': []}
         self.bibtex_data = {'ran_on_files': []}
         self.makeindex_data = {'ran_on_files': []}
@@ -46,6 +57,9 @@ class Query(object):
         self.force_building_to_stop = False
         self.error_count = 0
 
+        # errors found by a tool (bibtex), added to error_count after it ran
+        self.tool_error_counts = dict()
+
     def get_build_result(self):
         return_value = None
         with self.build_result_lock:
@@ -74,5 +88,27 @@ class Query(object):
     def is_done(self):
         with self.done_executing_lock:
             return self.done_executing
-    
+
+    def set_live_log_messages(self, log_messages):
+        with self.live_log_messages_lock:
+            self.live_log_messages = log_messages
+            notify = not self.live_log_update_pending
+            self.live_log_update_pending = True
+        if notify and self.live_log_callback != None:
+            self.live_log_callback(self)
+
+    def get_live_log_messages(self):
+        with self.live_log_messages_lock:
+            self.live_log_update_pending = False
+            return self.live_log_messages
+
+    def set_build_progress(self, progress):
+        if progress != self.build_progress:
+            self.build_progress = progress
+            if self.build_progress_callback != None:
+                self.build_progress_callback(self)
+
+    def get_build_progress(self):
+        return self.build_progress
+
 
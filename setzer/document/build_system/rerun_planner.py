@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os.path
+import hashlib
+
+from setzer.app.service_locator import ServiceLocator
+
+
+class RerunPlanner(object):
+    ''' Decides which tool or LaTeX pass comes next, by comparing the
+        files they read with what they read the last time.
+
+        A LaTeX pass is repeated only if one of its auxiliary inputs (.aux,
+        .toc, .bbl, ...) differs from its state when the last pass started.
+        BibTeX, Biber, makeindex and makeglossaries run when their input
+        (citations and databases, .bcf, .idx, .glo) changed since they
+        last successfully ran for the file, or when their output is
+        missing. The tool state is kept between builds. '''
+
+    MAX_LATEX_PASSES = 5
+
+    # read by LaTeX at the start of a pass, written during it
+    LATEX_INPUT_ENDINGS = ['.aux', '.toc', '.lof', '.lot', '.out', '.nav', '.snm', '.bbl', '.ind', '.gls', '.acr']
+
+    def __init__(self):
+        self.tool_input_hashes = dict()
+
+        self.bibdata_regex = ServiceLocator.get_regex_object(r'\\bibdata\{([^}]*)\}')
+        self.bibtex_input_regex = ServiceLocator.get_regex_object(r'\\(?:citation|bibdata|bibstyle)\{[^}]*\}')
+        self.datasource_regex = ServiceLocator.get_regex_object(r'<bcf:datasource[^>]*>([^<]*)</bcf:datasource>')
+        self.aux_input_regex = ServiceLocator.get_regex_object(r'\\@input\{([^}]*)\}')
+
+    def on_latex_pass_start(self, query):
+        query.build_data['latex_passes'] = query.build_data.get('latex_passes', 0) + 1
+        query.build_data['latex_input_hashes'] = self.get_latex_input_hashes(query)
+
+    def is_latex_pass_needed(self, query):
+        if query.build_data.get('latex_passes', 0) == 0: return True
+        return self.get_latex_input_hashes(query) != query.build_data['latex_input_hashes']
+
+    def on_tools_done(self, query):
+        ''' Called when the LaTeX pass after the tools starts. Tools that
+            failed or were stopped keep their old state, so they run again
+            next time. '''
+
+        succeeded_tools = query.build_data.get('succeeded_tools', set())
+        for tool, input_hash in query.build_data.pop('pending_tool_hashes', dict()).items():
+            if tool in succeeded_tools:
+                self.tool_input_hashes[(query.tex_filename, tool)] = input_hash
+        query.build_data['succeeded_tools'] = set()
+
+    def get_additional_jobs(self, query):
+        ''' The next jobs after a LaTeX pass, an empty list if its result is
+            final. The tools that need to run don't depend on each other,
+            if there are several they come as a tuple, to run at the same
+            time. A LaTeX pass follows them, whether it runs is decided by
+            is_latex_pass_needed(). Tools run only if that pass is still
+            allowed. '''
+
+        if query.build_data['use_latexmk']: return []
+        if query.build_data['latex_passes'] >= self.MAX_LATEX_PASSES: return []
+
+        tools = list()
+        pending_tool_hashes = dict()
+        uses_biber = False
+        for tool in ['build_biber', 'build_bibtex', 'build_makeindex', 'build_glossaries']:
+            if tool == 'build_bibtex' and uses_biber: continue
+            input_hash = self.get_tool_input_hash(query, tool)
+            if input_hash == None: continue
+            if tool == 'build_biber':
+                uses_biber = True
+
+            key = (query.tex_filename, tool)
+            if self.tool_input_hashes.get(key) != input_hash or not self.has_tool_output(query, tool):
+                pending_tool_hashes[tool] = input_hash
+                tools.append(tool)
+        query.build_data['pending_tool_hashes'] = pending_tool_hashes
+        query.build_data['succeeded_tools'] = set()
+
+        if len(tools) == 1:
+            return [tools[0], 'build_latex']
+        elif len(tools) > 1:
+            return [tuple(tools), 'build_latex']
+        if self.is_latex_pass_needed(query):
+            return ['build_latex']
+        return []
+
+    def get_latex_input_hashes(self, query):
+        basename = os.path.splitext(query.tex_filename)[0]
+        filenames = [basename + ending for ending in self.LATEX_INPUT_ENDINGS]
+
+        # \include-d files have aux files of their own
+        aux_text = self.read_file(basename + '.aux')
+        for name in self.aux_input_regex.findall(aux_text):
+            filenames.append(os.path.join(os.path.dirname(query.tex_filename), name))
+
+        return [self.get_hash(self.read_file(filename)) for filename in filenames]
+
+    def get_tool_input_hash(self, query, tool):
+        ''' None if the tool isn't used by the document. '''
+
+        dirname = os.path.dirname(query.tex_filename)
+        basename = os.path.splitext(query.tex_filename)[0]
+
+        if tool == 'build_biber':
+            bcf_text = self.read_file(basename + '.bcf')
+            if bcf_text == '': return None
+            texts = [bcf_text] + [self.read_file(os.path.join(dirname, name)) for name in self.datasource_regex.findall(bcf_text)]
+        elif tool == 'build_bibtex':
+            aux_text = self.read_file(basename + '.aux')
+            bibdata = self.bibdata_regex.findall(aux_text)
+            if len(bibdata) == 0: return None
+            texts = self.bibtex_input_regex.findall(aux_text)
+            for names in bibdata:
+                for name in names.split(','):
+                    name = name.strip()
+                    texts.append(self.read_file(os.path.join(dirname, name if name.endswith('.bib') else name + '.bib')))
+        elif tool == 'build_makeindex':
+            texts = [self.read_file(basename + '.idx')]
+        else:
+            texts = [self.read_file(basename + '.glo'), self.read_file(basename + '.acn')]
+        if ''.join(texts) == '': return None
+        return self.get_hash('\0'.join(texts))
+
+    def has_tool_output(self, query, tool):
+        basename = os.path.splitext(query.tex_filename)[0]
+        if tool == 'build_makeindex':
+            return os.path.isfile(basename + '.ind')
+        elif tool == 'build_glossaries':
+            return os.path.isfile(basename + '.gls') or os.path.isfile(basename + '.acr')
+        return os.path.isfile(basename + '.bbl')
+
+    def get_hash(self, text):
+        ''' Missing files and files with nothing but \\relax read the same. '''
+
+        if text.replace('\\relax', '').strip() == '': return None
+        return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def read_file(self, filename):
+        try:
+            with open(filename, 'r', errors='ignore') as filehandle:
+                return filehandle.read()
+        except OSError:
+            return ''
+
+
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os, os.path
+import base64
+import shutil
+import gzip
+import bisect
+import threading
+
+import setzer.helpers.grid_index as grid_index
+
+
+class SyncTeXReader(object):
+    ''' Stores the synctex file of the last build of each document in the
+        config folder and keeps it in memory, parsed. A file is read again
+        only when it changed on disk. '''
+
+    def __init__(self, config_folder):
+        self.config_folder = config_folder
+        self.files = dict()
+        self.lock = threading.Lock()
+
+    def get_synctex_filename(self, tex_filename):
+        folder = self.config_folder + '/' + base64.urlsafe_b64encode(str.encode(tex_filename)).decode()
+        return folder + '/' + os.path.splitext(os.path.basename(tex_filename))[0] + '.synctex.gz'
+
+    def store(self, tex_filename, filename, keep_original=True):
+        ''' Moves the synctex file of a build of tex_filename to the store,
+            or links it there if the original stays. The last one is
+            replaced atomically. Returns False if there is no file. '''
+
+        store_filename = self.get_synctex_filename(tex_filename)
+        temporary_filename = store_filename + '.tmp'
+        if not os.path.isdir(os.path.dirname(store_filename)):
+            os.makedirs(os.path.dirname(store_filename))
+        try: os.remove(temporary_filename)
+        except FileNotFoundError: pass
+
+        try:
+            if keep_original:
+                os.link(filename, temporary_filename)
+            else:
+                os.rename(filename, temporary_filename)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # another file system, or one without hard links
+            try: shutil.copyfile(filename, temporary_filename)
+            except FileNotFoundError: return False
+        os.replace(temporary_filename, store_filename)
+
+        # read it now, so the first sync after the build doesn't have to
+        self.get_file(store_filename, os.path.dirname(tex_filename))
+        return True
+
+    def get_file_by_tex_filename(self, tex_filename):
+        return self.get_file(self.get_synctex_filename(tex_filename), os.path.dirname(tex_filename))
+
+    def get_file(self, filename, dirname):
+        ''' The SyncTeXFile for filename, None if it can't be read.
+            Relative input paths in it are relative to dirname. '''
+
+        try: stat = os.stat(filename)
+        except OSError: return None
+        file_state = (stat.st_mtime, stat.st_size)
+
+        with self.lock:
+            try: synctex_file = self.files[filename]
+            except KeyError: synctex_file = None
+            if synctex_file != None and synctex_file.file_state == file_state:
+                return synctex_file
+
+            try: synctex_file = SyncTeXFile(filename, dirname, file_state)
+            except (OSError, EOFError, ValueError):
+                self.files.pop(filename, None)
+                return None
+            self.files[filename] = synctex_file
+            return synctex_file
+
+    def evict(self, open_tex_filenames):
+        ''' Forgets the synctex files of documents that aren't open, and
+            removes them from the store. '''
+
+        keep = {self.get_synctex_filename(tex_filename) for tex_filename in open_tex_filenames if tex_filename != None}
+        with self.lock:
+            for filename in list(self.files):
+                if filename not in keep:
+                    del(self.files[filename])
+
+        try: names = os.listdir(self.config_folder)
+        except OSError: return
+        for name in names:
+            folder = os.path.join(self.config_folder, name)
+            if not os.path.isdir(folder): continue
+            try: tex_filename = base64.urlsafe_b64decode(name.encode()).decode()
+            except (ValueError, UnicodeDecodeError): continue
+            if not tex_filename.endswith('.tex'): continue
+
+            try:
+                for filename in os.listdir(folder):
+                    filename = os.path.join(folder, filename)
+                    if filename.endswith('.synctex.gz') and filename not in keep:
+                        os.remove(filename)
+                if len(os.listdir(folder)) == 0:
+                    os.rmdir(folder)
+            except OSError:
+                continue
+
+
+class SyncTeXFile(object):
+    ''' The boxes of a .synctex.gz file, indexed by input line for forward
+        sync and by page, with a grid per page, for backward sync.
+
+        Boxes are hboxes: (page, tag, line, left, top, right, bottom), in
+        big points from the top left corner of the page. For each hbox the
+        positions of the nodes inside (glue, kerns, math) are kept as well,
+        to tell which input line a point in a paragraph line comes from. '''
+
+    SP_PER_BP = 65781.76
+
+    def __init__(self, filename, dirname, file_state=None):
+        self.filename = filename
+        self.dirname = dirname
+        self.file_state = file_state
+
+        self.inputs = dict()
+        self.tags = dict()
+        self.boxes = list()
+
+        # box index: [(h, tag, line), ...] sorted by h
+        self.box_nodes = dict()
+
+        # (tag, line): [box index, ...]
+        self.boxes_by_line = dict()
+
+        # tag: sorted lines
+        self.lines_by_tag = dict()
+
+        # page: [box index, ...]
+        self.boxes_by_page = dict()
+        self.page_grids = dict()
+        self.page_grids_lock = threading.Lock()
+
+        with gzip.open(filename, 'rt', encoding='utf-8', errors='surrogateescape') as filehandle:
+            self.parse(filehandle)
+
+    def parse(self, lines):
+        unit = 1
+        magnification = 1000
+        x_offset = 0
+        y_offset = 0
+        for line in lines:
+            if line.startswith('Input:'):
+                self.add_input(line)
+            elif line.startswith('Unit:'):
+                unit = int(line[5:])
+            elif line.startswith('Magnification:'):
+                magnification = int(line[14:])
+            elif line.startswith('X Offset:'):
+                x_offset = int(line[9:])
+            elif line.startswith('Y Offset:'):
+                y_offset = int(line[9:])
+            elif line.startswith('Content:'):
+                break
+
+        # like the synctex tool, coordinates include TeX's 1in origin
+        self.factor = unit * magnification / 1000 / self.SP_PER_BP
+        self.x_offset = 72 + x_offset * self.factor
+        self.y_offset = 72 + y_offset * self.factor
+
+        page = 0
+        stack = list()
+        for line in lines:
+            kind = line[:1]
+            try:
+                if kind == '(' or kind == 'h':
+                    tag, line_number, h, v, width, height, depth = self.get_values(line)
+                    index = len(self.boxes)
+                    self.boxes.append((page, tag, line_number, h, v - height, h + width, v + depth))
+                    self.box_nodes[index] = [(h, tag, line_number)]
+                    self.add_line(tag, line_number, index)
+                    try: self.boxes_by_page[page].append(index)
+                    except KeyError: self.boxes_by_page[page] = [index]
+                    if kind == '(':
+                        stack.append(index)
+                elif kind == '[':
+                    stack.append(None)
+                elif kind == ')' or kind == ']':
+                    if len(stack) > 0: stack.pop()
+                elif kind in ['k', 'g', '$', 'x', 'v']:
+                    tag, line_number, h = self.get_values(line)[:3]
+                    if len(stack) > 0 and stack[-1] != None:
+                        self.box_nodes[stack[-1]].append((h, tag, line_number))
+                        self.add_line(tag, line_number, stack[-1])
+                elif kind == '{':
+                    page = int(line[1:])
+                    del(stack[:])
+                elif line.startswith('Input:'):
+                    self.add_input(line)
+                elif line.startswith('Postamble:'):
+                    break
+            except (ValueError, IndexError):
+                continue
+
+        for nodes in self.box_nodes.values():
+            nodes.sort()
+        for key, indices in self.boxes_by_line.items():
+            self.boxes_by_line[key] = sorted(set(indices))
+            try: self.lines_by_tag[key[0]].append(key[1])
+            except KeyError: self.lines_by_tag[key[0]] = [key[1]]
+        for lines in self.lines_by_tag.values():
+            lines.sort()
+
+    def get_values(self, line):
+        ''' tag, line, h, v, width, height, depth of a record like
+            (1,10:4736286,3379477:22609920,655360,0 '''
+
+        link, _, coordinates = line[1:].partition(':')
+        link = link.split(',')
+        values = [int(link[0]), int(link[1])]
+        for part in coordinates.split(':'):
+            values += [int(value) for value in part.split(',')]
+        values[2] = values[2] * self.factor + self.x_offset
+        if len(values) > 3:
+            values[3] = values[3] * self.factor + self.y_offset
+        for i in range(4, len(values)):
+            values[i] = values[i] * self.factor
+        return values
+
+    def add_input(self, line):
+        tag, _, filename = line[6:].rstrip('\n').partition(':')
+        filename = os.path.normpath(os.path.join(self.dirname, filename))
+        self.inputs[int(tag)] = filename
+        self.tags[filename] = int(tag)
+
+    def add_line(self, tag, line, index):
+        try: self.boxes_by_line[(tag, line)].append(index)
+        except KeyError: self.boxes_by_line[(tag, line)] = [index]
+
+    def forward_sync(self, filename, line):
+        ''' Rectangles (dicts with page, h, v, width, height) of the boxes
+            made from line of filename, or from the next line after it that
+            has some. v is the bottom, h the left edge. '''
+
+        try: tag = self.tags[os.path.normpath(filename)]
+        except KeyError: return list()
+        lines = self.lines_by_tag.get(tag, list())
+        if len(lines) == 0: return list()
+
+        position = bisect.bisect_left(lines, line)
+        line = lines[position] if position < len(lines) else lines[-1]
+
+        rectangles = list()
+        for index in self.boxes_by_line[(tag, line)]:
+            page, tag, line_number, left, top, right, bottom = self.boxes[index]
+            if right - left <= 0 or bottom - top <= 0: continue
+            rectangles.append({'page': page, 'h': left, 'v': bottom, 'width': right - left, 'height': bottom - top})
+        return rectangles
+
+    def backward_sync(self, page, x, y):
+        ''' (filename, line) of the point (x, y) on page, None if the page
+            has no boxes. Of the boxes containing the point the smallest
+            wins, if there are none the closest one. '''
+
+        grid = self.get_page_grid(page)
+        rectangles = grid.get_at(x, y)
+        if len(rectangles) > 0:
+            index = min(rectangles, key=lambda rectangle: (rectangle[2] - rectangle[0]) * (rectangle[3] - rectangle[1]))[4]
+        else:
+            rectangle = grid.get_nearest(x, y)
+            if rectangle == None: return None
+            index = rectangle[4]
+
+        tag, line = self.get_node_link(index, x)
+        try: return (self.inputs[tag], line)
+        except KeyError: return None
+
+    def get_page_grid(self, page):
+        ''' Grids are made for a page when it's first clicked. '''
+
+        with self.page_grids_lock:
+            try: return self.page_grids[page]
+            except KeyError: pass
+
+            grid = grid_index.GridIndex()
+            for index in self.boxes_by_page.get(page, list()):
+                left, top, right, bottom = self.boxes[index][3:]
+                grid.add(left, top, right, bottom, index)
+            self.page_grids[page] = grid
+            return grid
+
+    def get_node_link(self, index, x):
+        ''' tag and line of the last node in the box left of x, nodes from
+            other files than .tex files (packages, classes) are skipped. '''
+
+        nodes = self.box_nodes[index]
+        position = bisect.bisect_right(nodes, (x, float('inf'), float('inf')))
+        for node in reversed(nodes[:position]):
+            if self.inputs.get(node[1], '').endswith('.tex'):
+                return node[1:]
+        for node in nodes[position:]:
+            if self.inputs.get(node[1], '').endswith('.tex'):
+                return node[1:]
+        return nodes[max(position - 1, 0)][1:]
+
+
@@ -46,6 +46,7 @@ class BuildWidget(Observable):
         self.document.connect('filename_change', self.on_filename_change)
         self.document.build_system.connect('build_state_change', self.on_build_state_change)
         self.document.build_system.connect('build_state', self.on_build_state)
+        self.document.build_system.connect('build_progress', self.on_build_progress)
         self.settings.connect('settings_changed', self.on_settings_changed)
 
     def on_filename_change(self, document, filename):
@@ -87,6 +88,15 @@ class BuildWidget(Observable):
     def on_build_state(self, build_system, message):
         self.show_message(message)
 
+    def on_build_progress(self, build_system, progress):
+        page, filename = progress
+        text = ''
+        if filename != None:
+            text += filename
+        if page != None:
+            text += (', ' if text != '' else '') + _('page {number}').format(number=str(page))
+        self.view.set_progress(text)
+
     def on_settings_changed(self, settings, parameter):
         section, item, value = parameter
         if (section, item) == ('preferences', 'cleanup_build_files'):
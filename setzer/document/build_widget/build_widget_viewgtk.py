@@ -30,6 +30,7 @@ class BuildWidgetView(Gtk.HBox):
 
         self.timer = 0
         self.timer_active = False
+        self.progress = ''
         self.state_change_count = 0
         
         self.build_button = Gtk.Button.new_from_icon_name('builder-build-symbolic', Gtk.IconSize.MENU)
@@ -71,7 +72,10 @@ class BuildWidgetView(Gtk.HBox):
         if self.timer_active:
             self.timer += 50
             if self.timer // 1000 >= 1:
-                self.label.set_text('{}:{:02}'.format(self.timer // 60000, (self.timer % 60000) // 1000))
+                text = '{}:{:02}'.format(self.timer // 60000, (self.timer % 60000) // 1000)
+                if self.progress != '':
+                    text += ' (' + self.progress + ')'
+                self.label.set_text(text)
                 self.set_size_request(max(self.label.get_allocated_width(), self.label.get_size_request()[0]), -1)
         return self.timer_active
 
@@ -80,9 +84,13 @@ class BuildWidgetView(Gtk.HBox):
 
     def reset_timer(self):
         self.timer = 0
+        self.progress = ''
         self.label.set_text('')
         self.build_timer.set_size_request(-1, -1)
     
+    def set_progress(self, text):
+        self.progress = text
+
     def show_timer(self):
         self.state_change_count += 1
         GObject.timeout_add(5, self.reveal, self.state_change_count)
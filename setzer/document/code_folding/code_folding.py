@@ -34,11 +34,8 @@ class CodeFolding(Observable):
 
         self.is_enabled = False
 
-        self.blocks = list()
-        self.marks_start = dict()
         self.folding_regions = dict()
-        self.folding_regions_by_region_id = dict()
-        self.maximum_region_id = 0
+        self.folding_regions_by_block = dict()
         self.initial_folded_regions_set = False
         self.initial_folding_done = False
         self.initial_folding_regions_checked_count = 0
@@ -52,52 +49,66 @@ class CodeFolding(Observable):
 
         self.document.content.connect('text_inserted', self.on_text_inserted)
         self.document.content.connect('text_deleted', self.on_text_deleted)
-        self.document.content.connect('buffer_changed', self.on_buffer_changed)
+        self.document.content.connect('blocks_changed', self.on_blocks_changed)
 
     def on_text_inserted(self, content, parameter):
+        if not self.is_enabled: return
+
         buffer, location_iter, text, text_length = parameter
         length = len(text)
-        offset = location_iter.get_offset() + length
-        marks_start = dict()
-        for index, region_id in self.marks_start.items():
-            if index < offset:
-                marks_start[index] = region_id
-            else:
-                index2 = index + length
-                region = self.folding_regions_by_region_id[region_id]
-                region['offset_start'] = index2
-                marks_start[index2] = region_id
-        self.marks_start = marks_start
+        line_count = text.count('\n')
+        offset = location_iter.get_offset()
+        for region in self.folding_regions_by_block.values():
+            if region['offset_start'] >= offset:
+                region['offset_start'] += length
+                region['starting_line'] += line_count
+            if region['offset_end'] >= offset:
+                region['offset_end'] += length
+                region['ending_line'] += line_count
+        if line_count > 0:
+            self.folding_regions = self.get_folding_regions_by_line()
 
     def on_text_deleted(self, content, parameter):
+        if not self.is_enabled: return
+
         buffer, start_iter, end_iter = parameter
         offset_start = start_iter.get_offset()
         offset_end = end_iter.get_offset()
+        line_start = start_iter.get_line()
         length = offset_end - offset_start
-        marks_start = dict()
-        for index, region_id in self.marks_start.items():
-            if index <= offset_start:
-                marks_start[index] = region_id
-            elif index >= offset_end:
-                index2 = index - length
-                region = self.folding_regions_by_region_id[region_id]
-                region['offset_start'] = index2
-                marks_start[index2] = region_id
-        self.marks_start = marks_start
-
-    def on_buffer_changed(self, content, parameter):
+        line_count = end_iter.get_line() - line_start
+        for region in self.folding_regions_by_block.values():
+            if region['offset_start'] >= offset_end:
+                region['offset_start'] -= length
+                region['starting_line'] -= line_count
+            elif region['offset_start'] > offset_start:
+                region['offset_start'] = offset_start
+                region['starting_line'] = line_start
+            if region['offset_end'] >= offset_end:
+                region['offset_end'] -= length
+                region['ending_line'] -= line_count
+            elif region['offset_end'] > offset_start:
+                region['offset_end'] = offset_start
+                region['ending_line'] = line_start
+        if line_count > 0:
+            self.folding_regions = self.get_folding_regions_by_line()
+
+    def on_blocks_changed(self, content, delta):
         if self.is_enabled:
-            self.update_folding_regions()
+            self.update_folding_regions(delta)
 
     def enable_code_folding(self):
         self.is_enabled = True
-        self.update_folding_regions()
+        self.folding_regions_by_block = dict()
+        self.update_folding_regions({'added': self.document.content.get_keyed_blocks().items(), 'removed': list(), 'moved': list()})
         self.gutter_object.show()
 
     def disable_code_folding(self):
         self.is_enabled = False
         for region in self.folding_regions.values():
             self.toggle_folding_region(region, show_region_regardless_of_state=True)
+        self.folding_regions = dict()
+        self.folding_regions_by_block = dict()
         self.gutter_object.hide()
 
     def toggle_folding_region(self, region, show_region_regardless_of_state=False, hide_region_regardless_of_state=False):
@@ -114,78 +125,42 @@ class CodeFolding(Observable):
             self.presenter.show_region(region)
         self.add_change_code('folding_state_changed', region)
 
-    def get_folding_region_by_region_id(self, region_id):
-        return self.folding_regions_by_region_id[region_id]
+    @timer
+    def update_folding_regions(self, delta):
+        ''' Apply a block delta of the parser. Regions not in the delta have
+            already been moved along with the text by on_text_inserted and
+            on_text_deleted. '''
 
-    #@timer
-    def update_folding_regions(self):
-        folding_regions = dict()
-        folding_regions_by_region_id = dict()
-        last_line = -1
-        try:
-            blocks = self.document.content.get_blocks()
-        except AttributeError:
-            return
-        if not self.blocks_changed(blocks): return
-        self.blocks = blocks
-
-        for block in blocks:
-            if block[1] != None:
-                if block[2] != last_line:
-                    region_id = self.get_mark_start_at_offset(block[0])
-                    if region_id != None:
-                        region_dict = self.get_folding_region_by_region_id(region_id)
-                        region_dict['starting_line'] = block[2]
-                        region_dict['ending_line'] = block[3]
-                        region_dict['offset_end'] = block[1]
-                        folding_regions_by_region_id[region_id] = region_dict
-                    else:
-                        self.add_mark_start(self.maximum_region_id, block[0])
-                        region_dict = {'offset_start': block[0], 'offset_end': block[1], 'is_folded': False, 'starting_line': block[2], 'ending_line': block[3], 'id': self.maximum_region_id}
-                        folding_regions_by_region_id[self.maximum_region_id] = region_dict
-                        self.maximum_region_id += 1
-                    folding_regions[block[2]] = region_dict
-                last_line = block[2]
-
-        self.delete_invalid_regions(folding_regions_by_region_id)
+        for key in delta['removed']:
+            try: region = self.folding_regions_by_block.pop(key)
+            except KeyError: continue
+            if region['is_folded']:
+                self.toggle_folding_region(region, show_region_regardless_of_state=True)
+        for key, block in list(delta['added']) + list(delta['moved']):
+            try: region = self.folding_regions_by_block[key]
+            except KeyError:
+                self.folding_regions_by_block[key] = {'offset_start': block[0], 'offset_end': block[1], 'is_folded': False, 'starting_line': block[2], 'ending_line': block[3]}
+            else:
+                region['offset_start'], region['offset_end'], region['starting_line'], region['ending_line'] = block
 
+        folding_regions = self.get_folding_regions_by_line()
+        for region in self.folding_regions.values():
+            if region['is_folded'] and folding_regions.get(region['starting_line']) is not region:
+                self.toggle_folding_region(region, show_region_regardless_of_state=True)
         self.folding_regions = folding_regions
-        self.folding_regions_by_region_id = folding_regions_by_region_id
 
         if not self.initial_folding_done:
             self.initial_folding()
 
-    #@timer
-    def delete_invalid_regions(self, folding_regions_by_region_id):
-        regions_to_delete = [region_id for region_id in self.folding_regions_by_region_id if region_id not in folding_regions_by_region_id]
-        for region_id in regions_to_delete:
-            region = self.folding_regions_by_region_id[region_id]
-            self.toggle_folding_region(region, show_region_regardless_of_state=True)
-            self.delete_mark_start(region['offset_start'])
-
-    def add_mark_start(self, region_id, offset):
-        self.marks_start[offset] = region_id
-
-    def delete_mark_start(self, offset):
-        try:
-            del(self.marks_start[offset])
-        except KeyError:
-            pass
-
-    def get_mark_start_at_offset(self, offset):
-        if offset in self.marks_start:
-            return self.marks_start[offset]
-        return None
-
-    #@timer
-    def blocks_changed(self, blocks):
-        blocks_old = self.blocks
-        if len(blocks) != len(blocks_old):
-            return True
-        for block_old, block_new in zip(blocks_old, blocks):
-            if block_old[0] != block_new[0] or block_old[1] != block_new[1]:
-                return True
-        return False
+    def get_folding_regions_by_line(self):
+        ''' One region per line, the first one starting on it. '''
+
+        folding_regions = dict()
+        for region in self.folding_regions_by_block.values():
+            line = region['starting_line']
+            if line not in folding_regions or region['offset_start'] < folding_regions[line]['offset_start']:
+                folding_regions[line] = region
+        return folding_regions
 
     def get_folded_regions(self):
         folded_regions = list()
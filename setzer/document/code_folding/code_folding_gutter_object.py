@@ -64,7 +64,7 @@ class CodeFoldingGutterObject(object):
             self.hovered_region = None
             self.source_view.queue_draw()
 
-    #@timer
+    @timer
     def on_draw(self, gutter, drawing_area, ctx, lines, current_line, offset):
         ctx.set_line_width(0)
         xoff1 = offset + 3 * self.size / 6
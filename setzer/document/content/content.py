@@ -34,6 +34,7 @@ import setzer.document.content.parser.parser_latex as parser_latex
 from setzer.app.service_locator import ServiceLocator
 from setzer.helpers.observable import Observable
 import setzer.helpers.timer as timer
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class Content(Observable):
@@ -82,6 +83,9 @@ class Content(Observable):
         self.synctex_highlight_tags = dict()
 
         self.indentation_update = None
+        self.transaction_depth = 0
+        self.transaction_changed_buffer = False
+        self.parser_flush_source_id = None
         self.indentation_tags = dict()
 
         self.placeholder_tag = self.source_buffer.create_tag('placeholder')
@@ -112,14 +116,32 @@ class Content(Observable):
 
     def on_insert_text(self, buffer, location_iter, text, text_length):
         self.parser.on_text_inserted(buffer, location_iter, text, text_length)
-        self.indentation_update = {'line_start': location_iter.get_line(), 'text_length': text_length}
+        line_start = location_iter.get_line()
+        self.add_indentation_update(line_start, line_start, text.count('\n'))
         self.add_change_code('text_inserted', (buffer, location_iter, text, text_length))
 
     def on_delete_range(self, buffer, start_iter, end_iter):
         self.parser.on_text_deleted(buffer, start_iter, end_iter)
-        self.indentation_update = {'line_start': start_iter.get_line(), 'text_length': 0}
+        line_start = start_iter.get_line()
+        self.add_indentation_update(line_start, end_iter.get_line(), line_start - end_iter.get_line())
         self.add_change_code('text_deleted', (buffer, start_iter, end_iter))
 
+    def add_indentation_update(self, line_start, line_end, line_delta):
+        ''' Lines line_start to line_end (before the edit) become
+            line_start to line_end + line_delta. Merged with the lines
+            of earlier edits not yet updated. '''
+
+        def move_line(line):
+            if line > line_end: return line + line_delta
+            if line > line_start: return line_start
+            return line
+
+        line_end_new = line_end + line_delta
+        if self.indentation_update != None:
+            line_start = min(line_start, move_line(self.indentation_update['line_start']))
+            line_end_new = max(line_end_new, move_line(self.indentation_update['line_end']))
+        self.indentation_update = {'line_start': line_start, 'line_end': line_end_new}
+
     def on_modified_changed(self, buffer):
         self.add_change_code('modified_changed')
 
@@ -130,6 +152,13 @@ class Content(Observable):
         self.add_change_code('can_redo_changed', self.undo_manager.can_redo())
 
     def on_buffer_changed(self, buffer):
+        self.parser.on_buffer_changed(buffer)
+        self.schedule_parser_flush()
+
+        if self.transaction_depth > 0:
+            self.transaction_changed_buffer = True
+            return
+
         self.update_indentation_tags()
 
         self.update_placeholder_selection()
@@ -152,12 +181,56 @@ class Content(Observable):
             self.add_change_code('insert_mark_deleted')
         self.update_selection_state()
 
+    def schedule_parser_flush(self):
+        ''' The parser runs when the main loop is idle, or once no edit came
+            in for the debounce interval (ms) from the settings. '''
+
+        interval = self.settings.get_value('preferences', 'parser_debounce_interval')
+        if interval > 0:
+            # each edit pushes the deadline back
+            if self.parser_flush_source_id != None:
+                main_loop_monitor.source_remove(self.parser_flush_source_id)
+            self.parser_flush_source_id = main_loop_monitor.timeout_add(interval, self.on_parser_flush_timeout)
+        elif self.parser_flush_source_id == None:
+            self.parser_flush_source_id = main_loop_monitor.idle_add(self.on_parser_flush_timeout)
+
+    def on_parser_flush_timeout(self):
+        self.parser_flush_source_id = None
+        self.parser.flush_pending_edits()
+        return False
+
+    def begin_transaction(self):
+        ''' Until the matching end_transaction() edits are only recorded:
+            parsing, indentation tags and the buffer_changed notification
+            happen once, at the end. Can be nested. Call end_transaction() in a
+            finally block, an unbalanced transaction stops all updates. '''
+
+        self.transaction_depth += 1
+
+    def end_transaction(self):
+        self.transaction_depth -= 1
+        if self.transaction_depth == 0 and self.transaction_changed_buffer:
+            self.transaction_changed_buffer = False
+            self.parser.flush_pending_edits()
+            self.on_buffer_changed(self.source_buffer)
+
     def initially_set_text(self, text):
+        parse_cache = ServiceLocator.get_parse_cache()
+        cache_kind = self.parser.get_cache_kind()
+        cache_data = None
+        if cache_kind != None and self.source_buffer.get_char_count() == 0:
+            cache_data = parse_cache.get(cache_kind, text)
+
         self.source_buffer.begin_not_undoable_action()
         self.source_buffer.set_text(text)
         self.source_buffer.end_not_undoable_action()
         self.source_buffer.set_modified(False)
 
+        if cache_data != None:
+            self.parser.load_cache_data(cache_data)
+        elif cache_kind != None:
+            parse_cache.set(cache_kind, text, self.parser.get_cache_data())
+
     def update_selection_state(self):
         self.add_change_code('selection_might_have_changed', self.source_buffer.get_has_selection())
 
@@ -181,14 +254,13 @@ class Content(Observable):
     def get_can_redo(self):
         return self.undo_manager.can_redo()
 
-    #@timer.timer
+    @timer.timer
     def update_indentation_tags(self):
         if self.indentation_update != None:
             start_iter = self.source_buffer.get_iter_at_line(self.indentation_update['line_start'])
-            end_iter = start_iter.copy()
-            end_iter.forward_chars(self.indentation_update['text_length'])
-            end_iter.forward_to_line_end()
-            start_iter.set_line_offset(0)
+            end_iter = self.source_buffer.get_iter_at_line(self.indentation_update['line_end'])
+            if not end_iter.ends_line():
+                end_iter.forward_to_line_end()
             text = self.source_buffer.get_text(start_iter, end_iter, True)
             for count, line in enumerate(text.splitlines()):
                 for tag in start_iter.get_tags():
@@ -231,97 +303,101 @@ class Content(Observable):
         self.insert_text_at_cursor(text, indent_lines)
 
     def insert_text_at_cursor(self, text, indent_lines=True, select_dot=True):
+        self.begin_transaction()
         self.source_buffer.begin_user_action()
+        try:
+            # replace tabs with spaces, if set in preferences
+            if self.spaces_instead_of_tabs:
+                number_of_spaces = self.tab_width
+                text = text.replace('\t', ' ' * number_of_spaces)
 
-        # replace tabs with spaces, if set in preferences
-        if self.spaces_instead_of_tabs:
-            number_of_spaces = self.tab_width
-            text = text.replace('\t', ' ' * number_of_spaces)
-
-        dotcount = text.count('•')
-        insert_iter = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
-        bounds = self.source_buffer.get_selection_bounds()
-        selection = ''
-        if dotcount == 1:
+            dotcount = text.count('•')
+            insert_iter = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
             bounds = self.source_buffer.get_selection_bounds()
-            if len(bounds) > 0:
-                selection = self.source_buffer.get_text(bounds[0], bounds[1], True)
-                if len(selection) > 0:
-                    text = text.replace('•', selection, 1)
-
-        if indent_lines:
-            line_iter = self.source_buffer.get_iter_at_line(insert_iter.get_line())
-            ws_line = self.source_buffer.get_text(line_iter, insert_iter, False)
-            lines = text.split('\n')
-            ws_number = len(ws_line) - len(ws_line.lstrip())
-            whitespace = ws_line[:ws_number]
-            final_text = ''
-            for no, line in enumerate(lines):
-                if no != 0:
-                    final_text += '\n' + whitespace
-                final_text += line
-        else:
-            final_text = text
-
-        self.source_buffer.delete_selection(False, False)
-        self.source_buffer.insert_at_cursor(final_text)
-
-        if select_dot:
-            dotindex = final_text.find('•')
-            if dotcount > 0:
-                selection_len = len(selection) if dotcount == 1 else 0
-                start = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
-                start.backward_chars(abs(dotindex + selection_len - len(final_text)))
-                self.source_buffer.place_cursor(start)
-                end = start.copy()
-                end.forward_char()
-                self.source_buffer.select_range(start, end)
-
-        self.source_buffer.end_user_action()
+            selection = ''
+            if dotcount == 1:
+                bounds = self.source_buffer.get_selection_bounds()
+                if len(bounds) > 0:
+                    selection = self.source_buffer.get_text(bounds[0], bounds[1], True)
+                    if len(selection) > 0:
+                        text = text.replace('•', selection, 1)
+
+            if indent_lines:
+                line_iter = self.source_buffer.get_iter_at_line(insert_iter.get_line())
+                ws_line = self.source_buffer.get_text(line_iter, insert_iter, False)
+                lines = text.split('\n')
+                ws_number = len(ws_line) - len(ws_line.lstrip())
+                whitespace = ws_line[:ws_number]
+                final_text = ''
+                for no, line in enumerate(lines):
+                    if no != 0:
+                        final_text += '\n' + whitespace
+                    final_text += line
+            else:
+                final_text = text
+
+            self.source_buffer.delete_selection(False, False)
+            self.source_buffer.insert_at_cursor(final_text)
+
+            if select_dot:
+                dotindex = final_text.find('•')
+                if dotcount > 0:
+                    selection_len = len(selection) if dotcount == 1 else 0
+                    start = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
+                    start.backward_chars(abs(dotindex + selection_len - len(final_text)))
+                    self.source_buffer.place_cursor(start)
+                    end = start.copy()
+                    end.forward_char()
+                    self.source_buffer.select_range(start, end)
+        finally:
+            self.source_buffer.end_user_action()
+            self.end_transaction()
 
     def insert_template(self, template_start, template_end):
+        self.begin_transaction()
         self.source_buffer.begin_user_action()
+        try:
+            bounds = self.source_buffer.get_bounds()
+            text = self.source_buffer.get_text(bounds[0], bounds[1], True)
+            line_count_before_insert = self.source_buffer.get_line_count()
 
-        bounds = self.source_buffer.get_bounds()
-        text = self.source_buffer.get_text(bounds[0], bounds[1], True)
-        line_count_before_insert = self.source_buffer.get_line_count()
-
-        # replace tabs with spaces, if set in preferences
-        if self.settings.get_value('preferences', 'spaces_instead_of_tabs'):
-            number_of_spaces = self.settings.get_value('preferences', 'tab_width')
-            template_start = template_start.replace('\t', ' ' * number_of_spaces)
-            template_end = template_end.replace('\t', ' ' * number_of_spaces)
+            # replace tabs with spaces, if set in preferences
+            if self.settings.get_value('preferences', 'spaces_instead_of_tabs'):
+                number_of_spaces = self.settings.get_value('preferences', 'tab_width')
+                template_start = template_start.replace('\t', ' ' * number_of_spaces)
+                template_end = template_end.replace('\t', ' ' * number_of_spaces)
 
-        bounds = self.source_buffer.get_bounds()
-        self.source_buffer.insert(bounds[0], template_start)
-        bounds = self.source_buffer.get_bounds()
-        self.source_buffer.insert(bounds[1], template_end)
+            bounds = self.source_buffer.get_bounds()
+            self.source_buffer.insert(bounds[0], template_start)
+            bounds = self.source_buffer.get_bounds()
+            self.source_buffer.insert(bounds[1], template_end)
 
-        bounds = self.source_buffer.get_bounds()
-        bounds[0].forward_chars(len(template_start))
-        self.source_buffer.place_cursor(bounds[0])
+            bounds = self.source_buffer.get_bounds()
+            bounds[0].forward_chars(len(template_start))
+            self.source_buffer.place_cursor(bounds[0])
 
-        self.source_buffer.end_user_action()
-        self.source_buffer.begin_user_action()
+            self.source_buffer.end_user_action()
+            self.source_buffer.begin_user_action()
 
-        if len(text.strip()) > 0:
-            note = _('''% NOTE: The content of your document has been commented out
+            if len(text.strip()) > 0:
+                note = _('''% NOTE: The content of your document has been commented out
 % by the wizard. Just do a CTRL+Z (undo) to put it back in
 % or remove the "%" before each line you want to keep.
 % You can remove this note as well.
 % 
 ''')
-            note_len = len(note)
-            note_number_of_lines = note.count('\n')
-            offset = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert()).get_line()
-            self.source_buffer.insert(self.source_buffer.get_iter_at_line(offset), note)
-            for line_number in range(offset + note_number_of_lines, line_count_before_insert + offset + note_number_of_lines):
-                self.source_buffer.insert(self.source_buffer.get_iter_at_line(line_number), '% ')
-            insert_iter = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
-            insert_iter.backward_chars(note_len + 2)
-            self.source_buffer.place_cursor(insert_iter)
-
-        self.source_buffer.end_user_action()
+                note_len = len(note)
+                note_number_of_lines = note.count('\n')
+                offset = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert()).get_line()
+                self.source_buffer.insert(self.source_buffer.get_iter_at_line(offset), note)
+                for line_number in range(offset + note_number_of_lines, line_count_before_insert + offset + note_number_of_lines):
+                    self.source_buffer.insert(self.source_buffer.get_iter_at_line(line_number), '% ')
+                insert_iter = self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert())
+                insert_iter.backward_chars(note_len + 2)
+                self.source_buffer.place_cursor(insert_iter)
+        finally:
+            self.source_buffer.end_user_action()
+            self.end_transaction()
 
     def replace_range_by_offset_and_length(self, offset, length, text, indent_lines=True, select_dot=True):
         start_iter = self.source_buffer.get_iter_at_offset(offset)
@@ -334,30 +410,34 @@ class Content(Observable):
         self.source_buffer.end_user_action()
 
     def replace_range_no_user_action(self, start_iter, end_iter, text, indent_lines=True, select_dot=True):
-        if indent_lines:
-            line_iter = self.source_buffer.get_iter_at_line(start_iter.get_line())
-            ws_line = self.source_buffer.get_text(line_iter, start_iter, False)
-            lines = text.split('\n')
-            ws_number = len(ws_line) - len(ws_line.lstrip())
-            whitespace = ws_line[:ws_number]
-            final_text = ''
-            for no, line in enumerate(lines):
-                if no != 0:
-                    final_text += '\n' + whitespace
-                final_text += line
-        else:
-            final_text = text
+        self.begin_transaction()
+        try:
+            if indent_lines:
+                line_iter = self.source_buffer.get_iter_at_line(start_iter.get_line())
+                ws_line = self.source_buffer.get_text(line_iter, start_iter, False)
+                lines = text.split('\n')
+                ws_number = len(ws_line) - len(ws_line.lstrip())
+                whitespace = ws_line[:ws_number]
+                final_text = ''
+                for no, line in enumerate(lines):
+                    if no != 0:
+                        final_text += '\n' + whitespace
+                    final_text += line
+            else:
+                final_text = text
 
-        self.source_buffer.delete(start_iter, end_iter)
-        self.source_buffer.insert(start_iter, final_text)
+            self.source_buffer.delete(start_iter, end_iter)
+            self.source_buffer.insert(start_iter, final_text)
 
-        if select_dot:
-            dotindex = final_text.find('•')
-            if dotindex > -1:
-                start_iter.backward_chars(abs(dotindex - len(final_text)))
-                bound = start_iter.copy()
-                bound.forward_chars(1)
-                self.source_buffer.select_range(start_iter, bound)
+            if select_dot:
+                dotindex = final_text.find('•')
+                if dotindex > -1:
+                    start_iter.backward_chars(abs(dotindex - len(final_text)))
+                    bound = start_iter.copy()
+                    bound.forward_chars(1)
+                    self.source_buffer.select_range(start_iter, bound)
+        finally:
+            self.end_transaction()
 
     def insert_before_after(self, before, after):
         bounds = self.source_buffer.get_selection_bounds()
@@ -370,36 +450,38 @@ class Content(Observable):
             self.insert_text_at_cursor(text)
 
     def comment_uncomment(self):
+        self.begin_transaction()
         self.source_buffer.begin_user_action()
+        try:
+            bounds = self.source_buffer.get_selection_bounds()
 
-        bounds = self.source_buffer.get_selection_bounds()
-
-        if len(bounds) > 1:
-            end = (bounds[1].get_line() + 1) if (bounds[1].get_line_index() > 0) else bounds[1].get_line()
-            line_numbers = list(range(bounds[0].get_line(), end))
-        else:
-            line_numbers = [self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert()).get_line()]
-
-        do_comment = False
-        for line_number in line_numbers:
-            line = self.get_line(line_number)
-            if not line.lstrip().startswith('%'):
-                do_comment = True
+            if len(bounds) > 1:
+                end = (bounds[1].get_line() + 1) if (bounds[1].get_line_index() > 0) else bounds[1].get_line()
+                line_numbers = list(range(bounds[0].get_line(), end))
+            else:
+                line_numbers = [self.source_buffer.get_iter_at_mark(self.source_buffer.get_insert()).get_line()]
 
-        if do_comment:
-            for line_number in line_numbers:
-                self.source_buffer.insert(self.source_buffer.get_iter_at_line(line_number), '%')
-        else:
+            do_comment = False
             for line_number in line_numbers:
-                line = self.source_buffer.get_line(line_number)
-                offset = len(line) - len(line.lstrip())
-                start = self.source_buffer.get_iter_at_line(line_number)
-                start.forward_chars(offset)
-                end = start.copy()
-                end.forward_char()
-                self.source_buffer.delete(start, end)
+                line = self.get_line(line_number)
+                if not line.lstrip().startswith('%'):
+                    do_comment = True
 
-        self.source_buffer.end_user_action()
+            if do_comment:
+                for line_number in line_numbers:
+                    self.source_buffer.insert(self.source_buffer.get_iter_at_line(line_number), '%')
+            else:
+                for line_number in line_numbers:
+                    line = self.source_buffer.get_line(line_number)
+                    offset = len(line) - len(line.lstrip())
+                    start = self.source_buffer.get_iter_at_line(line_number)
+                    start.forward_chars(offset)
+                    end = start.copy()
+                    end.forward_char()
+                    self.source_buffer.delete(start, end)
+        finally:
+            self.source_buffer.end_user_action()
+            self.end_transaction()
 
     def add_backslash_with_space(self):
         self.source_buffer.insert_at_cursor('\\ ')
@@ -748,7 +830,14 @@ class Content(Observable):
         line_height = self.font_manager.get_line_height()
         return math.floor(self.source_view.get_visible_rect().height / line_height)
 
+    def update_symbols(self):
+        ''' Parse pending edits now instead of after the debounce interval,
+            symbols_changed is published for them. '''
+
+        self.parser.flush_pending_edits()
+
     def get_bibitems(self):
+        self.parser.flush_pending_edits()
         return self.symbols['bibitems']
 
     def add_packages(self, packages):
@@ -763,8 +852,9 @@ class Content(Observable):
         if package_data:
             max_end = 0
             for package in package_data.items():
-                if package[1].end() > max_end:
-                    max_end = package[1].end()
+                end = self.parser.get_symbol_offset(package[1]) + len(package[1].group(0))
+                if end > max_end:
+                    max_end = end
             insert_iter = self.source_buffer.get_iter_at_offset(max_end)
             if not insert_iter.ends_line():
                 insert_iter.forward_to_line_end()
@@ -779,38 +869,54 @@ class Content(Observable):
                 self.insert_text_at_cursor(text)
 
     def remove_packages(self, packages):
-        packages_dict = self.get_package_details()
-        for package in packages:
-            try:
-                match_obj = packages_dict[package]
-            except KeyError: return
-            start_iter = self.source_buffer.get_iter_at_offset(match_obj.start())
-            end_iter = self.source_buffer.get_iter_at_offset(match_obj.end())
-            text = self.source_buffer.get_text(start_iter, end_iter, False)
-            if text == match_obj.group(0):  
-                if start_iter.get_line_offset() == 0:
-                    start_iter.backward_char()
-                self.source_buffer.delete(start_iter, end_iter)
+        self.begin_transaction()
+        try:
+            for package in packages:
+                # positions have to be up to date after each deletion
+                self.parser.flush_pending_edits()
+                try:
+                    match_obj = self.symbols['packages_detailed'][package]
+                except KeyError: break
+                offset = self.parser.get_symbol_offset(match_obj)
+                if offset == None: continue
+                start_iter = self.source_buffer.get_iter_at_offset(offset)
+                end_iter = self.source_buffer.get_iter_at_offset(offset + len(match_obj.group(0)))
+                text = self.source_buffer.get_text(start_iter, end_iter, False)
+                if text == match_obj.group(0):  
+                    if start_iter.get_line_offset() == 0:
+                        start_iter.backward_char()
+                    self.source_buffer.delete(start_iter, end_iter)
+        finally:
+            self.end_transaction()
 
     def get_packages(self):
+        self.parser.flush_pending_edits()
         return self.symbols['packages']
 
     def get_package_details(self):
+        self.parser.flush_pending_edits()
         return self.symbols['packages_detailed']
 
     def get_blocks(self):
+        self.parser.flush_pending_edits()
+        if self.symbols['blocks'] == None:
+            self.symbols['blocks'] = sorted(self.parser.get_keyed_blocks().values(), key=lambda block: block[0])
         return self.symbols['blocks']
 
-    def set_blocks(self, blocks):
-        self.symbols['blocks'] = blocks
+    def get_keyed_blocks(self):
+        self.parser.flush_pending_edits()
+        return self.parser.get_keyed_blocks()
 
     def get_included_latex_files(self):
+        self.parser.flush_pending_edits()
         return self.symbols['included_latex_files']
 
     def get_bibliography_files(self):
+        self.parser.flush_pending_edits()
         return self.symbols['bibliographies']
 
     def get_labels(self):
+        self.parser.flush_pending_edits()
         return self.symbols['labels']
 
 
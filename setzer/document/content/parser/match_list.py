@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+class CachedMatch(object):
+    ''' Stands in for a re.Match restored from the parse cache, only
+        group() and groups() are available. '''
+
+    def __init__(self, match_groups):
+        self.match_groups = match_groups
+
+    def group(self, index=0):
+        return self.match_groups[index]
+
+    def groups(self):
+        return self.match_groups[1:]
+
+
+def restore_items(cached_items):
+    return [(CachedMatch(match_groups), line_number, offset) for match_groups, line_number, offset in cached_items]
+
+
+class MatchList(object):
+    ''' Gap buffer of (match, line_number, offset) items, sorted by offset.
+
+        Items in front of the gap store absolute positions, items behind
+        the gap store their distance to the end of the text. An edit moves
+        the gap to its position, so only items between the old and the new
+        gap position are touched. Items behind the edit are shifted
+        implicitly by changing the length of the text.
+
+        Internally items are lists [match, line, offset, is_after_gap],
+        they are converted in place when crossing the gap, so they can be
+        looked up by match. '''
+
+    def __init__(self):
+        self.items_before_gap = list()
+
+        # reversed, the item closest to the gap comes last
+        self.items_after_gap = list()
+
+        self.items_by_match = dict()
+        self.text_length = 0
+        self.number_of_lines = 0
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def __reversed__(self):
+        text_length = self.text_length
+        number_of_lines = self.number_of_lines
+        for match, lines_to_end, chars_to_end, is_after_gap in self.items_after_gap:
+            yield (match, number_of_lines - lines_to_end, text_length - chars_to_end)
+        for match, line_number, offset, is_after_gap in reversed(self.items_before_gap):
+            yield (match, line_number, offset)
+
+    def __len__(self):
+        return len(self.items_before_gap) + len(self.items_after_gap)
+
+    def __contains__(self, match):
+        return match in self.items_by_match
+
+    def iter_from(self, index):
+        for match, line_number, offset, is_after_gap in self.items_before_gap[index:]:
+            yield (match, line_number, offset)
+        text_length = self.text_length
+        number_of_lines = self.number_of_lines
+        after = self.items_after_gap
+        start = len(after) - max(index - len(self.items_before_gap), 0) - 1
+        for i in range(start, -1, -1):
+            match, lines_to_end, chars_to_end, is_after_gap = after[i]
+            yield (match, number_of_lines - lines_to_end, text_length - chars_to_end)
+
+    def get_gap_index(self):
+        return len(self.items_before_gap)
+
+    def get_match_before_gap(self, index):
+        return self.items_before_gap[index][0]
+
+    def get_items_for_cache(self):
+        ''' Items with their matches replaced by (group(0),) + groups(),
+            so they can be pickled. See restore_items(). '''
+
+        return [((match.group(0),) + match.groups(), line_number, offset) for match, line_number, offset in self]
+
+    def get_first(self):
+        for item in self.iter_from(0):
+            return item
+        return None
+
+    def get_first_after(self, offset):
+        ''' Returns the first item behind offset, None if there is none. '''
+
+        before = self.items_before_gap
+        low, high = 0, len(before)
+        while low < high:
+            middle = (low + high) // 2
+            if before[middle][2] <= offset: low = middle + 1
+            else: high = middle
+        if low < len(before):
+            match, line_number, offset, is_after_gap = before[low]
+            return (match, line_number, offset)
+
+        # items behind the gap are ordered by their distance to the end
+        after = self.items_after_gap
+        chars_to_end_max = self.text_length - offset
+        low, high = 0, len(after)
+        while low < high:
+            middle = (low + high) // 2
+            if after[middle][2] < chars_to_end_max: low = middle + 1
+            else: high = middle
+        if low > 0:
+            match, lines_to_end, chars_to_end, is_after_gap = after[low - 1]
+            return (match, self.number_of_lines - lines_to_end, self.text_length - chars_to_end)
+        return None
+
+    def get_position(self, match):
+        ''' Returns (line_number, offset) of match, None if it's not in the list. '''
+
+        try: item = self.items_by_match[match]
+        except KeyError: return None
+        if item[3]:
+            return (self.number_of_lines - item[1], self.text_length - item[2])
+        return (item[1], item[2])
+
+    def move_gap(self, offset):
+        ''' Move the gap in front of the first item at or after offset. '''
+
+        before = self.items_before_gap
+        after = self.items_after_gap
+        text_length = self.text_length
+        number_of_lines = self.number_of_lines
+
+        while len(before) > 0 and before[-1][2] >= offset:
+            item = before.pop()
+            item[1] = number_of_lines - item[1]
+            item[2] = text_length - item[2]
+            item[3] = True
+            after.append(item)
+        while len(after) > 0 and text_length - after[-1][2] < offset:
+            item = after.pop()
+            item[1] = number_of_lines - item[1]
+            item[2] = text_length - item[2]
+            item[3] = False
+            before.append(item)
+
+    def remove_range(self, offset_start, offset_end, char_delta, line_delta):
+        ''' Remove items between offset_start and offset_end (inclusive,
+            positions before the edit) and shift the items behind by the
+            given deltas. Leaves the gap at offset_start, returns the
+            removed items. '''
+
+        self.move_gap(offset_start)
+
+        after = self.items_after_gap
+        text_length = self.text_length
+        number_of_lines = self.number_of_lines
+        removed_items = list()
+        while len(after) > 0 and text_length - after[-1][2] <= offset_end:
+            match, lines_to_end, chars_to_end, is_after_gap = after.pop()
+            del(self.items_by_match[match])
+            removed_items.append((match, number_of_lines - lines_to_end, text_length - chars_to_end))
+
+        self.text_length += char_delta
+        self.number_of_lines += line_delta
+        return removed_items
+
+    def insert_at_gap(self, items):
+        ''' Insert items (sorted, absolute positions) at the gap. They have
+            to lie between the items in front of and behind the gap. '''
+
+        for match, line_number, offset in items:
+            item = [match, line_number, offset, False]
+            self.items_before_gap.append(item)
+            self.items_by_match[match] = item
+
+    def replace_range(self, offset_start, offset_end, char_delta, line_delta, items):
+        removed_items = self.remove_range(offset_start, offset_end, char_delta, line_delta)
+        self.insert_at_gap(items)
+        return removed_items
+
+
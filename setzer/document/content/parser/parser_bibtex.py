@@ -15,35 +15,202 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-from setzer.app.service_locator import ServiceLocator
+import re
+
+import setzer.document.content.parser.match_list as match_list
+import setzer.document.content.parser.pending_edits as pending_edits
 from setzer.helpers.timer import timer
 
 
 class ParserBibTeX(object):
+    ''' Keeps the entry headers (@type{key) in a MatchList. Edits only
+        reparse the lines they touch, fields of an entry are read from the
+        buffer when they are asked for. '''
+
+    # increase when the cached data changes (e.g. the regex)
+    CACHE_VERSION = 1
+
+    # compiled once, like the regexes of ParserLaTeX
+    entry_regex = re.compile(r'@(\w+)\{(\w+)')
+    field_regex = re.compile(r'\s*,?\s*(\w+)\s*=\s*')
 
     def __init__(self, content):
         self.content = content
-        self.text = ''
+        self.pending_edits = pending_edits.PendingEdits(self)
+        self.text_length = 0
+        self.number_of_lines = 0
+        self.entry_matches = match_list.MatchList()
+        self.entry_matches_by_key = dict()
+        self.fields_by_match = dict()
+        self.symbols_changed = dict()
 
-    #@timer
     def on_text_deleted(self, buffer, start_iter, end_iter):
-        start_offset = start_iter.get_offset()
-        end_offset = end_iter.get_offset()
-        self.text = self.text[:start_offset] + self.text[end_offset:]
-        self.parse_symbols(self.text)
+        self.pending_edits.add_deletion(buffer, start_iter, end_iter)
 
-    #@timer
     def on_text_inserted(self, buffer, location_iter, text, text_length):
-        offset = location_iter.get_offset()
-        self.text = self.text[:offset] + text + self.text[offset:]
-        self.parse_symbols(self.text)
+        self.pending_edits.add_insertion(buffer, location_iter, text)
+
+    def on_buffer_changed(self, buffer):
+        self.pending_edits.on_buffer_changed(buffer)
+
+    def flush_pending_edits(self):
+        self.pending_edits.flush()
+
+    @timer
+    def parse_range(self, text, line_start, offset_line_start, offset_line_end, char_delta, line_delta):
+        ''' Reparse text, the current content of the lines between
+            offset_line_start and offset_line_end (positions before the edits). '''
+
+        self.text_length += char_delta
+        self.number_of_lines += line_delta
+        self.update_entries(text, line_start, offset_line_start, offset_line_end, char_delta, line_delta)
+
+    def get_cache_kind(self):
+        return 'bibtex-' + str(self.CACHE_VERSION)
+
+    def get_cache_data(self):
+        self.flush_pending_edits()
+        return {'text_length': self.text_length, 'number_of_lines': self.number_of_lines, 'entries': self.entry_matches.get_items_for_cache()}
+
+    @timer
+    def load_cache_data(self, data):
+        ''' Take over the entries of the same text parsed before. Only for
+            an empty parser. '''
+
+        self.pending_edits.clear()
+        self.text_length = data['text_length']
+        self.number_of_lines = data['number_of_lines']
+        self.add_entries(match_list.restore_items(data['entries']), 0, -1, self.text_length, self.number_of_lines)
+        self.publish_changes()
+
+    def publish_changes(self):
+        if len(self.symbols_changed) > 0:
+            self.content.add_change_code('symbols_changed', self.symbols_changed)
+            self.symbols_changed = dict()
+
+    def get_keyed_blocks(self):
+        return dict()
+
+    @timer
+    def update_entries(self, text, line_start, offset_line_start, offset_line_end, char_delta, line_delta):
+        additional_matches = self.parse_for_entries(text, line_start, offset_line_start)
+        self.add_entries(additional_matches, offset_line_start, offset_line_end, char_delta, line_delta)
+
+    def add_entries(self, additional_matches, offset_line_start, offset_line_end, char_delta, line_delta):
+        removed_matches = self.entry_matches.replace_range(offset_line_start, offset_line_end, char_delta, line_delta, additional_matches)
+
+        # the fields of the entry the edit happened in are outdated
+        index = self.entry_matches.get_gap_index() - len(additional_matches) - 1
+        if index >= 0:
+            try: del(self.fields_by_match[self.entry_matches.get_match_before_gap(index)])
+            except KeyError: pass
+
+        for match, line_number, offset in additional_matches:
+            key = match.group(2).strip()
+            try: self.entry_matches_by_key[key].add(match)
+            except KeyError:
+                self.entry_matches_by_key[key] = {match}
+                self.content.symbols['bibitems'].add(key)
+                self.add_symbol_change(key, 'added', 'removed')
+        for match, line_number, offset in removed_matches:
+            try: del(self.fields_by_match[match])
+            except KeyError: pass
+            key = match.group(2).strip()
+            matches = self.entry_matches_by_key[key]
+            matches.discard(match)
+            if len(matches) == 0:
+                del(self.entry_matches_by_key[key])
+                self.content.symbols['bibitems'].discard(key)
+                self.add_symbol_change(key, 'removed', 'added')
+
+    @timer
+    def parse_for_entries(self, text, line_start, offset_line_start):
+        entry_matches = list()
+        counter = line_start
+        last_match_start = 0
+        for match in self.entry_regex.finditer(text):
+            counter += text.count('\n', last_match_start, match.start())
+            last_match_start = match.start()
+            entry_matches.append((match, counter, match.start() + offset_line_start))
+        return entry_matches
+
+    def add_symbol_change(self, name, change, opposite_change):
+        try: changes = self.symbols_changed['bibitems']
+        except KeyError:
+            changes = {'added': set(), 'removed': set()}
+            self.symbols_changed['bibitems'] = changes
+        if name in changes[opposite_change]:
+            changes[opposite_change].discard(name)
+            if len(changes['added']) + len(changes['removed']) == 0:
+                del(self.symbols_changed['bibitems'])
+        else:
+            changes[change].add(name)
+
+    def get_entry_keys(self):
+        self.flush_pending_edits()
+        return self.entry_matches_by_key.keys()
+
+    def get_entry(self, key):
+        ''' Returns a dict with offset, line, type and fields of the entry
+            with the given key (the last one, if there are several), None if
+            there is no such entry. '''
+
+        # positions of pending edits don't match the buffer yet
+        self.flush_pending_edits()
+        try: matches = self.entry_matches_by_key[key]
+        except KeyError: return None
+
+        match = max(matches, key=lambda match: self.entry_matches.get_position(match)[1])
+        line_number, offset = self.entry_matches.get_position(match)
+        try: fields = self.fields_by_match[match]
+        except KeyError:
+            fields = self.parse_fields(self.get_entry_text(match, offset))
+            self.fields_by_match[match] = fields
+        return {'offset': offset, 'line': line_number, 'type': match.group(1).lower(), 'fields': fields}
+
+    def get_entry_text(self, match, offset):
+        ''' The text between the header of the entry and the next one. '''
+
+        buffer = self.content.source_buffer
+        start_iter = buffer.get_iter_at_offset(offset + len(match.group(0)))
+        next_match = self.entry_matches.get_first_after(offset)
+        if next_match != None:
+            end_iter = buffer.get_iter_at_offset(next_match[2])
+        else:
+            end_iter = buffer.get_end_iter()
+        return buffer.get_text(start_iter, end_iter, True)
 
-    #@timer
-    def parse_symbols(self, text):
-        bibitems = set()
-        for match in ServiceLocator.get_regex_object(r'@(\w+)\{(\w+)').finditer(text):
-            bibitems = bibitems | {match.group(2).strip()}
+    def parse_fields(self, text):
+        ''' Read name = value pairs until the brace closing the entry,
+            values are returned without their outer braces or quotes. '''
 
-        self.content.symbols['bibitems'] = bibitems
+        fields = dict()
+        regex = self.field_regex
+        position = 0
+        while True:
+            match = regex.match(text, position)
+            if match == None: break
+            position = match.end()
+            value_start = position
+            depth = 0
+            in_quotes = False
+            while position < len(text):
+                char = text[position]
+                if char == '{':
+                    depth += 1
+                elif char == '}':
+                    if depth == 0: break
+                    depth -= 1
+                elif char == '"' and depth == 0:
+                    in_quotes = not in_quotes
+                elif char == ',' and depth == 0 and not in_quotes:
+                    break
+                position += 1
+            value = text[value_start:position].strip()
+            if len(value) >= 2 and ((value[0] == '{' and value[-1] == '}') or (value[0] == '"' and value[-1] == '"')):
+                value = value[1:-1]
+            fields[match.group(1).lower()] = value
+            if position >= len(text) or text[position] == '}': break
+        return fields
 
 
@@ -27,4 +27,16 @@ class ParserDummy(object):
     def on_text_inserted(self, buffer, location_iter, text, text_length):
         pass
 
+    def on_buffer_changed(self, buffer):
+        pass
+
+    def flush_pending_edits(self):
+        pass
+
+    def get_cache_kind(self):
+        return None
+
+    def get_keyed_blocks(self):
+        return dict()
+
 
@@ -15,136 +15,179 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-from setzer.app.service_locator import ServiceLocator
+import re
+
+import setzer.document.content.parser.match_list as match_list
+import setzer.document.content.parser.pending_edits as pending_edits
 from setzer.helpers.timer import timer
 
 
 class ParserLaTeX(object):
 
+    # increase when the cached data changes (e.g. the regexes)
+    CACHE_VERSION = 1
+
+    # number of begin / end tokens between two stored pairing stacks
+    CHECKPOINT_INTERVAL = 32
+
+    # compiled here instead of with ServiceLocator, parsers don't need Gtk
+    block_regex = re.compile(r'\n|\\(begin|end)\{((?:\w|•|\*)+)\}|\\(part|chapter|section|subsection|subsubsection)(?:\*){0,1}\{')
+    symbol_regex = re.compile(r'\\(label|include|input|bibliography|addbibresource)\{((?:\s|\w|\:|\.|,)*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}')
+
     def __init__(self, content):
         self.content = content
+        self.pending_edits = pending_edits.PendingEdits(self)
         self.text_length = 0
         self.number_of_lines = 0
-        self.block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        self.other_symbols = list()
+        self.block_symbol_matches = {'begin_or_end': match_list.MatchList(), 'others': match_list.MatchList()}
+        self.other_symbols = match_list.MatchList()
 
-    #@timer
-    def on_text_deleted(self, buffer, start_iter, end_iter):
-        offset_start = start_iter.get_offset()
-        offset_end = end_iter.get_offset()
-        line_start = start_iter.get_line()
-        line_end = end_iter.get_line()
-        char_count = buffer.get_char_count()
-        before_iter = buffer.get_iter_at_line(line_start)
-        after_iter = buffer.get_iter_at_line(line_end + 1)
-        if not after_iter.get_offset() == char_count:
-            after_iter.backward_char()
-
-        text_length = offset_end - offset_start
-        text = buffer.get_text(start_iter, end_iter, True)
-        deleted_line_count = text.count('\n')
-        text_before = buffer.get_text(before_iter, start_iter, True)
-        text_after = buffer.get_text(end_iter, after_iter, True)
-        offset_line_start = before_iter.get_offset()
-        self.text_length = char_count - offset_end + offset_start
+        # blocks are keyed by the match that starts them ('preamble' for the preamble),
+        # matches keep their identity as long as they are not edited.
+        self.environment_blocks = dict()
+        self.environment_blocks_by_end = dict()
+        self.section_blocks = dict()
+        self.end_document_match = None
+        self.preamble = None
+        self.document_matches = {'begin': set(), 'end': set()}
 
-        block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] < line_start:
-                block_symbol_matches['begin_or_end'].append(match)
-        for match in self.block_symbol_matches['others']:
-            if match[1] < line_start:
-                block_symbol_matches['others'].append(match)
-        other_symbols = list()
-        for match in self.other_symbols:
-            if match[1] < offset_line_start:
-                other_symbols.append((match[0], match[1]))
+        # pairing stacks (name -> tuple of open begin matches) in front of some tokens
+        self.pairing_checkpoints = dict()
 
-        offset_line_end = offset_end + len(text_after)
-        text = text_before + text_after
+        self.changed_blocks = set()
+        self.published_blocks = set()
 
-        additional_matches = self.parse_for_blocks(text, line_start, offset_line_start)
-        block_symbol_matches['begin_or_end'] += additional_matches['begin_or_end']
-        block_symbol_matches['others'] += additional_matches['others']
-        for match in ServiceLocator.get_regex_object(r'\\(label|include|input|bibliography|addbibresource)\{((?:\s|\w|\:|\.|,)*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}').finditer(text):
-            other_symbols.append((match, match.start() + offset_line_start))
-
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] > line_end:
-                block_symbol_matches['begin_or_end'].append((match[0], match[1] - deleted_line_count, match[2] - text_length))
-        for match in self.block_symbol_matches['others']:
-            if match[1] > line_end:
-                block_symbol_matches['others'].append((match[0], match[1] - deleted_line_count, match[2] - text_length))
-        for match in self.other_symbols:
-            if match[1] > offset_line_end:
-                other_symbols.append((match[0], match[1] - text_length))
-
-        self.block_symbol_matches = block_symbol_matches
-        self.number_of_lines = self.number_of_lines - deleted_line_count
-        self.parse_blocks()
-
-        self.other_symbols = other_symbols
-        self.parse_symbols()
-
-    #@timer
-    def on_text_inserted(self, buffer, location_iter, text, text_length):
-        text_length = len(text)
-        offset = location_iter.get_offset()
-        new_line_count = text.count('\n')
-        line_start = location_iter.get_line()
-        char_count = buffer.get_char_count()
-        before_iter = buffer.get_iter_at_line(line_start)
-        after_iter = buffer.get_iter_at_line(line_start + 1)
-        if not after_iter.get_offset() == char_count:
-            after_iter.backward_char()
-
-        text_before = buffer.get_text(before_iter, location_iter, True)
-        offset_line_start = before_iter.get_offset()
-        text_after = buffer.get_text(location_iter, after_iter, True)
-        offset_line_end = offset + len(text_after)
-        self.text_length = char_count + text_length
-        text_parse = text_before + text + text_after
+        # reference counts of the names found in symbol matches
+        self.symbol_counts = {'labels': dict(), 'included_latex_files': dict(), 'bibliographies': dict(), 'bibitems': dict(), 'packages': dict()}
+        self.package_matches = dict()
+        self.symbols_changed = dict()
 
-        block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] < line_start:
-                block_symbol_matches['begin_or_end'].append(match)
-        for match in self.block_symbol_matches['others']:
-            if match[1] < line_start:
-                block_symbol_matches['others'].append(match)
-        other_symbols = list()
-        for match in self.other_symbols:
-            if match[1] < offset_line_start:
-                other_symbols.append((match[0], match[1]))
-
-        additional_matches = self.parse_for_blocks(text_parse, line_start, offset_line_start)
-        block_symbol_matches['begin_or_end'] += additional_matches['begin_or_end']
-        block_symbol_matches['others'] += additional_matches['others']
-        for match in ServiceLocator.get_regex_object(r'\\(label|include|input|bibliography|addbibresource)\{((?:\s|\w|\:|\.|,)*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}').finditer(text_parse):
-            other_symbols.append((match, match.start() + offset_line_start))
-
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] > line_start:
-                block_symbol_matches['begin_or_end'].append((match[0], match[1] + new_line_count, match[2] + text_length))
-        for match in self.block_symbol_matches['others']:
-            if match[1] > line_start:
-                block_symbol_matches['others'].append((match[0], match[1] + new_line_count, match[2] + text_length))
-        for match in self.other_symbols:
-            if match[1] > offset_line_end:
-                other_symbols.append((match[0], match[1] - text_length))
-
-        self.block_symbol_matches = block_symbol_matches
-        self.number_of_lines = self.number_of_lines + new_line_count
-        self.parse_blocks()
-
-        self.other_symbols = other_symbols
-        self.parse_symbols()
-
-    #@timer
+    def on_text_deleted(self, buffer, start_iter, end_iter):
+        self.pending_edits.add_deletion(buffer, start_iter, end_iter)
+
+    def on_text_inserted(self, buffer, location_iter, text, text_length):
+        self.pending_edits.add_insertion(buffer, location_iter, text)
+
+    def on_buffer_changed(self, buffer):
+        self.pending_edits.on_buffer_changed(buffer)
+
+    def flush_pending_edits(self):
+        self.pending_edits.flush()
+
+    @timer
+    def parse_range(self, text, line_start, offset_line_start, offset_line_end, char_delta, line_delta):
+        ''' Reparse text, the current content of the lines between
+            offset_line_start and offset_line_end (positions before the edits). '''
+
+        self.text_length += char_delta
+        self.number_of_lines += line_delta
+        touched_matches = self.update_matches(text, line_start, offset_line_start, offset_line_end, char_delta, line_delta)
+
+        self.parse_blocks(touched_matches, line_start)
+        self.parse_symbols(touched_matches['symbols'])
+
+    def get_cache_kind(self):
+        return 'latex-' + str(self.CACHE_VERSION)
+
+    def get_cache_data(self):
+        self.flush_pending_edits()
+        data = {'text_length': self.text_length, 'number_of_lines': self.number_of_lines}
+        data['begin_or_end'] = self.block_symbol_matches['begin_or_end'].get_items_for_cache()
+        data['others'] = self.block_symbol_matches['others'].get_items_for_cache()
+        data['symbols'] = self.other_symbols.get_items_for_cache()
+        return data
+
+    @timer
+    def load_cache_data(self, data):
+        ''' Take over the matches of the same text parsed before, instead of
+            parsing the text that has just been inserted. Blocks and symbols
+            are computed from them as usual. Only for an empty parser. '''
+
+        self.pending_edits.clear()
+        self.text_length = data['text_length']
+        self.number_of_lines = data['number_of_lines']
+
+        touched_matches = dict()
+        for key, matches in [('begin_or_end', self.block_symbol_matches['begin_or_end']), ('others', self.block_symbol_matches['others']), ('symbols', self.other_symbols)]:
+            items = match_list.restore_items(data[key])
+            matches.replace_range(0, -1, self.text_length, self.number_of_lines, items)
+            touched_matches[key] = (list(), items)
+
+        self.parse_blocks(touched_matches, 0)
+        self.parse_symbols(touched_matches['symbols'])
+        self.publish_changes()
+
+    def publish_changes(self):
+        ''' Publish the blocks changed since the last call as a delta:
+            {'added': [(key, block)], 'removed': [key], 'moved': [(key, block)]}.
+            Blocks that are not part of the delta only moved along with the text
+            in front of them. Symbols are published the same way, as
+            {symbol_type: {'added': set(), 'removed': set()}}. '''
+
+        if len(self.symbols_changed) > 0:
+            self.content.add_change_code('symbols_changed', self.symbols_changed)
+            self.symbols_changed = dict()
+
+        if len(self.changed_blocks) == 0: return
+
+        delta = {'added': list(), 'removed': list(), 'moved': list()}
+        for key in self.changed_blocks:
+            if self.has_block(key):
+                if key in self.published_blocks:
+                    delta['moved'].append((key, self.get_block(key)))
+                else:
+                    delta['added'].append((key, self.get_block(key)))
+                    self.published_blocks.add(key)
+            elif key in self.published_blocks:
+                delta['removed'].append(key)
+                self.published_blocks.discard(key)
+        self.changed_blocks = set()
+
+        if len(delta['added']) + len(delta['removed']) + len(delta['moved']) > 0:
+            self.content.add_change_code('blocks_changed', delta)
+
+    def update_matches(self, text, line_start, offset_line_start, offset_line_end, char_delta, line_delta):
+        ''' Replace the matches found between offset_line_start and offset_line_end
+            (positions before the edit) by the matches in text, the new content
+            of these lines. Matches behind the edit are shifted by the deltas.
+            Returns the matches removed and inserted. '''
+
+        touched_matches = {'begin_or_end': (list(), list()), 'others': (list(), list())}
+        additional_matches = self.parse_for_blocks(text, line_start, offset_line_start)
+        for key in ['begin_or_end', 'others']:
+            matches = self.block_symbol_matches[key]
+            removed_matches = matches.remove_range(offset_line_start, offset_line_end, char_delta, line_delta)
+            added_matches = self.reuse_matches(removed_matches, additional_matches[key])
+            matches.insert_at_gap(added_matches)
+            touched_matches[key] = (removed_matches, added_matches)
+        additional_symbols = self.parse_for_symbols(text, line_start, offset_line_start)
+        removed_symbols = self.other_symbols.replace_range(offset_line_start, offset_line_end, char_delta, line_delta, additional_symbols)
+        touched_matches['symbols'] = (removed_symbols, additional_symbols)
+        return touched_matches
+
+    def reuse_matches(self, removed_matches, added_matches):
+        ''' Matches at the start and the end of the reparsed lines that didn't
+            change take the place of their old versions, so the blocks they
+            belong to keep their identity. '''
+
+        matches = list(added_matches)
+        length = min(len(removed_matches), len(matches))
+        prefix_length = 0
+        while prefix_length < length and removed_matches[prefix_length][0].group(0) == matches[prefix_length][0].group(0):
+            match, line_number, offset = matches[prefix_length]
+            matches[prefix_length] = (removed_matches[prefix_length][0], line_number, offset)
+            prefix_length += 1
+        for i in range(1, length - prefix_length + 1):
+            if removed_matches[-i][0].group(0) != matches[-i][0].group(0): break
+            match, line_number, offset = matches[-i]
+            matches[-i] = (removed_matches[-i][0], line_number, offset)
+        return matches
+
+    @timer
     def parse_for_blocks(self, text, line_start, offset_line_start):
         block_symbol_matches = {'begin_or_end': list(), 'others': list()}
         counter = line_start
-        for match in ServiceLocator.get_regex_object(r'\n|\\(begin|end)\{((?:\w|•|\*)+)\}|\\(part|chapter|section|subsection|subsubsection)(?:\*){0,1}\{').finditer(text):
+        for match in self.block_regex.finditer(text):
             if match.group(1) != None:
                 block_symbol_matches['begin_or_end'].append((match, counter, match.start() + offset_line_start))
             elif match.group(3) != None:
@@ -153,107 +196,299 @@ class ParserLaTeX(object):
                 counter += 1
         return block_symbol_matches
 
-    #@timer
-    def parse_blocks(self):
-        blocks = dict()
-
-        add_preamble_folding = True
-        end_document_offset = None
-        end_document_line = None
-        begin_document_offset = None
-        begin_document_line = None
-        blocks_list = list()
-        for (match, line_number, offset) in self.block_symbol_matches['begin_or_end']:
-            if line_number == 0:
-                add_preamble_folding = False
-
+    @timer
+    def parse_for_symbols(self, text, line_start, offset_line_start):
+        other_symbols = list()
+        counter = line_start
+        last_match_start = 0
+        for match in self.symbol_regex.finditer(text):
+            counter += text.count('\n', last_match_start, match.start())
+            last_match_start = match.start()
+            other_symbols.append((match, counter, match.start() + offset_line_start))
+        return other_symbols
+
+    @timer
+    def parse_blocks(self, touched_matches, line_start):
+        removed_matches, added_matches = touched_matches['begin_or_end']
+        touched = set()
+        for match, line_number, offset in removed_matches:
+            touched.add(match)
+            try: del(self.pairing_checkpoints[match])
+            except KeyError: pass
+            if match.group(2).strip() == 'document':
+                self.document_matches[match.group(1)].discard(match)
+        for match, line_number, offset in added_matches:
+            touched.add(match)
+            if match.group(2).strip() == 'document':
+                self.document_matches[match.group(1)].add(match)
+        for match in touched:
+            if match not in self.block_symbol_matches['begin_or_end']:
+                self.remove_environment_pair(match)
+
+        self.update_environment_blocks(self.block_symbol_matches['begin_or_end'].get_gap_index() - len(added_matches))
+
+        for match in touched:
+            if match in self.environment_blocks:
+                self.changed_blocks.add(match)
+            elif match in self.environment_blocks_by_end:
+                self.changed_blocks.add(self.environment_blocks_by_end[match])
+
+        touched_sections = touched_matches['others'][0] + touched_matches['others'][1]
+        for match, line_number, offset in touched_sections:
+            touched.add(match)
+        end_document_match = self.get_document_match('end')
+        if len(touched_sections) > 0 or end_document_match is not self.end_document_match or end_document_match in touched:
+            self.update_section_blocks(touched, end_document_match)
+        self.update_preamble(touched, line_start)
+
+        self.content.symbols['blocks'] = None
+
+    @timer
+    def update_environment_blocks(self, index_start):
+        ''' Pair begin and end tokens, starting from the last checkpoint in
+            front of index_start. Stops as soon as the stack of open
+            environments behind the edit equals the one stored before. '''
+
+        matches = self.block_symbol_matches['begin_or_end']
+        gap_index = matches.get_gap_index()
+
+        index = index_start
+        stack = dict()
+        while index > 0:
+            index -= 1
+            try: stack = dict(self.pairing_checkpoints[matches.get_match_before_gap(index)])
+            except KeyError: pass
+            else: break
+
+        tokens_since_checkpoint = 0
+        for match, line_number, offset in matches.iter_from(index):
+            try: checkpoint = self.pairing_checkpoints[match]
+            except KeyError:
+                if tokens_since_checkpoint >= self.CHECKPOINT_INTERVAL:
+                    self.pairing_checkpoints[match] = dict(stack)
+                    tokens_since_checkpoint = 0
+            else:
+                if index >= gap_index and checkpoint == stack:
+                    return
+                self.pairing_checkpoints[match] = dict(stack)
+                tokens_since_checkpoint = 0
+            tokens_since_checkpoint += 1
+            index += 1
+
+            name = match.group(2)
             if match.group(1) == 'begin':
-                if match.group(2).strip() == 'document':
-                    begin_document_offset = offset
-                    begin_document_line = line_number
-                try: blocks[match.group(2)].append([offset, None, line_number, None])
-                except KeyError: blocks[match.group(2)] = [[offset, None, line_number, None]]
+                try: stack[name] += (match,)
+                except KeyError: stack[name] = (match,)
             else:
-                if match.group(2).strip() == 'document':
-                    end_document_offset = offset
-                    end_document_line = line_number
-                try: blocks_begin = blocks[match.group(2)]
-                except KeyError: pass
+                try: open_blocks = stack[name]
+                except KeyError:
+                    self.remove_environment_pair(match)
                 else:
-                    try: block_begin = blocks_begin.pop()
-                    except IndexError: pass
+                    if len(open_blocks) == 1:
+                        del(stack[name])
                     else:
-                        block_begin[1] = offset
-                        block_begin[3] = line_number
-                        blocks_list.append(block_begin)
-
-        relevant_following_blocks = [list(), list(), list(), list(), list()]
+                        stack[name] = open_blocks[:-1]
+                    self.set_environment_pair(open_blocks[-1], match)
+
+        for open_blocks in stack.values():
+            for match in open_blocks:
+                self.remove_environment_pair(match)
+
+    def set_environment_pair(self, begin_match, end_match):
+        if self.environment_blocks_by_end.get(end_match) is begin_match: return
+
+        self.remove_environment_pair(begin_match)
+        self.remove_environment_pair(end_match)
+        self.environment_blocks[begin_match] = end_match
+        self.environment_blocks_by_end[end_match] = begin_match
+        self.changed_blocks.add(begin_match)
+
+    def remove_environment_pair(self, match):
+        try: end_match = self.environment_blocks[match]
+        except KeyError:
+            try: begin_match = self.environment_blocks_by_end[match]
+            except KeyError: return
+            end_match = match
+        else:
+            begin_match = match
+        del(self.environment_blocks[begin_match])
+        del(self.environment_blocks_by_end[end_match])
+        self.changed_blocks.add(begin_match)
+
+    @timer
+    def update_section_blocks(self, touched, end_document_match):
+        ''' Sections are rebuilt completely when one of them or the end of
+            the document changed. Only those whose start or end changed end
+            up in the delta. '''
+
+        self.end_document_match = end_document_match
+        if end_document_match != None:
+            end_document_offset = self.get_match_position(end_document_match)[1]
+
+        section_blocks = dict()
+        following_sections = [None, None, None, None, None]
         levels = {'part': 0, 'chapter': 1, 'section': 2, 'subsection': 3, 'subsubsection': 4}
         for (match, line_number, offset) in reversed(self.block_symbol_matches['others']):
-            if line_number == 0:
-                add_preamble_folding = False
-
             level = levels[match.group(3)]
-            block = [offset, None, line_number, None]
-
-            if len(relevant_following_blocks[level]) >= 1:
-                # - 1 to go one line up
-                block[1] = relevant_following_blocks[level][-1][0] - 1
-                block[3] = relevant_following_blocks[level][-1][2] - 1
+            terminator = following_sections[level]
+            if terminator == None and end_document_match != None and offset < end_document_offset:
+                terminator = end_document_match
+            section_blocks[match] = terminator
+            for i in range(level, 5):
+                following_sections[i] = match
+
+        for match in self.section_blocks:
+            if match not in section_blocks:
+                self.changed_blocks.add(match)
+        for match, terminator in section_blocks.items():
+            if match not in self.section_blocks or self.section_blocks[match] is not terminator:
+                self.changed_blocks.add(match)
+            elif match in touched or terminator in touched:
+                self.changed_blocks.add(match)
+        self.section_blocks = section_blocks
+
+    def update_preamble(self, touched, line_start):
+        preamble = self.get_document_match('begin')
+        for key in ['begin_or_end', 'others']:
+            first_match = self.block_symbol_matches[key].get_first()
+            if first_match != None and first_match[1] == 0:
+                preamble = None
+        if preamble != None:
+            line_number, offset = self.get_match_position(preamble)
+            if not (offset and line_number):
+                preamble = None
+
+        if preamble is not self.preamble or (preamble != None and (line_start == 0 or preamble in touched)):
+            self.changed_blocks.add('preamble')
+        self.preamble = preamble
+
+    def get_document_match(self, begin_or_end):
+        result = None
+        result_offset = -1
+        for match in self.document_matches[begin_or_end]:
+            offset = self.block_symbol_matches['begin_or_end'].get_position(match)[1]
+            if offset > result_offset:
+                result = match
+                result_offset = offset
+        return result
+
+    def get_match_position(self, match):
+        position = self.block_symbol_matches['begin_or_end'].get_position(match)
+        if position == None:
+            position = self.block_symbol_matches['others'].get_position(match)
+        return position
+
+    def has_block(self, key):
+        if key == 'preamble':
+            return self.preamble != None
+        return key in self.environment_blocks or key in self.section_blocks
+
+    def get_block(self, key):
+        ''' Returns [offset_start, offset_end, line_start, line_end] of a block. '''
+
+        if key == 'preamble':
+            line_number, offset = self.get_match_position(self.preamble)
+            return [0, offset - 1, 0, line_number - 1]
+
+        line_number, offset = self.get_match_position(key)
+        try: end_match = self.environment_blocks[key]
+        except KeyError:
+            terminator = self.section_blocks[key]
+            if terminator == None:
+                return [offset, self.text_length, line_number, self.number_of_lines]
             else:
-                if end_document_offset != None and block[0] < end_document_offset:
-                    # - 1 to go one line up
-                    block[1] = end_document_offset - 1
-                    block[3] = end_document_line - 1
-                else:
-                    block[1] = self.text_length
-                    block[3] = self.number_of_lines
+                # - 1 to go one line up
+                line_end, offset_end = self.get_match_position(terminator)
+                return [offset, offset_end - 1, line_number, line_end - 1]
+        else:
+            line_end, offset_end = self.get_match_position(end_match)
+            return [offset, offset_end, line_number, line_end]
 
-            blocks_list.append(block)
-            for i in range(level, 5):
-                relevant_following_blocks[i].append(block)
-
-        if add_preamble_folding and begin_document_offset and begin_document_line:
-            blocks_list.append([0, begin_document_offset - 1, 0, begin_document_line - 1])
-
-        self.content.set_blocks(sorted(blocks_list, key=lambda block: block[0]))
-
-    #@timer
-    def parse_symbols(self):
-        labels = set()
-        included_latex_files = set()
-        bibliographies = set()
-        bibitems = set()
-        packages = set()
-        packages_detailed = dict()
-        for match in self.other_symbols:
-            match = match[0]
-            if match.group(1) == 'label':
-                labels = labels | {match.group(2).strip()}
-            elif match.group(1) == 'include' or match.group(1) == 'input':
-                filename = match.group(2).strip()
-                if not filename.endswith('.tex'):
-                    filename += '.tex'
-                included_latex_files = included_latex_files | {filename}
-            elif match.group(1) == 'bibliography':
-                bibfiles = match.group(2).strip().split(',')
-                for entry in bibfiles:
-                    bibliographies = bibliographies | {entry.strip() + '.bib'}
-            elif match.group(1) == 'addbibresource':
-                bibfiles = match.group(2).strip().split(',')
-                for entry in bibfiles:
-                    bibliographies = bibliographies | {entry.strip()}
-            elif match.group(3) == 'usepackage':
-                packages = packages | {match.group(4).strip()}
-                packages_detailed[match.group(4).strip()] = match
-            elif match.group(5) == 'bibitem':
-                bibitems = bibitems | {match.group(6).strip()}
-
-        self.content.symbols['labels'] = labels
-        self.content.symbols['included_latex_files'] = included_latex_files
-        self.content.symbols['bibliographies'] = bibliographies
-        self.content.symbols['bibitems'] = bibitems
-        self.content.symbols['packages'] = packages
-        self.content.symbols['packages_detailed'] = packages_detailed
+    def get_keyed_blocks(self):
+        blocks = dict()
+        for key in self.environment_blocks:
+            blocks[key] = self.get_block(key)
+        for key in self.section_blocks:
+            blocks[key] = self.get_block(key)
+        if self.preamble != None:
+            blocks['preamble'] = self.get_block('preamble')
+        return blocks
+
+    @timer
+    def parse_symbols(self, touched_symbols):
+        removed_symbols, added_symbols = touched_symbols
+        changed_packages = set()
+        for match, line_number, offset in added_symbols:
+            for symbol_type, name in self.get_symbols_of_match(match):
+                self.add_symbol(symbol_type, name)
+                if symbol_type == 'packages':
+                    try: self.package_matches[name].add(match)
+                    except KeyError: self.package_matches[name] = {match}
+                    changed_packages.add(name)
+        for match, line_number, offset in removed_symbols:
+            for symbol_type, name in self.get_symbols_of_match(match):
+                self.remove_symbol(symbol_type, name)
+                if symbol_type == 'packages':
+                    self.package_matches[name].discard(match)
+                    changed_packages.add(name)
+
+        packages_detailed = self.content.symbols['packages_detailed']
+        for name in changed_packages:
+            if len(self.package_matches[name]) == 0:
+                del(self.package_matches[name])
+                del(packages_detailed[name])
+            else:
+                packages_detailed[name] = max(self.package_matches[name], key=self.get_symbol_offset)
+
+    def get_symbols_of_match(self, match):
+        if match.group(1) == 'label':
+            return [('labels', match.group(2).strip())]
+        elif match.group(1) == 'include' or match.group(1) == 'input':
+            filename = match.group(2).strip()
+            if not filename.endswith('.tex'):
+                filename += '.tex'
+            return [('included_latex_files', filename)]
+        elif match.group(1) == 'bibliography':
+            return [('bibliographies', entry.strip() + '.bib') for entry in match.group(2).strip().split(',')]
+        elif match.group(1) == 'addbibresource':
+            return [('bibliographies', entry.strip()) for entry in match.group(2).strip().split(',')]
+        elif match.group(3) == 'usepackage':
+            return [('packages', match.group(4).strip())]
+        elif match.group(5) == 'bibitem':
+            return [('bibitems', match.group(6).strip())]
+        return []
+
+    def add_symbol(self, symbol_type, name):
+        counts = self.symbol_counts[symbol_type]
+        try: counts[name] += 1
+        except KeyError:
+            counts[name] = 1
+            self.content.symbols[symbol_type].add(name)
+            self.add_symbol_change(symbol_type, name, 'added', 'removed')
+
+    def remove_symbol(self, symbol_type, name):
+        counts = self.symbol_counts[symbol_type]
+        counts[name] -= 1
+        if counts[name] == 0:
+            del(counts[name])
+            self.content.symbols[symbol_type].discard(name)
+            self.add_symbol_change(symbol_type, name, 'removed', 'added')
+
+    def add_symbol_change(self, symbol_type, name, change, opposite_change):
+        try: changes = self.symbols_changed[symbol_type]
+        except KeyError:
+            changes = {'added': set(), 'removed': set()}
+            self.symbols_changed[symbol_type] = changes
+        if name in changes[opposite_change]:
+            changes[opposite_change].discard(name)
+            if len(changes['added']) + len(changes['removed']) == 0:
+                del(self.symbols_changed[symbol_type])
+        else:
+            changes[change].add(name)
+
+    def get_symbol_offset(self, match):
+        position = self.other_symbols.get_position(match)
+        if position == None: return None
+        return position[1]
 
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+from setzer.helpers.timer import timer
+
+
+class PendingEdits(object):
+    ''' Collects edits and hands them to the parser as one range.
+
+        Offsets before the first edit are the same in the parser's view of
+        the text and in the buffer, everything behind the last edit is
+        moved by char_delta. So a burst of edits (a paste, replace all, undo
+        of a large action) is described by the offset the dirty range starts
+        at, its end in the parser's coordinates and the deltas. When the
+        parser runs is up to Content, it calls flush(). '''
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.buffer = None
+        self.offset_start = None
+        self.offset_end = None
+        self.char_delta = 0
+        self.line_delta = 0
+
+        # the buffer applies an edit after the parser has been told about it
+        self.edit_in_progress = False
+
+    def add_insertion(self, buffer, location_iter, text):
+        offset = location_iter.get_offset()
+        self.add_edit(buffer, offset, offset, len(text), text.count('\n'))
+
+    def add_deletion(self, buffer, start_iter, end_iter):
+        self.add_edit(buffer, start_iter.get_offset(), end_iter.get_offset(), 0, start_iter.get_line() - end_iter.get_line())
+
+    def add_edit(self, buffer, offset_start, offset_end, length, line_delta):
+        ''' Replacing offset_start to offset_end (positions in the buffer
+            before the edit) by length characters. '''
+
+        self.buffer = buffer
+        if self.offset_start == None:
+            self.offset_start = offset_start
+            self.offset_end = offset_end
+        else:
+            self.offset_start = min(self.offset_start, offset_start)
+            self.offset_end = max(self.offset_end, offset_end - self.char_delta)
+        self.char_delta += length - (offset_end - offset_start)
+        self.line_delta += line_delta
+        self.edit_in_progress = True
+
+    def clear(self):
+        self.offset_start = None
+        self.offset_end = None
+        self.char_delta = 0
+        self.line_delta = 0
+
+    def on_buffer_changed(self, buffer):
+        self.edit_in_progress = False
+
+    @timer
+    def flush(self):
+        ''' Parse the dirty lines now. Does nothing while the buffer is in
+            the middle of an edit, the pending offsets would be wrong then. '''
+
+        if self.offset_start == None or self.edit_in_progress: return
+
+        buffer = self.buffer
+        char_count = buffer.get_char_count()
+        line_start = buffer.get_iter_at_offset(self.offset_start).get_line()
+        before_iter = buffer.get_iter_at_line(line_start)
+        line_end = buffer.get_iter_at_offset(self.offset_end + self.char_delta).get_line()
+        after_iter = buffer.get_iter_at_line(line_end + 1)
+        if not after_iter.get_offset() == char_count:
+            after_iter.backward_char()
+
+        text = buffer.get_text(before_iter, after_iter, True)
+        offset_line_start = before_iter.get_offset()
+        offset_line_end = after_iter.get_offset() - self.char_delta
+        char_delta = self.char_delta
+        line_delta = self.line_delta
+        self.clear()
+
+        self.parser.parse_range(text, line_start, offset_line_start, offset_line_end, char_delta, line_delta)
+        self.parser.publish_changes()
+
+
@@ -23,10 +23,10 @@ gi.require_version('Gdk', '3.0')
 from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import Gtk
-from gi.repository import GObject
 
 from setzer.dialogs.dialog_locator import DialogLocator
 from setzer.app.service_locator import ServiceLocator
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class DocumentController(object):
@@ -41,7 +41,7 @@ class DocumentController(object):
         self.view.source_view.connect('key-press-event', self.on_keypress)
         self.view.source_view.connect('button-press-event', self.on_buttonpress)
         self.continue_save_date_loop = True
-        GObject.timeout_add(500, self.save_date_loop)
+        main_loop_monitor.timeout_add(500, self.save_date_loop)
 
     '''
     *** signal handlers: changes in documents
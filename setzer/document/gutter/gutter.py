@@ -80,7 +80,7 @@ class Gutter(object):
         if (section, item) == ('preferences', 'highlight_current_line'):
             self.set_line_highlighting(value)
 
-    #@timer
+    @timer
     def on_draw(self, drawing_area, ctx, data = None):
         self.update_sizes()
         if self.total_size != 0:
@@ -94,7 +94,7 @@ class Gutter(object):
                     widget.on_draw(self, drawing_area, ctx, self.lines, self.current_line, total_size)
                     total_size += widget.get_size()
 
-    #@timer
+    @timer
     def draw_background(self, drawing_area, ctx):
         if self.highlight_current_line and self.current_line != None:
             ctx.rectangle(0, self.current_line[1], self.total_size, self.current_line[2])
@@ -104,7 +104,7 @@ class Gutter(object):
         ctx.set_source_rgba(self.border_color.red, self.border_color.green, self.border_color.blue, self.border_color.alpha)
         ctx.fill()
 
-    #@timer
+    @timer
     def update_colors(self, style_context=None):
         style_scheme = self.document.content.get_style_scheme()
         line_numbers_style = style_scheme.get_style('line-numbers')
@@ -134,7 +134,7 @@ class Gutter(object):
 
         self.view.queue_draw()
 
-    #@timer
+    @timer
     def update_lines(self):
         lines = list()
         y_window = 0
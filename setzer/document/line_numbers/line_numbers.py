@@ -73,7 +73,7 @@ class LineNumbers(object):
     def on_pointer_movement(self, event):
         pass
 
-    #@timer
+    @timer
     def on_draw(self, gutter, drawing_area, ctx, lines, current_line, offset):
         ctx.set_font_size(self.font_size)
         font_family = self.font_desc.get_family()
@@ -35,6 +35,7 @@ import setzer.document.preview.preview_presenter as preview_presenter
 import setzer.document.preview.preview_controller as preview_controller
 import setzer.document.preview.preview_page_renderer as preview_page_renderer
 import setzer.document.preview.zoom_widget.zoom_widget as zoom_widget
+import setzer.helpers.grid_index as grid_index
 import setzer.document.preview.paging_widget.paging_widget as paging_widget
 from setzer.helpers.observable import Observable
 from setzer.helpers.timer import timer
@@ -57,6 +58,9 @@ class Preview(Observable):
         with self.links_lock:
             self.links = dict()
         self.links_parser_lock = thread.allocate_lock()
+
+        # page number: (text, grid of character rectangles)
+        self.text_indexes = dict()
         self.number_of_pages = 0
         self.page_width = None
         self.page_height = None
@@ -135,6 +139,7 @@ class Preview(Observable):
         self.pdf_date = None
         with self.poppler_document_lock:
             self.poppler_document = None
+            self.text_indexes = dict()
         self.number_of_pages = 0
         self.page_width = None
         self.page_height = None
@@ -201,6 +206,7 @@ class Preview(Observable):
         try:
             with self.poppler_document_lock:
                 self.poppler_document = Poppler.Document.new_from_file('file:' + self.pdf_filename)
+                self.text_indexes = dict()
         except TypeError:
             self.reset_pdf_data()
         except gi.repository.GLib.Error:
@@ -228,6 +234,36 @@ class Preview(Observable):
             self.links_parsed = False
             thread.start_new_thread(self.update_links, ())
 
+    def get_word_and_context(self, page_number, x, y):
+        ''' The word at (x, y) on page_number (counting from 0) and the
+            text line around it, from the text layout of the page. '''
+
+        with self.poppler_document_lock:
+            try:
+                text, grid = self.text_indexes[page_number]
+            except KeyError:
+                page = self.poppler_document.get_page(page_number)
+                text = page.get_text()
+                grid = grid_index.GridIndex(cell_size=16)
+                for offset, rect in enumerate(page.get_text_layout()[1]):
+                    grid.add(rect.x1, rect.y1, rect.x2, rect.y2, offset)
+                self.text_indexes[page_number] = (text, grid)
+
+        offsets = [rectangle[4] for rectangle in grid.get_at(x, y) if rectangle[4] < len(text) and not text[rectangle[4]].isspace()]
+        if len(offsets) == 0: return ('', '')
+        offset = min(offsets)
+
+        word_start = offset
+        while word_start > 0 and not text[word_start - 1].isspace():
+            word_start -= 1
+        word_end = offset
+        while word_end < len(text) and not text[word_end].isspace():
+            word_end += 1
+        line_start = text.rfind('\n', 0, offset) + 1
+        line_end = text.find('\n', offset)
+        if line_end < 0: line_end = len(text)
+        return (text[word_start:word_end], text[line_start:line_end])
+
     def get_page_number_and_offsets_by_document_offsets(self, x, y):
         return self.layouter.get_page_number_and_offsets_by_document_offsets(x, y)
 
@@ -18,7 +18,6 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gdk
-from gi.repository import GObject
 import cairo
 
 import _thread as thread, queue
@@ -26,6 +25,7 @@ import time
 import math
 
 from setzer.helpers.observable import Observable
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class PreviewPageRenderer(Observable):
@@ -53,7 +53,7 @@ class PreviewPageRenderer(Observable):
         self.render_queue_low_priority = queue.Queue()
         self.rendered_pages_queue = queue.Queue()
         thread.start_new_thread(self.render_page_loop, ())
-        GObject.timeout_add(50, self.rendered_pages_loop)
+        main_loop_monitor.timeout_add(50, self.rendered_pages_loop)
 
     def on_layout_or_position_changed(self, notifying_object):
         if self.layouter.has_layout:
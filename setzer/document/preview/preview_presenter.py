@@ -27,6 +27,7 @@ import queue
 
 from setzer.app.service_locator import ServiceLocator
 from setzer.helpers.timer import timer
+import setzer.helpers.main_loop_monitor as main_loop_monitor
 
 
 class PreviewPresenter(object):
@@ -44,7 +45,7 @@ class PreviewPresenter(object):
         self.view.drawing_area.connect('draw', self.draw)
         self.scrolling_queue = queue.Queue()
         self.view.drawing_area.connect('size-allocate', self.scrolling_loop)
-        GObject.timeout_add(50, self.scrolling_loop)
+        main_loop_monitor.timeout_add(50, self.scrolling_loop)
 
         self.preview.connect('pdf_changed', self.on_pdf_changed)
         self.preview.connect('invert_pdf_changed', self.on_invert_pdf_changed)
@@ -113,7 +114,7 @@ class PreviewPresenter(object):
         self.view.scrolled_window.get_hadjustment().set_value(xoffset)
         self.view.scrolled_window.get_vadjustment().set_value(yoffset)
 
-    #@timer
+    @timer
     def draw(self, drawing_area, ctx, data = None):
         if self.layouter.has_layout:
             bg_color = self.color_manager.get_theme_color('theme_bg_color')
@@ -144,7 +145,7 @@ class PreviewPresenter(object):
         ctx.set_source_rgba(bg_color.red, bg_color.green, bg_color.blue, bg_color.alpha)
         ctx.fill()
 
-    #@timer
+    @timer
     def draw_page_background_and_outline(self, ctx, border_color):
         ctx.set_source_rgba(border_color.red, border_color.green, border_color.blue, border_color.alpha)
         ctx.rectangle(- self.layouter.border_width, - self.layouter.border_width, self.layouter.page_width + 2 * self.layouter.border_width, self.layouter.page_height + 2 * self.layouter.border_width)
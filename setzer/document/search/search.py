@@ -100,7 +100,11 @@ class Search(object):
         if number_of_occurrences > 0:
             dialog = DialogLocator.get_dialog('replace_confirmation')
             if dialog.run(original, replacement, number_of_occurrences):
-                self.search_context.replace_all(replacement, -1)
+                self.document.content.begin_transaction()
+                try:
+                    self.search_context.replace_all(replacement, -1)
+                finally:
+                    self.document.content.end_transaction()
 
     def on_search_entry_activate(self, entry=None):
         self.on_search_next_match(entry, True)
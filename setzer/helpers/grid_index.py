@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import math
+
+
+class GridIndex(object):
+    ''' Rectangles on a page, bucketed by the square cells of a grid they
+        overlap, to find the ones at or near a point without looking at
+        all of them. '''
+
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = dict()
+
+        # (left, top, right, bottom, value)
+        self.rectangles = list()
+        self.min_cell = None
+        self.max_cell = None
+
+    def add(self, left, top, right, bottom, value):
+        number = len(self.rectangles)
+        self.rectangles.append((left, top, right, bottom, value))
+
+        first_column, first_row = self.get_cell(left, top)
+        last_column, last_row = self.get_cell(right, bottom)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                try: self.cells[(column, row)].append(number)
+                except KeyError: self.cells[(column, row)] = [number]
+
+        if self.min_cell == None:
+            self.min_cell = [first_column, first_row]
+            self.max_cell = [last_column, last_row]
+        else:
+            self.min_cell = [min(self.min_cell[0], first_column), min(self.min_cell[1], first_row)]
+            self.max_cell = [max(self.max_cell[0], last_column), max(self.max_cell[1], last_row)]
+
+    def get_cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def get_at(self, x, y):
+        ''' Rectangles (left, top, right, bottom, value) containing the point. '''
+
+        result = list()
+        for number in self.cells.get(self.get_cell(x, y), list()):
+            rectangle = self.rectangles[number]
+            if rectangle[0] <= x <= rectangle[2] and rectangle[1] <= y <= rectangle[3]:
+                result.append(rectangle)
+        return result
+
+    def get_nearest(self, x, y, max_distance=None):
+        ''' The rectangle closest to the point, None if there is none within
+            max_distance. Looks at rings of cells around the point until no
+            farther ring can hold anything closer. '''
+
+        if self.min_cell == None: return None
+
+        column, row = self.get_cell(x, y)
+        max_radius = max(abs(column - self.min_cell[0]), abs(column - self.max_cell[0]), abs(row - self.min_cell[1]), abs(row - self.max_cell[1]))
+        if max_distance != None:
+            max_radius = min(max_radius, math.ceil(max_distance / self.cell_size) + 1)
+
+        best_rectangle = None
+        best_distance = None
+        seen = set()
+        for radius in range(max_radius + 1):
+            for cell in self.get_ring(column, row, radius):
+                for number in self.cells.get(cell, list()):
+                    if number in seen: continue
+                    seen.add(number)
+                    distance = self.get_distance(self.rectangles[number], x, y)
+                    if best_distance == None or distance < best_distance:
+                        best_rectangle, best_distance = self.rectangles[number], distance
+
+            # everything in the next ring is at least this far away
+            if best_distance != None and best_distance <= radius * self.cell_size:
+                break
+
+        if best_distance == None or (max_distance != None and best_distance > max_distance):
+            return None
+        return best_rectangle
+
+    def get_ring(self, column, row, radius):
+        if radius == 0:
+            return [(column, row)]
+        cells = list()
+        for offset in range(-radius, radius + 1):
+            cells.append((column + offset, row - radius))
+            cells.append((column + offset, row + radius))
+        for offset in range(-radius + 1, radius):
+            cells.append((column - radius, row + offset))
+            cells.append((column + radius, row + offset))
+        return cells
+
+    def get_distance(self, rectangle, x, y):
+        dx = max(rectangle[0] - x, 0, x - rectangle[2])
+        dy = max(rectangle[1] - y, 0, y - rectangle[3])
+        return math.sqrt(dx * dx + dy * dy)
+
+
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017, 2018 Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+''' Stall detector for the main loop.
+
+    Use timeout_add(), idle_add() and source_remove() from here instead
+    of the GObject ones for callbacks that run regularly. While the
+    monitor is enabled (SETZER_MONITOR_MAIN_LOOP in the environment or
+    the monitor_main_loop preference) a heartbeat measures how late the
+    main loop dispatches, and how long the monitored callbacks run. Stalls
+    longer than STALL_THRESHOLD are logged to stderr together with the
+    callback that took most of the time, a summary is logged on exit. '''
+
+import gi
+from gi.repository import GLib
+
+import os
+import sys
+import time
+import atexit
+
+
+HEARTBEAT_INTERVAL = 50
+STALL_THRESHOLD = 0.1
+
+enabled = False
+heartbeat_source_id = None
+last_heartbeat_time = None
+
+# (name, duration) for callbacks since the last heartbeat
+recent_runs = list()
+
+callback_stats = dict()
+stall_stats = dict()
+latency_stats = {'heartbeats': 0, 'total': 0.0, 'max': 0.0, 'stalls': 0}
+
+
+def timeout_add(interval, callback, *args, **kwargs):
+    return GLib.timeout_add(interval, monitored(callback, interval), *args, **kwargs)
+
+
+def idle_add(callback, *args, **kwargs):
+    return GLib.idle_add(monitored(callback, None), *args, **kwargs)
+
+
+def source_remove(source_id):
+    return GLib.source_remove(source_id)
+
+
+def monitored(callback, interval):
+    name = getattr(callback, '__qualname__', repr(callback))
+    scheduled_time = [time.perf_counter()]
+
+    def new_callback(*args):
+        if not enabled:
+            # the monitor may be switched on before the next run
+            return_value = callback(*args)
+            scheduled_time[0] = time.perf_counter()
+            return return_value
+
+        start_time = time.perf_counter()
+        dispatch_latency = start_time - scheduled_time[0] - (interval or 0) / 1000
+        return_value = callback(*args)
+        end_time = time.perf_counter()
+
+        # glib schedules the next run of a timeout when it has returned
+        scheduled_time[0] = end_time
+        add_run(name, end_time - start_time, dispatch_latency if interval != None else None)
+        return return_value
+
+    return new_callback
+
+
+def add_run(name, duration, dispatch_latency):
+    try: stats = callback_stats[name]
+    except KeyError:
+        stats = {'calls': 0, 'total': 0.0, 'max': 0.0, 'max_dispatch_latency': 0.0}
+        callback_stats[name] = stats
+    stats['calls'] += 1
+    stats['total'] += duration
+    stats['max'] = max(stats['max'], duration)
+    if dispatch_latency != None:
+        stats['max_dispatch_latency'] = max(stats['max_dispatch_latency'], dispatch_latency)
+    recent_runs.append((name, duration))
+
+
+def on_heartbeat():
+    global last_heartbeat_time
+
+    if not enabled: return False
+
+    now = time.perf_counter()
+    latency = max(now - last_heartbeat_time - HEARTBEAT_INTERVAL / 1000, 0)
+    last_heartbeat_time = now
+    latency_stats['heartbeats'] += 1
+    latency_stats['total'] += latency
+    latency_stats['max'] = max(latency_stats['max'], latency)
+
+    if latency >= STALL_THRESHOLD:
+        latency_stats['stalls'] += 1
+        culprit, duration = get_culprit(latency)
+        try: stall_stats[culprit] += 1
+        except KeyError: stall_stats[culprit] = 1
+        log('main loop stalled for {:.0f} ms, {} ran for {:.0f} ms'.format(latency * 1000, culprit, duration * 1000))
+    del(recent_runs[:])
+    return True
+
+
+def get_culprit(latency):
+    ''' The monitored callback with the longest run since the last
+        heartbeat. If it doesn't explain half the stall, something else
+        (a signal handler, drawing) is to blame. '''
+
+    durations = dict()
+    for name, duration in recent_runs:
+        durations[name] = durations.get(name, 0) + duration
+    if len(durations) > 0:
+        name = max(durations, key=durations.get)
+        if durations[name] >= latency / 2:
+            return (name, durations[name])
+    return ('an unmonitored handler', latency - sum(durations.values()))
+
+
+def set_enabled(value):
+    global enabled, heartbeat_source_id, last_heartbeat_time
+
+    enabled = bool(value)
+    if enabled and heartbeat_source_id == None:
+        last_heartbeat_time = time.perf_counter()
+        heartbeat_source_id = GLib.timeout_add(HEARTBEAT_INTERVAL, on_heartbeat)
+    elif not enabled and heartbeat_source_id != None:
+        GLib.source_remove(heartbeat_source_id)
+        heartbeat_source_id = None
+    del(recent_runs[:])
+
+
+def get_stats():
+    ''' Dispatch latency of the main loop, stalls per culprit and run
+        times of the monitored callbacks (all times in ms). '''
+
+    heartbeats = max(latency_stats['heartbeats'], 1)
+    result = dict()
+    result['latency'] = {'heartbeats': latency_stats['heartbeats'],
+                         'mean_ms': latency_stats['total'] * 1000 / heartbeats,
+                         'max_ms': latency_stats['max'] * 1000,
+                         'stalls': latency_stats['stalls']}
+    result['stalls'] = dict(stall_stats)
+    result['callbacks'] = dict()
+    for name, stats in sorted(callback_stats.items(), key=lambda item: -item[1]['total']):
+        result['callbacks'][name] = {'calls': stats['calls'],
+                                     'total_ms': stats['total'] * 1000,
+                                     'max_ms': stats['max'] * 1000,
+                                     'max_dispatch_latency_ms': stats['max_dispatch_latency'] * 1000}
+    return result
+
+
+def log(message):
+    print('main loop monitor: ' + message, file=sys.stderr)
+
+
+def log_summary():
+    if latency_stats['heartbeats'] == 0: return
+
+    stats = get_stats()
+    log('{heartbeats} heartbeats, latency mean {mean_ms:.1f} ms, max {max_ms:.0f} ms, {stalls} stalls'.format(**stats['latency']))
+    for name, count in sorted(stats['stalls'].items(), key=lambda item: -item[1]):
+        log('  {} stalls: {}'.format(count, name))
+    for name, callback in stats['callbacks'].items():
+        log('  {}: {} calls, {:.0f} ms total, max {:.1f} ms, dispatched up to {:.0f} ms late'.format(name, callback['calls'], callback['total_ms'], callback['max_ms'], callback['max_dispatch_latency_ms']))
+
+
+def is_enabled_in_environment():
+    return os.environ.get('SETZER_MONITOR_MAIN_LOOP', '') not in ['', '0']
+
+
+atexit.register(log_summary)
+
+
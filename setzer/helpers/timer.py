@@ -15,17 +15,147 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
+''' Profiling hooks.
+
+    Functions decorated with @timer record their number of calls and a
+    latency histogram while profiling is enabled, either by setting
+    SETZER_PROFILE in the environment or with the enable_profiling
+    preference. When disabled a decorated function costs one extra call.
+
+    On exit the numbers are written to <prefix>.json, together with
+    <prefix>.folded, self times (µs) per call stack in the collapsed
+    format read by flamegraph.pl and speedscope. The prefix is the value
+    of SETZER_PROFILE, unless that is "1", then it's
+    ~/.cache/setzer/profile-<pid>. '''
+
+import os, os.path
 import time
+import json
+import atexit
+import functools
+import threading
+
+
+# bucket i counts calls taking less than 2**i microseconds
+NUMBER_OF_BUCKETS = 32
+
+enabled = False
+output_prefix = None
+stats = dict()
+folded_stacks = dict()
+thread_data = threading.local()
 
 
 def timer(original_function):
-    
+    name = original_function.__module__ + '.' + original_function.__qualname__
+
+    @functools.wraps(original_function)
     def new_function(*args, **kwargs):
-        start_time = time.time()
-        return_value = original_function(*args, **kwargs)
-        print(original_function.__name__ + ': ' + str(time.time() - start_time) + ' seconds')
-        return return_value
-    
-    return  new_function
+        if not enabled:
+            return original_function(*args, **kwargs)
+
+        try: call_stack = thread_data.call_stack
+        except AttributeError:
+            call_stack = list()
+            thread_data.call_stack = call_stack
+
+        # frames are [name, time spent in callees]
+        frame = [name, 0]
+        call_stack.append(frame)
+        start_time = time.perf_counter()
+        try:
+            return original_function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start_time
+            stack_key = ';'.join(entry[0] for entry in call_stack)
+            call_stack.pop()
+            if len(call_stack) > 0:
+                call_stack[-1][1] += duration
+            add_sample(name, stack_key, duration, duration - frame[1])
+
+    return new_function
+
+
+def add_sample(name, stack_key, duration, self_duration):
+    try: function_stats = stats[name]
+    except KeyError:
+        function_stats = {'calls': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * NUMBER_OF_BUCKETS}
+        stats[name] = function_stats
+    function_stats['calls'] += 1
+    function_stats['total'] += duration
+    if duration > function_stats['max']:
+        function_stats['max'] = duration
+    bucket = min(int(duration * 1000000).bit_length(), NUMBER_OF_BUCKETS - 1)
+    function_stats['histogram'][bucket] += 1
+
+    try: folded_stacks[stack_key] += self_duration
+    except KeyError: folded_stacks[stack_key] = self_duration
+
+
+def set_enabled(value):
+    global enabled
+
+    enabled = bool(value)
+
+
+def reset():
+    stats.clear()
+    folded_stacks.clear()
+
+
+def get_stats():
+    ''' Per function call counts, times (ms) and histograms, slowest first. '''
+
+    result = dict()
+    for name, function_stats in sorted(stats.items(), key=lambda item: -item[1]['total']):
+        histogram = dict()
+        for bucket, count in enumerate(function_stats['histogram']):
+            if count > 0:
+                histogram['<' + str(2 ** bucket) + 'us'] = count
+        result[name] = {'calls': function_stats['calls'],
+                        'total_ms': function_stats['total'] * 1000,
+                        'mean_ms': function_stats['total'] * 1000 / function_stats['calls'],
+                        'max_ms': function_stats['max'] * 1000,
+                        'histogram': histogram}
+    return result
+
+
+def get_output_prefix():
+    if output_prefix != None:
+        return output_prefix
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'setzer', 'profile-' + str(os.getpid()))
+
+
+def dump(prefix=None):
+    if len(stats) == 0: return
+    if prefix == None:
+        prefix = get_output_prefix()
+
+    dirname = os.path.dirname(prefix)
+    try:
+        if dirname != '' and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(prefix + '.json', 'w') as filehandle:
+            json.dump({'functions': get_stats()}, filehandle, indent=2)
+        with open(prefix + '.folded', 'w') as filehandle:
+            for stack_key, self_duration in sorted(folded_stacks.items()):
+                filehandle.write(stack_key + ' ' + str(max(int(self_duration * 1000000), 0)) + '\n')
+    except OSError:
+        pass
+
+
+def init_from_environment():
+    global output_prefix
+
+    value = os.environ.get('SETZER_PROFILE', '')
+    if value != '' and value != '0':
+        if value != '1':
+            output_prefix = value
+        set_enabled(True)
+
+
+init_from_environment()
+atexit.register(dump)
 
 
@@ -58,7 +58,7 @@ class BuildLogPresenter(object):
     def on_hover_item_changed(self, build_log):
         self.view.list.queue_draw()
 
-    #@timer
+    @timer
     def draw(self, drawing_area, ctx):
         update_size = False
 
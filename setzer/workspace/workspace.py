@@ -129,6 +129,7 @@ class Workspace(Observable):
         self.open_documents.remove(document)
         if document.is_latex_document():
             self.open_latex_documents.remove(document)
+            ServiceLocator.get_synctex_reader().evict([open_document.get_filename() for open_document in self.open_latex_documents])
         if self.active_document == document:
             candidate = self.get_last_active_document()
             if candidate == None: